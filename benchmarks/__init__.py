@@ -0,0 +1,9 @@
+"""
+Benchmarks of the matching on synthetic profiles.
+
+Run them with
+
+    python3 -m benchmarks.run --profiles 10000 --output results.json
+
+to get the throughput and the peak memory of each stage as json.
+"""
@@ -0,0 +1,274 @@
+"""
+Checks of the behaviour of the matching against local stand-ins of the
+external services, which can be run without network access with
+
+    python3 -m benchmarks.check
+
+Each check raises a CheckError if the behaviour is not the expected one,
+and the script exits with status 1 if any check failed.
+"""
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import requests
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from matching.corpus import Corpus
+from matching.live import LiveQuery
+from matching.lsh import LSHIndex
+from matching.matcher import match
+from matching.parsing import parser
+from matching.parsing.loader import get_profiles_by_dir, get_profile_by_file, \
+    get_profile_filenames
+from matching.server import MatchingService
+from .generator import ProfileGenerator
+from .mock_api import MockWikipediaAPI
+
+
+class CheckError(Exception):
+    """
+    Raised when a check fails.
+    """
+
+
+def _expect(condition, message, *args):
+    if not condition:
+        raise CheckError(message % args)
+
+
+def _translate_with(api, lang, topics):
+    api_url = parser.API_URL
+    parser.API_URL = api.url
+    try:
+        return parser.translate_topics(lang, topics)
+    finally:
+        parser.API_URL = api_url
+
+
+def check_translation_parts():
+    """
+    Check that the translations split in more parts of the answer are
+    all requested, and that a part without the langlinks of a topic does
+    not replace its translation.
+    """
+    topics = ['Sport_%d' % i for i in range(7)]
+    with MockWikipediaAPI(latency=0, part_size=2) as api:
+        translations = _translate_with(api, 'it', topics)
+    _expect(api.requests == 4, "4 requests expected, %d sent", api.requests)
+    for topic in topics:
+        expected = api.get_translation('Category:' + topic)
+        expected = parser.normalize_topic_string(expected) \
+            if expected is not None else topic
+        _expect(translations.get(('it', topic)) == expected,
+                "%s translated to %r instead of %r", topic,
+                translations.get(('it', topic)), expected)
+
+
+def check_translation_retries():
+    """
+    Check that the requests failed with a transient error are retried,
+    and that an error is raised when the retries are exhausted.
+    """
+    topics = ['Calcio', 'Tennis', 'Nuoto']
+    with MockWikipediaAPI(latency=0, failures=2) as api:
+        translations = _translate_with(api, 'it', topics)
+    _expect(api.requests == 3, "3 requests expected, %d sent", api.requests)
+    _expect(len(translations) == len(topics),
+            "%d topics translated instead of %d", len(translations),
+            len(topics))
+
+    with MockWikipediaAPI(latency=0, failures=parser.RETRIES + 1) as api:
+        try:
+            _translate_with(api, 'it', topics)
+        except requests.exceptions.RequestException:
+            pass
+        else:
+            raise CheckError("no error raised after %d failures"
+                             % api.requests)
+    _expect(api.requests == parser.RETRIES + 1,
+            "%d requests expected, %d sent", parser.RETRIES + 1,
+            api.requests)
+
+
+def check_lsh_recall(cmp_profiles_dir='tapoi_models',
+                     profiles_dir='sample_profiles', bands=1024, rows=1):
+    """
+    Check that the most similar cmp_profiles of each sample profile are
+    among its LSH candidates, and that a profile without discussed
+    topics is never a candidate.
+
+    The sample profiles share only a few percent of their discussions
+    with the cmp_profiles, so the signatures need many bands to find
+    them.
+    """
+    ids, profiles = get_profiles_by_dir(cmp_profiles_dir)
+    corpus = Corpus.from_profiles(profiles, ids)
+    # the last profile of the index has no discussed topics
+    empty = len(corpus)
+    lsh = LSHIndex(corpus.profiles + [{}], bands, rows)
+    _expect(not lsh.get_candidates({}),
+            "a profile without discussed topics has candidates")
+    for filename in sorted(os.listdir(profiles_dir)):
+        _, profile = get_profile_by_file(os.path.join(profiles_dir,
+                                                      filename))
+        prepared = parser.get_parsed_profile(profile)
+        parser.values_to_percentage(prepared)
+        candidates = set(lsh.get_candidates(prepared))
+        _expect(empty not in candidates,
+                "the profile without discussed topics is a candidate of %s",
+                filename)
+        for best_match, _ in match(profile, corpus):
+            if best_match is None:
+                continue
+            _expect(corpus.ids.index(best_match) in candidates,
+                    "%s is not a candidate of %s", best_match, filename)
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def check_server_reload(cmp_profiles_dir='tapoi_models'):
+    """
+    Check that the files which are not valid profiles do not stop the
+    reloads of the matching service, and that the changes made after
+    them are still loaded.
+    """
+    work_dir = tempfile.mkdtemp()
+    try:
+        for filename in get_profile_filenames(cmp_profiles_dir):
+            shutil.copy(os.path.join(cmp_profiles_dir, filename), work_dir)
+        service = MatchingService(work_dir)
+        thread = service.watch(0.05)
+        try:
+            profiles = len(service.corpus)
+            bad_profiles = {'empty.json': {}, 'zero.json': {'Sport': 0},
+                            'list.json': [1, 2], 'broken.json': None}
+            for filename, content in bad_profiles.items():
+                with open(os.path.join(work_dir, filename), 'w') as f:
+                    if content is None:
+                        f.write('{"Sport":')
+                    else:
+                        json.dump(content, f)
+            _expect(_wait_for(lambda: set(service.status()['invalid']) ==
+                              set(bad_profiles)),
+                    "invalid files reported: %s",
+                    sorted(service.status()['invalid']))
+            version = service.version
+            with open(os.path.join(work_dir, 'new.json'), 'w') as f:
+                json.dump({'http://it.wikipedia.org/wiki/Categoria:Sport':
+                           3}, f)
+            _expect(_wait_for(lambda: service.version > version),
+                    "version %d not increased after a valid change",
+                    service.version)
+            _expect(thread.is_alive(), "the reload thread stopped")
+            _expect(len(service.corpus) == profiles + 1,
+                    "%d profiles loaded instead of %d",
+                    len(service.corpus), profiles + 1)
+            _expect(service.reload_error is None, "reload failed: %s",
+                    service.reload_error)
+        finally:
+            service.stop()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def check_live_updates(profiles=200, updates=150, seed=0):
+    """
+    Check that the results of a LiveQuery after random updates, which
+    move, add and remove discussions and topics, are the same of a
+    matching from scratch of its counts, even when some updates are not
+    followed by a read.
+    """
+    generator = ProfileGenerator(seed, topics=2000)
+    corpus = Corpus.from_parsed(
+        parser.get_parsed_profiles(generator.profiles(profiles)))
+    rng = random.Random(seed)
+    topics = list({topic for profile in generator.profiles(20)
+                   for topic in profile})
+    removed = []
+    live_query = LiveQuery(generator.profile(), corpus)
+    for n in range(updates):
+        present = list(live_query.counts)
+        deltas = {}
+        for _ in range(rng.randint(1, 3)):
+            kind = rng.random()
+            topic = rng.choice(present)
+            if kind < 0.4:
+                deltas[topic] = rng.choice((-1, 1))
+            elif kind < 0.6:
+                deltas[rng.choice(topics)] = rng.randint(1, 3)
+            elif kind < 0.8 and removed:
+                # a removed topic discussed again
+                deltas[removed.pop()] = 1
+            elif len(present) > 1:
+                deltas[topic] = -live_query.counts[topic]
+                removed.append(topic)
+        try:
+            live_query.update(deltas)
+        except ValueError:
+            continue
+        if n % 3 == 2:
+            # the updates are applied together at the next read
+            continue
+        expected = match(dict(live_query.counts), corpus)
+        _expect(live_query.results() == expected,
+                "the results after update %d are not the ones of match", n)
+
+
+CHECKS = {
+    'translation_parts': check_translation_parts,
+    'translation_retries': check_translation_retries,
+    'lsh_recall': check_lsh_recall,
+    'server_reload': check_server_reload,
+    'live_updates': check_live_updates,
+}
+
+
+def run_checks(only=None):
+    """
+    Run the checks.
+
+    Args:
+        only (optional): list with the names of the checks to run. By
+            default all are run
+
+    Returns:
+        a dictionary where the name of each failed check is associated
+        with its error message
+    """
+    failures = {}
+    for name, check in CHECKS.items():
+        if only is not None and name not in only:
+            continue
+        start = time.perf_counter()
+        try:
+            check()
+        except CheckError as ex:
+            failures[name] = str(ex)
+        print('%-20s %-6s %8.3f s' % (
+            name, 'FAILED' if name in failures else 'ok',
+            time.perf_counter() - start), file=sys.stderr)
+    return failures
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(description="""
+        Runs the checks of the matching against local stand-ins of the
+        external services.
+        """, formatter_class=ArgumentDefaultsHelpFormatter)
+    ap.add_argument('--only', nargs='+', choices=list(CHECKS),
+                    default=None, help="names of the checks to run")
+    args = ap.parse_args()
+    failures = run_checks(args.only)
+    for name, message in failures.items():
+        print("%s: %s" % (name, message), file=sys.stderr)
+    sys.exit(1 if failures else 0)
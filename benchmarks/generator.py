@@ -0,0 +1,114 @@
+"""
+Contains a seeded generator of synthetic profiles.
+
+Topics are urls of Wikipedia categories in different languages, and
+their popularity follows a Zipf law, so that few topics are discussed by
+many profiles and most topics by few ones, as in real profiles. The size
+of profiles follows a log-normal distribution.
+"""
+import itertools
+import json
+import math
+import os
+import random
+import urllib.parse
+
+# share of the topics in each language
+LANGUAGES = {'en': 0.7, 'it': 0.1, 'de': 0.08, 'fr': 0.07, 'es': 0.05}
+_SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'ßa',
+              'è', 'ño', 'ü']
+
+
+class ProfileGenerator:
+    """
+    Generator of synthetic profiles.
+
+    Attributes:
+        urls: the urls of all the topics, from the most popular
+        median_size: the median number of topics of a profile
+    """
+
+    def __init__(self, seed=0, topics=100000, zipf_exponent=1.1,
+                 median_size=150, size_sigma=1.0):
+        """
+        Create the topics.
+
+        Args:
+            seed (optional): the seed of the random generator
+            topics (optional): the number of distinct topics
+            zipf_exponent (optional): the exponent of the Zipf law of
+                the popularity of topics
+            median_size (optional): the median number of topics of a
+                profile
+            size_sigma (optional): the sigma of the log-normal
+                distribution of the sizes of profiles
+        """
+        self._random = random.Random(seed)
+        self.median_size = median_size
+        self._size_sigma = size_sigma
+        langs = list(LANGUAGES)
+        weights = [LANGUAGES[lang] for lang in langs]
+        self.urls = []
+        for rank in range(topics):
+            lang = self._random.choices(langs, weights)[0]
+            name = '_'.join(''.join(self._random.choices(_SYLLABLES, k=3))
+                            for _ in range(self._random.randint(1, 4)))
+            name = '%s_%d' % (name.capitalize(), rank)
+            self.urls.append('http://%s.wikipedia.org/wiki/Category:%s' % (
+                lang, urllib.parse.quote(name)))
+        self._cum_weights = list(itertools.accumulate(
+            1 / (rank ** zipf_exponent) for rank in range(1, topics + 1)))
+
+    def profile(self):
+        """
+        Generate a profile.
+
+        Returns:
+            a profile where each topic url is associated with the number
+            of times it has been discussed
+        """
+        size = max(1, int(self._random.lognormvariate(
+            math.log(self.median_size), self._size_sigma)))
+        size = min(size, len(self.urls) // 2)
+        profile = {}
+        while len(profile) < size:
+            for url in self._random.choices(
+                    self.urls, cum_weights=self._cum_weights,
+                    k=size - len(profile)):
+                # discussions per topic decrease geometrically
+                profile[url] = 1 + int(self._random.expovariate(0.5))
+        return profile
+
+    def profiles(self, n):
+        """
+        Generate some profiles.
+
+        Args:
+            n: the number of profiles
+
+        Returns:
+            a list with n profiles
+        """
+        return [self.profile() for _ in range(n)]
+
+
+def write_profiles(profiles, profiles_dir):
+    """
+    Write profiles as json files in a directory.
+
+    Args:
+        profiles: list of profiles
+        profiles_dir: the directory, created if it does not exist
+
+    Returns:
+        the list of the ids of the profiles, i.e. the file names without
+        extension
+    """
+    os.makedirs(profiles_dir, exist_ok=True)
+    ids = []
+    for i, profile in enumerate(profiles):
+        profile_id = 'profile_%07d' % i
+        with open(os.path.join(profiles_dir, profile_id + '.json'), 'w') as f:
+            json.dump(profile, f)
+        ids.append(profile_id)
+    return ids
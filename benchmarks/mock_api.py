@@ -0,0 +1,120 @@
+"""
+Contains a local stand-in of the Wikipedia API, which answers to the
+langlinks queries done by the translation of topics.
+
+Like the real API, it can split the langlinks of a query in more parts,
+each one requested with the 'continue' parameters of the previous
+answer, and it can fail the first requests with a transient error, so
+that the retries are exercised.
+"""
+import json
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        api = self.server.api
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        titles = query['titles'][0].split('|')
+        with api.lock:
+            api.requests += 1
+            api.titles += len(titles)
+            failed = api.failures > 0
+            if failed:
+                api.failures -= 1
+        if api.latency:
+            time.sleep(api.latency)
+        if failed:
+            self._answer(503, {'error': 'service unavailable'})
+            return
+        # the langlinks of the titles from start to end are in this part
+        start = int(query.get('llcontinue', ['0'])[0])
+        end = len(titles)
+        if api.part_size:
+            end = min(start + api.part_size, end)
+        pages = {}
+        for i, title in enumerate(titles):
+            page = {'title': title.replace('_', ' ')}
+            translation = api.get_translation(title)
+            if start <= i < end and translation is not None:
+                page['langlinks'] = [{'lang': 'en', '*': translation}]
+            pages[str(-i - 1)] = page
+        answer = {'query': {'pages': pages}}
+        if end < len(titles):
+            answer['continue'] = {'llcontinue': str(end), 'continue': '||'}
+        self._answer(200, answer)
+
+    def _answer(self, status, answer):
+        body = json.dumps(answer).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockWikipediaAPI:
+    """
+    A local HTTP server answering like the Wikipedia API.
+
+    Attributes:
+        url: the url template of the API, to be used as
+            parsing.parser.API_URL
+        latency: seconds waited before each answer
+        translated_percentage: percentage of topics with a translation
+        part_size: if not None, the number of titles whose langlinks
+            are in each part of an answer
+        failures: number of the next requests which are answered with
+            the status 503
+        requests: number of requests received, including the failed ones
+        titles: number of titles requested
+    """
+
+    def __init__(self, latency=0.05, translated_percentage=60,
+                 part_size=None, failures=0):
+        self.latency = latency
+        self.translated_percentage = translated_percentage
+        self.part_size = part_size
+        self.failures = failures
+        self.requests = 0
+        self.titles = 0
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self.url = 'http://127.0.0.1:%d/{lang}/w/api.php' % \
+            self._server.server_address[1]
+
+    def get_translation(self, title):
+        """
+        Get the English title of a category.
+
+        Args:
+            title: the title of the category, with its 'Category:'
+                prefix
+
+        Returns:
+            the English title, or None if the category is not translated
+        """
+        # a deterministic share of the topics has a translation
+        if zlib.crc32(title.encode()) % 100 < self.translated_percentage:
+            return 'Category:EN ' + title.split(':')[1]
+        return None
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,373 @@
+"""
+Runs the benchmarks of the matching on synthetic profiles and prints
+the results as json.
+
+For each stage it reports the time, the throughput and the peak memory
+allocated while running it (measured with tracemalloc in a second run,
+so that tracing does not affect the time).
+"""
+import copy
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from matching import algorithm1, algorithm2
+from matching.allpairs import match_all_pairs
+from matching.corpus import Corpus
+from matching.live import LiveQuery
+from matching.lsh import LSHIndex, BANDS, ROWS
+from matching.matcher import match, match_top_k
+from matching.parallel import ParallelMatcher
+from matching.parsing import parser
+from matching.parsing.loader import get_profiles_by_dir
+from matching.quantized import STORAGES, QuantizedCorpus, \
+    get_accuracy_report
+from matching.stream import CHUNK_SIZE, match_stream
+from matching.vectorized import HAS_NUMPY
+from .generator import ProfileGenerator, write_profiles
+from .mock_api import MockWikipediaAPI
+
+
+def measure(name, setup, run, items, memory=True):
+    """
+    Measure a stage.
+
+    Args:
+        name: the name of the stage
+        setup: function without arguments which returns the input of
+            run. It is not measured
+        run: function which takes the input returned by setup
+        items: the number of items processed by run, used for the
+            throughput
+        memory (optional): if set to True, the peak memory is measured
+            in a second run
+
+    Returns:
+        a dictionary with the results of the stage
+    """
+    data = setup()
+    start = time.perf_counter()
+    run(data)
+    seconds = time.perf_counter() - start
+    result = {'name': name, 'items': items, 'seconds': seconds,
+              'items_per_second': items / seconds if seconds else None}
+    if memory:
+        data = setup()
+        tracemalloc.start()
+        run(data)
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print('%-20s %10.3f s %14.1f items/s' % (
+        name, seconds, result['items_per_second'] or 0), file=sys.stderr)
+    return result
+
+
+def get_retained_memory(build):
+    """
+    Measure the memory of the objects built by a function.
+
+    Args:
+        build: the function, without arguments
+
+    Returns:
+        the bytes allocated by the function and not released when it
+        returns, while its result is alive
+    """
+    tracemalloc.start()
+    result = build()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return retained
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_recall(exact, approximate):
+    """
+    Compute the share of the most similar profiles found by an
+    approximate matching.
+
+    Args:
+        exact: list with the results of match_top_k for each query
+        approximate: list with the results of the approximate
+            match_top_k for the same queries
+
+    Returns:
+        the share of the profiles in the exact results of both the
+        algorithms which are also in the approximate results, or None
+        if the exact results are empty
+    """
+    found = total = 0
+    for exact_results, approximate_results in zip(exact, approximate):
+        for exact_top, approximate_top in zip(exact_results,
+                                              approximate_results):
+            ids = {i for i, _ in exact_top}
+            found += len(ids & {i for i, _ in approximate_top})
+            total += len(ids)
+    return found / total if total else None
+
+
+def run_benchmarks(profiles=2000, queries=20, topics=100000, seed=0,
+                   translate_profiles=200, latency=0.05, memory=True,
+                   only=None, lsh_bands=BANDS, lsh_rows=ROWS):
+    """
+    Run the benchmarks.
+
+    Args:
+        profiles (optional): the number of cmp_profiles
+        queries (optional): the number of profiles matched against them
+        topics (optional): the number of distinct topics
+        seed (optional): the seed of the generator
+        translate_profiles (optional): the number of profiles translated
+            with the mock API
+        latency (optional): seconds waited by the mock API before each
+            answer
+        memory (optional): if set to True, the peak memory of each
+            stage is measured
+        only (optional): list with the names of the stages to run. By
+            default all are run
+        lsh_bands (optional): the number of bands of the LSHIndex
+        lsh_rows (optional): the number of rows of each band of the
+            LSHIndex
+
+    Returns:
+        a dictionary with the parameters and the results of each stage
+    """
+    generator = ProfileGenerator(seed, topics)
+    raw_profiles = generator.profiles(profiles)
+    raw_queries = generator.profiles(queries)
+    results = []
+
+    def stage(name, setup, run, items):
+        if only is None or name in only:
+            results.append(measure(name, setup, run, items, memory))
+
+    with tempfile.TemporaryDirectory() as profiles_dir:
+        write_profiles(raw_profiles, profiles_dir)
+        stage('load', lambda: profiles_dir, get_profiles_by_dir, profiles)
+        # each query reads and parses all the profiles again, so only
+        # the first one is streamed
+        stage('match_stream', lambda: raw_queries[:1],
+              lambda qs: [match_stream(q, profiles_dir, 10, CHUNK_SIZE)
+                          for q in qs], profiles)
+
+    stage('parse', lambda: raw_profiles,
+          parser.get_parsed_profiles, profiles)
+    parsed = parser.get_parsed_profiles(raw_profiles)
+
+    def normalize(profiles):
+        for profile in profiles:
+            parser.values_to_percentage(profile)
+    stage('normalize', lambda: copy.deepcopy(parsed), normalize, profiles)
+    stage('corpus', lambda: copy.deepcopy(parsed), Corpus.from_parsed,
+          profiles)
+
+    corpus = Corpus.from_parsed(copy.deepcopy(parsed))
+    corpus.index
+    prepared = parser.get_parsed_profiles(raw_queries)
+    for profile in prepared:
+        parser.values_to_percentage(profile)
+    pairs = profiles * queries
+
+    stage('algorithm1', lambda: prepared,
+          lambda qs: [algorithm1.match(q, corpus.profiles) for q in qs],
+          pairs)
+    stage('algorithm1_index', lambda: prepared,
+          lambda qs: [algorithm1.match_index(q, corpus.index) for q in qs],
+          pairs)
+    stage('algorithm2', lambda: prepared,
+          lambda qs: [algorithm2.match(q, corpus.profiles) for q in qs],
+          pairs)
+    stage('algorithm2_cached', lambda: prepared,
+          lambda qs: [algorithm2.match(q, corpus.profiles, corpus.rankings)
+                      for q in qs], pairs)
+    stage('match', lambda: raw_queries,
+          lambda qs: [match(q, corpus) for q in qs], pairs)
+    if HAS_NUMPY:
+        corpus.sparse
+        stage('match_numpy', lambda: raw_queries,
+              lambda qs: [match(q, corpus, engine='numpy') for q in qs],
+              pairs)
+    stage('match_top_k', lambda: raw_queries,
+          lambda qs: [match_top_k(q, corpus, 10) for q in qs], pairs)
+
+    # each query receives updates which move a discussion between two of
+    # its least discussed topics (the total does not change) or add a
+    # discussion, which changes all the percentages, and its best
+    # matches are read after each update
+    def live_setup():
+        return [LiveQuery(q, corpus) for q in raw_queries]
+
+    def live_updates(moves):
+        def run(live_queries):
+            for live_query, q in zip(live_queries, raw_queries):
+                urls = sorted(q, key=q.get)[:2]
+                for _ in range(5):
+                    if moves:
+                        live_query.update({urls[0]: -1, urls[1]: 1})
+                        live_query.best_matches
+                        live_query.update({urls[0]: 1, urls[1]: -1})
+                        live_query.best_matches
+                    else:
+                        live_query.update({urls[0]: 1})
+                        live_query.best_matches
+                        live_query.update({urls[1]: 1})
+                        live_query.best_matches
+        return run
+    stage('live_update_move', live_setup, live_updates(True), queries * 10)
+    stage('live_update_add', live_setup, live_updates(False), queries * 10)
+    # the seconds of an update against the ones of a match from scratch
+    seconds = {result['name']: result['seconds'] / result['items']
+               for result in results}
+    live_report = None
+    if 'match' in seconds:
+        seconds_per_match = seconds['match'] * profiles
+        live_report = {'match_seconds': seconds_per_match}
+        for name in ('live_update_move', 'live_update_add'):
+            if name in seconds:
+                live_report[name + '_seconds'] = seconds[name]
+                live_report[name + '_per_match'] = \
+                    seconds[name] / seconds_per_match
+
+    if only is None or 'match_parallel' in only:
+        with ParallelMatcher(corpus) as parallel_matcher:
+            stage('match_parallel', lambda: raw_queries,
+                  lambda qs: [parallel_matcher.match(q) for q in qs], pairs)
+
+    # the work grows with the square of the profiles, so only a part of
+    # the corpus is compared with itself
+    if only is None or 'all_pairs' in only:
+        subset = Corpus.from_parsed(copy.deepcopy(parsed[:profiles // 4]))
+        with tempfile.TemporaryDirectory() as output_dir:
+            output = os.path.join(output_dir, 'all_pairs.jsonl')
+            stage('all_pairs', lambda: subset,
+                  lambda c: match_all_pairs(c, output, 10), len(subset) ** 2)
+
+    lsh_report = None
+    lsh_stages = ('lsh_build', 'lsh_match', 'lsh_match_top_k')
+    if only is None or any(name in only for name in lsh_stages):
+        stage('lsh_build', lambda: corpus.profiles,
+              lambda ps: LSHIndex(ps, lsh_bands, lsh_rows), profiles)
+        lsh = LSHIndex(corpus.profiles, lsh_bands, lsh_rows)
+        stage('lsh_match', lambda: raw_queries,
+              lambda qs: [match(q, corpus, lsh=lsh) for q in qs], pairs)
+        stage('lsh_match_top_k', lambda: raw_queries,
+              lambda qs: [match_top_k(q, corpus, 10, lsh=lsh) for q in qs],
+              pairs)
+        # the recall of the 10 most similar profiles against the
+        # exhaustive matching
+        lsh_report = {
+            'bands': lsh_bands, 'rows': lsh_rows,
+            'candidates': sum(len(lsh.get_candidates(q)) for q in prepared)
+            / (pairs or 1),
+            'recall_at_10': get_recall(
+                [match_top_k(q, corpus, 10) for q in raw_queries],
+                [match_top_k(q, corpus, 10, lsh=lsh) for q in raw_queries]),
+        }
+
+    # the quantized corpora, with their index, against the exact one.
+    # The topic names are shared, so they are not in the memory of any
+    quantization_report = None
+    quantize_stages = [prefix + storage for storage in STORAGES
+                       for prefix in ('quantize_', 'match_')]
+    if only is None or any(name in only for name in quantize_stages):
+        def build_exact():
+            exact = Corpus.from_parsed(copy.deepcopy(parsed))
+            exact.index
+            return exact
+        quantization_report = {'exact_memory_bytes':
+                               get_retained_memory(build_exact)
+                               if memory else None}
+        for storage in STORAGES:
+            stage('quantize_' + storage, lambda: corpus,
+                  lambda c: QuantizedCorpus(c, storage), profiles)
+            quantized = QuantizedCorpus(corpus, storage)
+            stage('match_' + storage, lambda: raw_queries,
+                  lambda qs: [match(q, quantized) for q in qs], pairs)
+            report = get_accuracy_report(raw_queries, corpus, quantized, 10)
+            report['memory_bytes'] = get_retained_memory(
+                lambda: QuantizedCorpus(corpus, storage)) if memory else None
+            quantization_report[storage] = report
+
+    api = None
+    if only is None or 'translation' in only:
+        to_translate = raw_profiles[:translate_profiles]
+        with MockWikipediaAPI(latency) as api:
+            api_url = parser.API_URL
+            parser.API_URL = api.url
+            try:
+                stage('translation', lambda: to_translate,
+                      lambda ps: parser.get_parsed_profiles(ps, True),
+                      len(to_translate))
+            finally:
+                parser.API_URL = api_url
+
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': HAS_NUMPY,
+        'cpus': os.cpu_count(),
+        'params': {'profiles': profiles, 'queries': queries,
+                   'topics': topics, 'seed': seed,
+                   'translate_profiles': translate_profiles,
+                   'latency': latency},
+        'translation_requests': api.requests if api else None,
+        'live': live_report,
+        'lsh': lsh_report,
+        'quantization': quantization_report,
+        'results': results,
+    }
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(description="""
+        Runs the benchmarks of the matching on synthetic profiles and 
+        prints the results as json.
+        """, formatter_class=ArgumentDefaultsHelpFormatter)
+    ap.add_argument('--profiles', type=int, default=2000,
+                    help="number of cmp_profiles")
+    ap.add_argument('--queries', type=int, default=20,
+                    help="number of profiles matched")
+    ap.add_argument('--topics', type=int, default=100000,
+                    help="number of distinct topics")
+    ap.add_argument('--seed', type=int, default=0,
+                    help="seed of the generator")
+    ap.add_argument('--translate_profiles', type=int, default=200,
+                    help="number of profiles translated with the mock API")
+    ap.add_argument('--latency', type=float, default=0.05,
+                    help="seconds waited by the mock API for each request")
+    ap.add_argument('--no_memory', action='store_true',
+                    help="do not measure the peak memory")
+    ap.add_argument('--only', nargs='+', default=None,
+                    help="names of the stages to run")
+    ap.add_argument('--lsh_bands', type=int, default=BANDS,
+                    help="number of bands of the LSH pre-filter")
+    ap.add_argument('--lsh_rows', type=int, default=ROWS,
+                    help="number of rows of each band of the LSH pre-filter")
+    ap.add_argument('--output', type=str, default=None,
+                    help="json file where results are written, instead of "
+                    "the standard output")
+    args = ap.parse_args()
+
+    report = run_benchmarks(args.profiles, args.queries, args.topics,
+                            args.seed, args.translate_profiles, args.latency,
+                            not args.no_memory, args.only, args.lsh_bands,
+                            args.lsh_rows)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -6,101 +6,457 @@ It calls the API functions to do the matching and prints their result.
 It offers also the possibility to translate the topics from foreign 
 languages to English when possible by setting a flag.
 """
-import os
 import json
+import sys
 import requests
-from matching.matcher import match
+from matching.matcher import match, match_iter, match_iter_top_k, \
+    match_top_k, ENGINES
+from matching.corpus import Corpus, compile_corpus, load_corpus, \
+    iter_prepared_profiles
+from matching.server import MatchingService, serve
+from matching.result_cache import ResultCache
+from matching.columnar import MappedCorpus, write_columnar
+from matching.quantized import STORAGES, QuantizedCorpus, \
+    get_accuracy_report
+from matching.lsh import LSHIndex, ROWS
+from matching.scorers import ALGORITHMS, get_scorer, get_scorer_names
+from matching.parallel import ParallelMatcher
+from matching.shard import ShardCluster, ShardedMatcher, ShardError, \
+    ShardTimeoutError
+from matching.batch import iter_query_profiles, match_batch
+from matching.stream import CHUNK_SIZE, match_stream
+from matching.allpairs import BLOCK_SIZE, match_all_pairs
+from matching.parsing.parser import set_translation_cache
+from matching.parsing.cache import TranslationCache
+from matching.stats import enable_stats, get_stats
+from matching.parsing.loader import get_profile_by_file, \
+    get_profiles_by_dir
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
 
-def path_to_id(profile_path):
+def print_results(cmp_ids, results, algorithms=ALGORITHMS):
     """
-    Convert the profile path to an id. 
+    Print the results of the matching.
 
     Args:
-        profile_path: the path of the file containing the profile
+        cmp_ids: the ids of the existing profiles
+        results: the results of the matching, as returned by 
+            matcher.match
+        algorithms (optional): the names of the algorithms of the 
+            results
+    """
+    for name, (id, match_values) in zip(algorithms, results):
+        print(get_scorer(name).title)
+        for j in range(len(match_values)):
+            print("Similarity with %s: %f" % (cmp_ids[j], match_values[j]))
+        print("Most similar: %s\n" % id)
+
 
-    Returns:
-        the file name without the '.json' extension
+def print_top_k(results, algorithms=ALGORITHMS):
     """
-    return profile_path.rstrip('.json').split('/')[-1]
+    Print the most similar profiles found by each algorithm.
 
-# throws
+    Args:
+        results: the results of the matching, as returned by 
+            matcher.match_top_k
+        algorithms (optional): the names of the algorithms of the 
+            results
+    """
+    for name, top_matches in zip(algorithms, results):
+        print(get_scorer(name).title)
+        for id, match_value in top_matches:
+            print("Similarity with %s: %f" % (id, match_value))
+        print()
 
 
-def get_profile_by_file(profile_path):
+def print_accuracy_report(report, algorithms=ALGORITHMS):
     """
-    Read the profile from the given file.
+    Print the accuracy of the matching with a quantized storage.
+
+    Args:
+        report: the report, as returned by quantized.get_accuracy_report
+        algorithms (optional): the names of the algorithms of the report
+    """
+    print("Accuracy of the %s storage" % report['storage'])
+    for name in algorithms:
+        accuracy = report[name]
+        print("%s: top-1 agreement %s, top-k agreement %s, max error %g "
+              "(%g of the highest value)" % (
+                  get_scorer(name).title, accuracy['top1_agreement'],
+                  accuracy['top_k_agreement'], accuracy['max_error'],
+                  accuracy['max_relative_error']))
+    print()
 
-    A valid profile contains a dictionary where keys are topic names 
-    (in the form of urls of Wikipedia categories) and values are the 
-    number of times the profile has spoken about the respective topic.
+
+def main(profile_path, cmp_profiles_dir, translate, snapshot_path=None,
+         engine='python', top_k=None, processes=None, lsh_bands=None,
+         lsh_rows=ROWS, algorithms=ALGORITHMS, columnar_path=None,
+         score_processes=None, quantize=None, accuracy_report=False,
+         compact=False):
+    """
+    Print the id of the most similar profile to the given one among the 
+    ones to compare it with.
+
+    Some algorithms, by default both, are used to find the most similar 
+    profile, and the ids returned by each of them are printed. For each 
+    algorithm the evaluated similarity values with each profile are also 
+    printed.
 
     Args:
-        profile_path: path to a json file containing a profile
+        profile_path: the path of the profile to compare with the 
+            existing ones (json)
+        cmp_profiles_dir: the dir containing the existing profiles 
+            (json)
+        translate (bool): if set to True, the topics in foreign 
+            languages are translated to English when possible
+        snapshot_path (optional): if given, the existing profiles are 
+            loaded from the compiled snapshot at this path, which is 
+            rebuilt if the profiles in cmp_profiles_dir changed
+        engine (optional): the engine used to compute the similarity 
+            values, one of ENGINES
+        top_k (optional): if given, only the top_k most similar 
+            profiles are printed for each algorithm, with their 
+            similarity values
+        processes (optional): if given, the existing profiles are read 
+            and parsed from cmp_profiles_dir by this number of worker 
+            processes, while the ones already parsed are compared with 
+            the python engine. snapshot_path, columnar_path, quantize, 
+            lsh_bands and score_processes are not used
+        lsh_bands (optional): if given, the existing profiles are 
+            pre-filtered with an LSHIndex with this number of bands, and 
+            only the candidates are compared
+        lsh_rows (optional): the number of rows of each band of the 
+            LSHIndex
+        algorithms (optional): the names of the algorithms to run
+        columnar_path (optional): if given, the existing profiles are 
+            read in place from the columnar file at this path
+        score_processes (optional): if given, the existing profiles are 
+            split among this number of worker processes, which compare 
+            them with the profile in parallel
+        quantize (optional): if given, the values of the existing 
+            profiles are stored with this storage, one of 
+            quantized.STORAGES
+        accuracy_report (optional): if set to True with quantize, the 
+            accuracy of the quantized storage for the profile is printed
+        compact (optional): if set to True, the existing profiles are 
+            kept as Profiles, which take less memory (see 
+            Corpus.compact)
+    """
+    try:
+        _, profile = get_profile_by_file(profile_path)
+        if processes:
+            entries = iter_prepared_profiles(cmp_profiles_dir, translate,
+                                             processes)
+            if top_k is not None:
+                print_top_k(match_iter_top_k(
+                    profile, entries, top_k, translate, algorithms),
+                    algorithms)
+            else:
+                cmp_ids, results = match_iter(profile, entries, translate,
+                                              algorithms)
+                print_results(cmp_ids, results, algorithms)
+            return
+        if columnar_path:
+            cmp_profiles = MappedCorpus(columnar_path)
+            cmp_ids = cmp_profiles.ids
+        elif snapshot_path:
+            cmp_profiles = load_corpus(
+                cmp_profiles_dir, snapshot_path, translate)
+            cmp_ids = cmp_profiles.ids
+        else:
+            cmp_ids, cmp_profiles = get_profiles_by_dir(cmp_profiles_dir)
+        if quantize:
+            if not isinstance(cmp_profiles, Corpus):
+                cmp_profiles = Corpus.from_profiles(
+                    cmp_profiles, cmp_ids, translate)
+            exact = cmp_profiles
+            cmp_profiles = QuantizedCorpus(exact, quantize)
+            if accuracy_report:
+                print_accuracy_report(get_accuracy_report(
+                    [profile], exact, cmp_profiles, top_k or 10, translate,
+                    algorithms), algorithms)
+        if compact:
+            if not isinstance(cmp_profiles, Corpus):
+                cmp_profiles = Corpus.from_profiles(
+                    cmp_profiles, cmp_ids, translate)
+            cmp_profiles = cmp_profiles.compact()
+        lsh = None
+        if lsh_bands:
+            if not isinstance(cmp_profiles, Corpus):
+                cmp_profiles = Corpus.from_profiles(
+                    cmp_profiles, cmp_ids, translate)
+            lsh = LSHIndex(cmp_profiles.profiles, lsh_bands, lsh_rows)
+        if score_processes and lsh is None:
+            if not isinstance(cmp_profiles, Corpus):
+                cmp_profiles = Corpus.from_profiles(
+                    cmp_profiles, cmp_ids, translate)
+            with ParallelMatcher(cmp_profiles, score_processes) as matcher:
+                if top_k is not None:
+                    print_top_k(matcher.match_top_k(
+                        profile, top_k, translate, algorithms), algorithms)
+                else:
+                    print_results(cmp_ids, matcher.match(
+                        profile, translate, algorithms), algorithms)
+            return
+        if top_k is not None:
+            print_top_k(match_top_k(
+                profile, cmp_profiles, top_k, cmp_ids, translate, lsh,
+                algorithms), algorithms)
+            return
+        results = match(profile, cmp_profiles, cmp_ids, translate, engine,
+                        lsh, algorithms)
+        print_results(cmp_ids, results, algorithms)
+    except (FileNotFoundError, IsADirectoryError) as ex:
+        print("Bad file name: %s" % (str(ex)))
+    except ValueError as ex:
+        print("Error while reading the profiles: %s" % (str(ex)))
+    except (json.decoder.JSONDecodeError) as ex:
+        print("Error while parsing %s: %s" % (ex.doc, str(ex)))
+    except requests.exceptions.RequestException as ex:
+        print("Error during the connection to Wikipedia API: %s" % (str(ex)))
+
 
-    Returns:
-        a tuple with the file name (without the extension), which is 
-        meant to be the id of the profile, and the profile itself
+def main_compile(cmp_profiles_dir, translate, snapshot_path=None,
+                 columnar_path=None):
+    """
+    Compile the snapshot of the profiles in the given directory, and 
+    optionally write them in the columnar format.
 
-    Raises:
-        FileNotFoundError: the file is missing
-        IsADirectoryError: the profile_path is a path to a directory
-        json.decoder.JSONDecodeError: the given is not a valid json file
+    Args:
+        cmp_profiles_dir: the dir containing the existing profiles 
+            (json)
+        translate (bool): if set to True, the topics in foreign 
+            languages are translated to English when possible
+        snapshot_path (optional): the path of the snapshot. By default 
+            it is stored in cmp_profiles_dir
+        columnar_path (optional): if given, the profiles are also 
+            written in the columnar format at this path
     """
     try:
-        with open(profile_path) as f:
-            profile = json.load(f)
-    except json.decoder.JSONDecodeError as ex:
-        raise json.decoder.JSONDecodeError(ex.msg, profile_path, ex.pos)
-    return path_to_id(profile_path), profile
+        corpus = compile_corpus(cmp_profiles_dir, snapshot_path, translate)
+        if columnar_path:
+            write_columnar(corpus, columnar_path)
+        print("Compiled %d profiles" % len(corpus))
+    except (FileNotFoundError, IsADirectoryError) as ex:
+        print("Bad file name: %s" % (str(ex)))
+    except (json.decoder.JSONDecodeError) as ex:
+        print("Error while parsing %s: %s" % (ex.doc, str(ex)))
+    except requests.exceptions.RequestException as ex:
+        print("Error during the connection to Wikipedia API: %s" % (str(ex)))
 
 
-def get_profiles_by_dir(profiles_dir):
+def main_batch(source, cmp_profiles_dir, translate, top_k=5, processes=None,
+               snapshot_path=None, columnar_path=None, quantize=None,
+               algorithms=ALGORITHMS, compact=False):
     """
-    Read the profiles in the given directory.
+    Print a json line with the results of each profile in the source.
 
-    Profiles are json files. A valid profile contains a dictionary where 
-    keys are topic names (in the form of urls of Wikipedia categories) 
-    and values are the number of times the profile has spoken about the 
-    respective topic.
+    Each line contains the id of the profile and, for each algorithm, 
+    the id of the most similar profile and the top_k most similar 
+    profiles with their similarity values. Lines are printed as soon as 
+    the profiles are matched, so they are not in the order of source.
 
     Args:
-        profiles_dir: the path to the directory in which to look for 
-            profiles
+        source: a directory, a glob pattern of json files or a JSONL 
+            file with the profiles to compare with the existing ones
+        cmp_profiles_dir: the dir containing the existing profiles 
+            (json)
+        translate (bool): if set to True, the topics in foreign 
+            languages are translated to English when possible
+        top_k (optional): the number of most similar profiles printed
+        processes (optional): the number of worker processes. By 
+            default the number of cpus
+        snapshot_path (optional): if given, the existing profiles are 
+            loaded from the compiled snapshot at this path
+        columnar_path (optional): if given, the existing profiles are 
+            read in place from the columnar file at this path, which is 
+            shared by the worker processes
+        quantize (optional): if given, the values of the existing 
+            profiles are stored with this storage, one of 
+            quantized.STORAGES
+        algorithms (optional): the names of the algorithms to run
+        compact (optional): if set to True, the existing profiles are 
+            kept as Profiles, which take less memory
+    """
+    try:
+        if columnar_path:
+            corpus = MappedCorpus(columnar_path)
+        elif snapshot_path:
+            corpus = load_corpus(cmp_profiles_dir, snapshot_path, translate)
+        else:
+            cmp_ids, cmp_profiles = get_profiles_by_dir(cmp_profiles_dir)
+            corpus = Corpus.from_profiles(cmp_profiles, cmp_ids, translate)
+        if quantize:
+            corpus = QuantizedCorpus(corpus, quantize)
+        if compact:
+            corpus = corpus.compact()
+        queries = iter_query_profiles(source)
+        for result in match_batch(queries, corpus, top_k, processes,
+                                  translate, algorithms):
+            print(json.dumps(result), flush=True)
+    except (FileNotFoundError, IsADirectoryError) as ex:
+        print("Bad file name: %s" % (str(ex)))
+    except (json.decoder.JSONDecodeError) as ex:
+        print("Error while parsing %s: %s" % (ex.doc, str(ex)))
+    except ValueError as ex:
+        print("Error while reading the profiles: %s" % (str(ex)))
+    except requests.exceptions.RequestException as ex:
+        print("Error during the connection to Wikipedia API: %s" % (str(ex)))
 
-    Returns:
-        a tuple with a list with the file names (without the extension), 
-        which are meant to be the ids of the profiles, and a list with 
-        the profiles
 
-    Raises:
-        IsADirectoryError: there is a subdirectory with '.json' 
-            extension
-        json.decoder.JSONDecodeError: there is a file with '.json' 
-            extension which is not a valid json file
+def main_stream(profile_path, source, translate, top_k=5,
+                chunk_size=CHUNK_SIZE, spill_path=None,
+                algorithms=ALGORITHMS):
     """
-    profiles = []
-    ids = []
-    if not profiles_dir.endswith('/'):
-        profiles_dir += '/'
-    for filename in os.listdir(profiles_dir):
-        if filename.endswith('.json') and not filename.startswith('.'):
-            profile_id, profile = get_profile_by_file(profiles_dir + filename)
-            ids.append(profile_id)
-            profiles.append(profile)
+    Print the most similar profiles to the given one, reading the ones 
+    to compare it with one chunk at a time.
 
-    return ids, profiles
+    Args:
+        profile_path: the path of the profile to compare with the 
+            existing ones (json)
+        source: the dir containing the existing profiles (json), or a 
+            JSONL file with them
+        translate (bool): if set to True, the topics in foreign 
+            languages are translated to English when possible
+        top_k (optional): the number of most similar profiles printed
+        chunk_size (optional): the number of existing profiles read and 
+            compared together
+        spill_path (optional): if given, a json line with the similarity 
+            values of each existing profile is written to this file
+        algorithms (optional): the names of the algorithms to run
+    """
+    spill = None
+    try:
+        _, profile = get_profile_by_file(profile_path)
+        if spill_path:
+            spill = open(spill_path, 'w')
+        print_top_k(match_stream(profile, source, top_k, chunk_size,
+                                 translate, algorithms, spill), algorithms)
+    except (FileNotFoundError, IsADirectoryError) as ex:
+        print("Bad file name: %s" % (str(ex)))
+    except (json.decoder.JSONDecodeError) as ex:
+        print("Error while parsing %s: %s" % (ex.doc, str(ex)))
+    except ValueError as ex:
+        print("Error while reading the profiles: %s" % (str(ex)))
+    except requests.exceptions.RequestException as ex:
+        print("Error during the connection to Wikipedia API: %s" % (str(ex)))
+    finally:
+        if spill is not None:
+            spill.close()
 
 
-def main(profile_path, cmp_profiles_dir, translate):
+def main_all_pairs(output, cmp_profiles_dir, translate, top_k=10,
+                   processes=None, block_size=BLOCK_SIZE,
+                   snapshot_path=None, columnar_path=None,
+                   algorithms=ALGORITHMS, compact=False):
     """
-    Print the id of the most similar profile to the given one among the 
-    ones to compare it with.
+    Write for each existing profile the most similar other existing 
+    profiles to a JSONL file.
 
-    Two algorithms are used to find the most similar profile, and the 
-    ids returned by both are printed. For each algorithm the evaluated 
-    similarity values with each profile are also printed.
+    If the run is interrupted, running it again with the same arguments 
+    compares only the tiles of pairs of blocks which were not completed.
+
+    Args:
+        output: the path of the JSONL file with the results
+        cmp_profiles_dir: the dir containing the existing profiles 
+            (json)
+        translate (bool): if set to True, the topics in foreign 
+            languages are translated to English when possible
+        top_k (optional): the number of most similar profiles written 
+            for each profile
+        processes (optional): the number of worker processes. By 
+            default the number of cpus
+        block_size (optional): the number of profiles of each block
+        snapshot_path (optional): if given, the existing profiles are 
+            loaded from the compiled snapshot at this path
+        columnar_path (optional): if given, the existing profiles are 
+            read in place from the columnar file at this path
+        algorithms (optional): the names of the algorithms to run
+        compact (optional): if set to True, the existing profiles are 
+            kept as Profiles, which take less memory
+    """
+    try:
+        if columnar_path:
+            corpus = MappedCorpus(columnar_path)
+        elif snapshot_path:
+            corpus = load_corpus(cmp_profiles_dir, snapshot_path, translate)
+        else:
+            cmp_ids, cmp_profiles = get_profiles_by_dir(cmp_profiles_dir)
+            corpus = Corpus.from_profiles(cmp_profiles, cmp_ids, translate)
+        if compact:
+            corpus = corpus.compact()
+        scored, blocks = match_all_pairs(corpus, output, top_k, None,
+                                         block_size, processes, algorithms)
+        print("Compared %d of %d tiles, results written to %s"
+              % (scored, blocks, output))
+    except (FileNotFoundError, IsADirectoryError) as ex:
+        print("Bad file name: %s" % (str(ex)))
+    except (json.decoder.JSONDecodeError) as ex:
+        print("Error while parsing %s: %s" % (ex.doc, str(ex)))
+    except ValueError as ex:
+        print("Error during the all-pairs matching: %s" % (str(ex)))
+    except requests.exceptions.RequestException as ex:
+        print("Error during the connection to Wikipedia API: %s" % (str(ex)))
+
+
+def main_serve(cmp_profiles_dir, translate, port, reload_interval,
+               snapshot_path=None, engine='python', result_cache_size=0,
+               result_cache_ttl=None, algorithms=ALGORITHMS, compact=False):
+    """
+    Serve the matching of profiles against the ones in the given 
+    directory on a local HTTP port.
+
+    Args:
+        cmp_profiles_dir: the dir containing the existing profiles 
+            (json)
+        translate (bool): if set to True, the topics in foreign 
+            languages are translated to English when possible
+        port: the port on which the server listens
+        reload_interval: number of seconds between two checks of 
+            cmp_profiles_dir
+        snapshot_path (optional): the path where the snapshot of the 
+            existing profiles is stored
+        engine (optional): the engine used to compute the similarity 
+            values, one of ENGINES
+        result_cache_size (optional): the number of results kept in 
+            memory for the profiles matched again. With 0 the results 
+            are not stored
+        result_cache_ttl (optional): number of seconds after which a 
+            stored result expires
+        algorithms (optional): the names of the algorithms run when a 
+            request does not choose them
+        compact (optional): if set to True, the existing profiles are 
+            kept as Profiles, which take less memory
+    """
+    result_cache = ResultCache(result_cache_size, result_cache_ttl) \
+        if result_cache_size > 0 else None
+    try:
+        service = MatchingService(
+            cmp_profiles_dir, translate, engine, snapshot_path,
+            result_cache, algorithms, compact)
+    except (FileNotFoundError, IsADirectoryError) as ex:
+        print("Bad file name: %s" % (str(ex)))
+        return
+    except (json.decoder.JSONDecodeError) as ex:
+        print("Error while parsing %s: %s" % (ex.doc, str(ex)))
+        return
+    except ValueError as ex:
+        print("Error while reading the profiles: %s" % (str(ex)))
+        return
+    except requests.exceptions.RequestException as ex:
+        print("Error during the connection to Wikipedia API: %s" % (str(ex)))
+        return
+    print("Serving %d profiles on http://127.0.0.1:%d/" % (
+        len(service.corpus), port))
+    serve(service, port=port, reload_interval=reload_interval)
+
+
+def main_sharded(profile_path, cmp_profiles_dir, translate, shards,
+                 timeout, engine='python', top_k=None,
+                 algorithms=ALGORITHMS, compact=False):
+    """
+    Print the results of the matching of a profile, with the existing 
+    profiles split among worker processes.
 
     Args:
         profile_path: the path of the profile to compare with the 
@@ -109,24 +465,58 @@ def main(profile_path, cmp_profiles_dir, translate):
             (json)
         translate (bool): if set to True, the topics in foreign 
             languages are translated to English when possible
+        shards: the number of worker processes
+        timeout: seconds to wait for the answer of each worker
+        engine (optional): the engine used by the workers to compute 
+            the similarity values, one of ENGINES
+        top_k (optional): if given, only the top_k most similar 
+            profiles are printed for each algorithm
+        algorithms (optional): the names of the algorithms to run
+        compact (optional): if set to True, the workers keep their 
+            profiles as Profiles, which take less memory
     """
     try:
         _, profile = get_profile_by_file(profile_path)
-        cmp_ids, cmp_profiles = get_profiles_by_dir(cmp_profiles_dir)
-        results = match(profile, cmp_profiles, cmp_ids, translate)
-        for i, (id, match_values) in enumerate(results):
-            print("Algorithm %d" % (i+1))
-            for j in range(len(match_values)):
-                print("Similarity with %s: %f" % (cmp_ids[j], match_values[j]))
-            print("Most similar: %s\n" % id)
+        with ShardCluster(cmp_profiles_dir, shards, translate, engine,
+                          compact=compact) as cluster:
+            matcher = ShardedMatcher(cluster.addresses, timeout)
+            if top_k is not None:
+                print_top_k(matcher.match_top_k(profile, top_k, algorithms),
+                            algorithms)
+            else:
+                print_results(matcher.ids,
+                              matcher.match(profile, algorithms), algorithms)
     except (FileNotFoundError, IsADirectoryError) as ex:
         print("Bad file name: %s" % (str(ex)))
     except (json.decoder.JSONDecodeError) as ex:
         print("Error while parsing %s: %s" % (ex.doc, str(ex)))
-    except requests.exceptions.ConnectionError as ex:
+    except ShardTimeoutError as ex:
+        print("Timeout during the sharded matching: %s" % (str(ex)))
+    except ShardError as ex:
+        print("Error during the sharded matching: %s" % (str(ex)))
+    except ValueError as ex:
+        print("Error while reading the profiles: %s" % (str(ex)))
+    except requests.exceptions.RequestException as ex:
         print("Error during the connection to Wikipedia API: %s" % (str(ex)))
 
 
+def write_stats(stats, path):
+    """
+    Write the timings and the counters recorded while matching.
+
+    Args:
+        stats: the Stats recorded
+        path: the json file where the stats are written, or '-' to 
+            print them to stderr
+    """
+    content = json.dumps(stats.to_dict(), indent=2, sort_keys=True)
+    if path == '-':
+        print(content, file=sys.stderr)
+    else:
+        with open(path, 'w') as f:
+            f.write(content + '\n')
+
+
 if __name__ == "__main__":
     ap = ArgumentParser(description="""
         Evaluates the similarity of a profile against a set of existing 
@@ -137,6 +527,11 @@ if __name__ == "__main__":
         translate the category names to english when possible. Note that 
         it can take some time to translate
         """)
+    ap.add_argument('--translation_cache', action='store',
+        dest='translation_cache', type=str, default=None, help="""
+        SQLite file where the translations are stored, so that each 
+        topic is requested to the Wikipedia API only once
+        """)
     ap.add_argument('--cmp_profiles_dir', action='store',
         dest='cmp_profiles_dir', type=str, default='tapoi_models/',
         help="""
@@ -145,10 +540,221 @@ if __name__ == "__main__":
         each file must be in json format. See the example files in 
         tapoi_models directory for more infos
         """)
-    ap.add_argument('profile_path', type=str, help="""
+    ap.add_argument('--snapshot', action='store', dest='snapshot_path',
+        type=str, default=None, help="""
+        load the profiles used for the comparison from the compiled 
+        snapshot at this path instead of parsing cmp_profiles_dir. The 
+        snapshot is rebuilt automatically when the profiles change
+        """)
+    ap.add_argument('--columnar', action='store', dest='columnar_path',
+        type=str, default=None, help="""
+        read the profiles used for the comparison in place from the 
+        columnar file at this path, which is mapped in memory and shared 
+        by all the processes. With --compile_corpus, the file is written
+        """)
+    ap.add_argument('--engine', action='store', dest='engine', type=str,
+        choices=ENGINES, default='python', help="""
+        engine used to compute the similarity values. The numpy engine 
+        requires NumPy, otherwise the python one is used
+        """)
+    ap.add_argument('--quantize', action='store', dest='quantize',
+        type=str, choices=STORAGES, default=None, help="""
+        store the percentages and the ranking positions of the profiles 
+        used for the comparison as single precision floats or as 16 bit 
+        fixed-point integers, which take less memory but give slightly 
+        different similarity values
+        """)
+    ap.add_argument('--compact', action='store_true', help="""
+        keep the profiles used for the comparison in memory as arrays of 
+        interned topic ids and values instead of dictionaries, which 
+        take several times less memory when many profiles share their 
+        topics. It cannot be combined with --columnar, --quantize, 
+        --stream, --compile_corpus, or --processes without --batch or 
+        --all_pairs, which store the profiles in their own way
+        """)
+    ap.add_argument('--accuracy_report', action='store_true', help="""
+        with --quantize, print how much the most similar profiles and the 
+        similarity values differ from the ones of the exact values
+        """)
+    ap.add_argument('--top_k', action='store', dest='top_k', type=int,
+        default=None, help="""
+        print only the TOP_K most similar profiles for each algorithm
+        """)
+    ap.add_argument('--compile_corpus', action='store_true', help="""
+        compile the snapshot of the profiles in cmp_profiles_dir and 
+        exit. It is written at the --snapshot path if given, otherwise 
+        in cmp_profiles_dir
+        """)
+    ap.add_argument('--batch', action='store', dest='batch', type=str,
+        default=None, help="""
+        instead of a single profile, match all the profiles in BATCH, 
+        which is a directory, a glob pattern of json files or a JSONL 
+        file, and print a json line with the results of each one. 
+        --top_k sets the number of most similar profiles printed 
+        (default 5)
+        """)
+    ap.add_argument('--stream', action='store_true', help="""
+        read and compare the profiles in cmp_profiles_dir, which can 
+        also be a JSONL file, one chunk at a time, keeping only the 
+        --top_k most similar ones (default 5), so that they do not need 
+        to fit in memory
+        """)
+    ap.add_argument('--chunk_size', action='store', dest='chunk_size',
+        type=int, default=CHUNK_SIZE, help="""
+        with --stream, the number of profiles read and compared 
+        together. The memory used grows with it
+        """)
+    ap.add_argument('--spill', action='store', dest='spill_path',
+        type=str, default=None, help="""
+        with --stream, write a json line with the similarity values of 
+        each profile used for the comparison to this file
+        """)
+    ap.add_argument('--all_pairs', action='store', dest='all_pairs',
+        type=str, default=None, help="""
+        instead of a single profile, find for each profile in 
+        cmp_profiles_dir the --top_k most similar other ones (default 
+        10), and write a json line for each to ALL_PAIRS. An interrupted 
+        run is resumed when started again
+        """)
+    ap.add_argument('--block_size', action='store', dest='block_size',
+        type=int, default=BLOCK_SIZE, help="""
+        with --all_pairs, the number of profiles of each block. Each 
+        task compares the profiles of two blocks, and its size bounds the 
+        amount of work lost when a run is interrupted
+        """)
+    ap.add_argument('--processes', action='store', dest='processes',
+        type=int, default=None, help="""
+        the number of worker processes. With --batch and --all_pairs, 
+        the profiles are matched in parallel (by default by as many 
+        processes as cpus), otherwise the profiles used for the 
+        comparison are read and parsed in parallel and compared as soon 
+        as they are ready, which cannot be combined with --engine numpy, 
+        --lsh_bands, --snapshot, --columnar, --quantize or 
+        --score_processes
+        """)
+    ap.add_argument('--score_processes', action='store',
+        dest='score_processes', type=int, default=None, help="""
+        split the profiles used for the comparison among this number of 
+        worker processes, which compare them with the profile in 
+        parallel. Not used with --lsh_bands, and it cannot be combined 
+        with --engine numpy
+        """)
+    ap.add_argument('--serve', action='store', dest='port', type=int,
+        default=None, help="""
+        instead of matching a single profile, keep the profiles used for 
+        the comparison in memory and serve the matching on this local 
+        port. POST a profile to /match to get the results
+        """)
+    ap.add_argument('--reload_interval', action='store',
+        dest='reload_interval', type=float, default=1.0, help="""
+        with --serve, seconds between two checks for changes in 
+        cmp_profiles_dir
+        """)
+    ap.add_argument('--result_cache', action='store',
+        dest='result_cache_size', type=int, default=0, help="""
+        with --serve, keep the results of this number of profiles in 
+        memory, so that a profile matched again is not compared again 
+        until the profiles used for the comparison change
+        """)
+    ap.add_argument('--result_cache_ttl', action='store',
+        dest='result_cache_ttl', type=float, default=None, help="""
+        with --result_cache, seconds after which a stored result expires
+        """)
+    ap.add_argument('--shards', action='store', dest='shards', type=int,
+        default=None, help="""
+        split the profiles used for the comparison among this number of 
+        worker processes, which score them in parallel
+        """)
+    ap.add_argument('--shard_timeout', action='store',
+        dest='shard_timeout', type=float, default=10.0, help="""
+        with --shards, seconds to wait for the answer of each worker
+        """)
+    ap.add_argument('--lsh_bands', action='store', dest='lsh_bands',
+        type=int, default=None, help="""
+        compare the profile only with the candidates found by MinHash 
+        LSH with this number of bands. It is approximate: more bands 
+        find more of the similar profiles, but are slower
+        """)
+    ap.add_argument('--lsh_rows', action='store', dest='lsh_rows',
+        type=int, default=ROWS, help="""
+        with --lsh_bands, the number of MinHash values of each band. 
+        More rows find fewer candidates
+        """)
+    ap.add_argument('--algorithms', action='store', dest='algorithms',
+        nargs='+', choices=get_scorer_names(), default=list(ALGORITHMS),
+        help="""
+        the algorithms used to compute the similarity values. They are 
+        run together in a single pass over the profiles
+        """)
+    ap.add_argument('--stats', action='store', dest='stats_path',
+        type=str, nargs='?', const='-', default=None, help="""
+        record the time spent in each stage of the matching and some 
+        counters (profiles, topics, translation requests, cache hits), 
+        and write them in json to STATS_PATH, or to stderr if no path 
+        is given
+        """)
+    ap.add_argument('profile_path', type=str, nargs='?', help="""
         the json file containing profile which you want to compare with 
         the existing ones
         """)
     args = ap.parse_args()
 
-    main(args.profile_path, args.cmp_profiles_dir, args.translate)
+    if args.translation_cache:
+        set_translation_cache(TranslationCache(args.translation_cache))
+    if args.stats_path is not None:
+        enable_stats()
+
+    if args.compact and (args.columnar_path or args.quantize or
+                         args.stream or args.compile_corpus or
+                         args.processes and args.batch is None and
+                         args.all_pairs is None):
+        ap.error("--compact cannot be used with --columnar, --quantize, "
+                 "--stream, --compile_corpus, or --processes without "
+                 "--batch or --all_pairs")
+    if args.compile_corpus:
+        main_compile(args.cmp_profiles_dir, args.translate,
+                     args.snapshot_path, args.columnar_path)
+    elif args.batch is not None:
+        main_batch(args.batch, args.cmp_profiles_dir, args.translate,
+                   args.top_k if args.top_k is not None else 5,
+                   args.processes, args.snapshot_path, args.columnar_path,
+                   args.quantize, args.algorithms, args.compact)
+    elif args.all_pairs is not None:
+        main_all_pairs(args.all_pairs, args.cmp_profiles_dir, args.translate,
+                       args.top_k if args.top_k is not None else 10,
+                       args.processes, args.block_size, args.snapshot_path,
+                       args.columnar_path, args.algorithms, args.compact)
+    elif args.port is not None:
+        main_serve(args.cmp_profiles_dir, args.translate, args.port,
+                   args.reload_interval, args.snapshot_path, args.engine,
+                   args.result_cache_size, args.result_cache_ttl,
+                   args.algorithms, args.compact)
+    elif args.profile_path is None:
+        ap.error("the following arguments are required: profile_path")
+    elif args.stream:
+        main_stream(args.profile_path, args.cmp_profiles_dir,
+                    args.translate,
+                    args.top_k if args.top_k is not None else 5,
+                    args.chunk_size, args.spill_path, args.algorithms)
+    elif args.shards:
+        main_sharded(args.profile_path, args.cmp_profiles_dir,
+                     args.translate, args.shards, args.shard_timeout,
+                     args.engine, args.top_k, args.algorithms,
+                     args.compact)
+    else:
+        if args.processes and (
+                args.engine != 'python' or args.lsh_bands or
+                args.snapshot_path or args.columnar_path or
+                args.quantize or args.score_processes):
+            ap.error("--processes cannot be used with --engine numpy, "
+                     "--lsh_bands, --snapshot, --columnar, --quantize or "
+                     "--score_processes")
+        if args.score_processes and args.engine != 'python':
+            ap.error("--score_processes cannot be used with --engine numpy")
+        main(args.profile_path, args.cmp_profiles_dir, args.translate,
+             args.snapshot_path, args.engine, args.top_k, args.processes,
+             args.lsh_bands, args.lsh_rows, args.algorithms,
+             args.columnar_path, args.score_processes, args.quantize,
+             args.accuracy_report, args.compact)
+    if args.stats_path is not None:
+        write_stats(get_stats(), args.stats_path)
@@ -21,6 +21,7 @@ if the two percentages are very similar but they are very low, this does
 not contribute much to the match_value.
 """
 import math
+from .profile import is_compact
 
 
 def get_similarity(value1, value2):
@@ -48,13 +49,21 @@ def match_value(profile1, profile2):
 
     Args:
         profile1: first profile to compare
-        profile2: second profile to compare
+        profile2: second profile to compare. If both profiles are 
+            Profiles with the same Vocabulary, the shared topics are 
+            found by merging their sorted topic ids
 
     Returns:
         The match value which evaluates the similarity between the two 
         profiles
     """
     value = 0
+    if is_compact(profile1, profile2):
+        weights1 = profile1.weights
+        weights2 = profile2.weights
+        for i, j in profile1.intersect(profile2):
+            value += get_similarity(weights1[i], weights2[j])
+        return value
     for topic, times1 in profile1.items():
         if topic in profile2:
             sim = get_similarity(times1, profile2[topic])
@@ -96,3 +105,38 @@ def match(profile, cmp_profiles):
             best_match_value = curr_match_value
             best_match_id = i
     return best_match_id, match_values
+
+
+def match_index(profile, index):
+    """
+    Find the profile in an index which is most similar to profile.
+
+    It computes the same match_values as match, but the comparison is 
+    done by walking only the postings of the topics of profile, so 
+    that the cmp_profiles which do not share any topic with profile 
+    are never visited and get a match_value of 0.
+
+    Args:
+        profile: the profile for which to find the most similar one. 
+            Each topic should be associated with its percentage of 
+            discussions over all discussions
+        index: the TopicIndex of the cmp_profiles, where each topic is 
+            associated with its percentage of discussion over all 
+            discussions of the profile
+
+    Returns:
+        a tuple with the index of the cmp_profile most similar to 
+        profile and a list with the similarity values for each profile
+    """
+    match_values = [0] * len(index)
+    for topic, times in profile.items():
+        for i, cmp_times in index.get_postings(topic):
+            match_values[i] += get_similarity(times, cmp_times)
+
+    best_match_id = None
+    best_match_value = 0
+    for i, curr_match_value in enumerate(match_values):
+        if curr_match_value > best_match_value:
+            best_match_value = curr_match_value
+            best_match_id = i
+    return best_match_id, match_values
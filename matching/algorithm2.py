@@ -24,6 +24,7 @@ if the two positions are very similar but the corresponding percentages
 are low, this does not contribute much to the match_value.
 """
 import math
+from .profile import is_compact
 
 
 def get_ranking(profile):
@@ -48,8 +49,11 @@ def get_ranking(profile):
     # compute the average diff without the min and the max
     if len(diffs) > 2:
         avg_diff = (sum(diffs) - min(diffs) - max(diffs)) / (len(diffs)-2)
-    else:
+    elif diffs:
         avg_diff = sum(diffs) / len(diffs)
+    else:
+        # a profile with a single topic has a single position
+        avg_diff = 0
 
     # topics are grouped if the difference between the highest
     # percentage and the lowest is less than the average difference
@@ -64,6 +68,23 @@ def get_ranking(profile):
     return ranking, ranking_position + 1
 
 
+def get_normalized_ranking(profile):
+    """
+    Build a ranking for the given profile with positions normalized on
+    the number of positions of the ranking.
+
+    Args:
+        profile: The profile for which to build the ranking
+
+    Returns:
+        a dictionary where each topic is associated to its position in
+        the ranking divided by the number of positions
+    """
+    ranking, positions = get_ranking(profile)
+    return {topic: position / positions
+            for topic, position in ranking.items()}
+
+
 def get_position_similarity(pos1, pos2):
     """
     Evaluate the similarity of positions of a topic in two rankings.
@@ -79,6 +100,61 @@ def get_position_similarity(pos1, pos2):
     return math.exp(-((2*diff)**2))
 
 
+def get_topic_value(value1, value2, pos1, pos2):
+    """
+    Evaluate the contribution of a topic to the match_value.
+
+    Args:
+        value1: discussion percentage of the topic in the first profile
+        value2: discussion percentage of the topic in the second profile
+        pos1: the position of the topic in the first ranking
+        pos2: the position of the topic in the second ranking
+
+    Returns:
+        the similarity of the two positions multiplied by the lowest of 
+        the two percentages
+    """
+    diff = abs(pos1-pos2)
+    return math.exp(-((2*diff)**2)) * min(value1, value2)
+
+
+def match_value(profile1, ranking1, profile2, ranking2):
+    """
+    Evaluate the similarity of two profiles.
+
+    Each topic discussed by both profiles contributes to the match_value 
+    with the similarity of its positions in the rankings of the two 
+    profiles, multiplied by the lowest of its two percentages.
+
+    Args:
+        profile1: first profile to compare
+        ranking1: normalized ranking of the first profile
+        profile2: second profile to compare
+        ranking2: normalized ranking of the second profile. If the 
+            profiles and the rankings are all Profiles with the same 
+            Vocabulary, the shared topics are found by merging their 
+            sorted topic ids
+
+    Returns:
+        The match value which evaluates the similarity between the two 
+        profiles
+    """
+    value = 0
+    if is_compact(profile1, ranking1, profile2, ranking2):
+        # the ranking of a profile has the same topics of the profile, 
+        # so they are at the same positions in the arrays
+        for i, j in profile1.intersect(profile2):
+            value += get_topic_value(
+                profile1.weights[i], profile2.weights[j],
+                ranking1.weights[i], ranking2.weights[j])
+        return value
+    for topic in profile1:
+        if topic in profile2:
+            value += get_topic_value(profile1[topic], profile2[topic],
+                                     ranking1[topic], ranking2[topic])
+    return value
+
+
 def print_ranking(profile, profile_ranking):
     """
     Print the ranking of a profile.
@@ -92,7 +168,7 @@ def print_ranking(profile, profile_ranking):
         print("%d %s: %f" % (profile_ranking[t], t, profile[t]))
 
 
-def match(profile, cmp_profiles):
+def match(profile, cmp_profiles, cmp_rankings=None):
     """
     Find the profile in cmp_profiles which is most similar to profile.
 
@@ -115,31 +191,27 @@ def match(profile, cmp_profiles):
             done. For each profile, each topic should be associated 
             with its percentage of discussion over all discussions of 
             the profile
+        cmp_rankings (optional): list with the normalized ranking of 
+            each cmp_profile, as returned by get_normalized_ranking. 
+            If not given, the rankings are built at each call
 
     Returns:
         a tuple with the index of the cmp_profile most similar to 
         profile and a list with the similarity values for each profile  
     """
 
-    profile_ranking, positions = get_ranking(profile)
-    # print_ranking(profile, profile_ranking)
+    profile_ranking = get_normalized_ranking(profile)
     best_match_id = None
     best_match_value = 0
 
     match_values = []
     for i, cmp_profile in enumerate(cmp_profiles):
-        cmp_ranking, cmp_positions = get_ranking(cmp_profile)
-        # print("\n\n\n\n")
-        # print_ranking(cmp_profile, cmp_ranking)
-
-        curr_match_value = 0
-        for topic in profile:
-            if topic in cmp_profile:
-                pos = profile_ranking[topic] / positions
-                cmp_pos = cmp_ranking[topic] / cmp_positions
-                topic_value = get_position_similarity(pos, cmp_pos)
-                topic_value *= min(profile[topic], cmp_profile[topic])
-                curr_match_value += topic_value
+        if cmp_rankings is None:
+            cmp_ranking = get_normalized_ranking(cmp_profile)
+        else:
+            cmp_ranking = cmp_rankings[i]
+        curr_match_value = match_value(
+            profile, profile_ranking, cmp_profile, cmp_ranking)
         match_values.append(curr_match_value)
 
         if curr_match_value > best_match_value:
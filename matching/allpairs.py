@@ -0,0 +1,388 @@
+"""
+Contains the all-pairs matching, which finds for each profile of a
+corpus the k most similar other profiles of the same corpus.
+
+The corpus is prepared once, and the profiles are split in blocks of
+consecutive ones. The similarity matrix is split in tiles, one for each
+pair of blocks (a, b) with a <= b, scored by a pool of worker processes
+which inherit the corpus where processes are forked. A tile compares
+the rows of block a with the profiles of block b and, for the scorers
+which are not symmetric (see scorers.Scorer), the rows of block b with
+the profiles of block a. Each row is scored by walking the postings of
+its topics, sorted by the index of the profiles, so only the pairs
+sharing a topic are visited, and the postings outside of the other
+block are skipped by bisection. For the symmetric scorers the
+match_value of a pair is found once, by the row of the profile which
+comes first, and given to both the profiles.
+
+Each tile is written to its own file in a work directory, with the k
+most similar profiles found in the tile for every profile of its two
+blocks, so a file holds at most 2 * block_size * k matches. The tiles
+already written are skipped when the job is run again, so an
+interrupted run resumes from the missing tiles. When all the tiles are
+done they are merged one block at a time into a JSONL file with a line
+for each profile, and the work directory is removed.
+
+The match_value of a pair is summed over the topics in the order of the
+profile of its row, so it can differ in the last digits from the one
+computed by matcher.match with the other profile as the query.
+"""
+import hashlib
+import heapq
+import json
+import os
+import shutil
+from bisect import bisect_left
+from .matcher import get_scorers
+from .parsing.parser import reinit_after_fork
+from .stats import stage, count
+from .workers import get_context
+
+# default number of consecutive profiles of each block
+BLOCK_SIZE = 256
+_MANIFEST = 'manifest.json'
+
+# the job of the worker processes
+_job = None
+
+
+def _get_fingerprint(corpus):
+    """
+    Identify the profiles of a corpus, with their ids and percentages,
+    so that the tiles of another corpus are not resumed.
+    """
+    digest = hashlib.sha256()
+    digest.update(b'%d:%d' % (len(corpus), corpus.version))
+    if corpus.ids:
+        for profile_id in corpus.ids:
+            digest.update(str(profile_id).encode('utf-8') + b'\0')
+    for profile in corpus.profiles:
+        for topic, value in sorted(profile.items()):
+            digest.update(b'%s\0%r\0' % (topic.encode('utf-8'), value))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def _push(heap, k, match_value, j):
+    # the root of the min-heap is the worst of the k best
+    # (match_value, -index); among equal values the lowest index wins
+    item = (match_value, -j)
+    if len(heap) < k:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+
+class AllPairsJob:
+    """
+    The all-pairs matching of a corpus.
+
+    Attributes:
+        corpus: the Corpus of the profiles
+        k: the number of most similar profiles kept for each profile
+        scorers: the Scorers of the algorithms
+        block_size: the number of consecutive profiles of each block
+        work_dir: the directory of the files of the tiles
+    """
+
+    def __init__(self, corpus, k, work_dir, block_size=BLOCK_SIZE,
+                 algorithms=None):
+        """
+        Prepare the job, resuming the tiles already in work_dir.
+
+        Args:
+            corpus: the Corpus of the profiles
+            k: the number of most similar profiles to keep for each
+                profile
+            work_dir: the directory where the file of each tile is
+                written. It is created if missing
+            block_size (optional): the number of consecutive profiles
+                of each block
+            algorithms (optional): list with the names of the
+                algorithms to run, see scorers.py. By default ALGORITHMS
+
+        Raises:
+            ValueError: k or block_size are not positive, an algorithm
+                is not registered, or work_dir contains the tiles of a
+                different job
+        """
+        if k < 1 or block_size < 1:
+            raise ValueError("k and block_size must be positive")
+        self.corpus = corpus
+        self.k = k
+        self.scorers = get_scorers(algorithms)
+        self.block_size = block_size
+        self.work_dir = work_dir
+        self._postings = None
+        manifest = {
+            'corpus': _get_fingerprint(corpus), 'k': k,
+            'block_size': block_size,
+            'algorithms': [scorer.name for scorer in self.scorers]}
+        os.makedirs(work_dir, exist_ok=True)
+        path = os.path.join(work_dir, _MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                if json.load(f) != manifest:
+                    raise ValueError(
+                        "%s contains the tiles of a different job"
+                        % work_dir)
+        else:
+            with open(path, 'w') as f:
+                json.dump(manifest, f)
+
+    @property
+    def blocks(self):
+        """
+        The number of blocks.
+        """
+        return -(-len(self.corpus) // self.block_size)
+
+    @property
+    def tiles(self):
+        """
+        The tiles, a tuple (a, b) with a <= b for each pair of blocks.
+        """
+        return [(a, b) for a in range(self.blocks)
+                for b in range(a, self.blocks)]
+
+    def _get_rows(self, block):
+        start = block * self.block_size
+        return start, min(start + self.block_size, len(self.corpus))
+
+    def _get_postings(self):
+        # for each topic the sorted indexes of the profiles which
+        # discussed it and their values, so that the profiles outside
+        # of a block are skipped with a bisection
+        if self._postings is None:
+            postings = {}
+            for i, profile in enumerate(self.corpus.profiles):
+                for topic, value in profile.items():
+                    rows, values = postings.setdefault(topic, ([], []))
+                    rows.append(i)
+                    values.append(value)
+            self._postings = postings
+        return self._postings
+
+    def _get_path(self, tile):
+        return os.path.join(self.work_dir, 'tile_%06d_%06d.json' % tile)
+
+    def get_pending(self):
+        """
+        List the tiles which have not been written yet.
+
+        Returns:
+            a list with each pending tile
+        """
+        return [tile for tile in self.tiles
+                if not os.path.exists(self._get_path(tile))]
+
+    def _score_rows(self, scorer, prepared, rows, columns, heaps):
+        """
+        Compare the rows of a block with the profiles of another one,
+        and push each positive match_value to the heap of the row and,
+        if the scorer is symmetric, to the heap of the profile.
+
+        Returns:
+            the number of pairs scored
+        """
+        corpus = self.corpus
+        postings = self._get_postings()
+        contribution = scorer.contribution
+        low, high = columns
+        pairs = 0
+        for i in range(*rows):
+            profile = corpus.profiles[i]
+            match_values = {}
+            for topic, value1 in profile.items():
+                if prepared is not None:
+                    prepared1 = prepared[i][topic]
+                topic_rows, values = postings[topic]
+                # a symmetric pair is scored by its first profile
+                first = bisect_left(topic_rows, max(low, i + 1)
+                                    if scorer.symmetric else low)
+                last = bisect_left(topic_rows, high, first)
+                for j, value2 in zip(topic_rows[first:last],
+                                     values[first:last]):
+                    if j == i:
+                        continue
+                    if prepared is None:
+                        value = contribution(value1, value2)
+                    else:
+                        value = contribution(value1, value2, prepared1,
+                                             prepared[j][topic])
+                    match_values[j] = match_values.get(j, 0) + value
+            pairs += len(match_values)
+            heap = heaps.setdefault(i, [])
+            for j, match_value in match_values.items():
+                if match_value <= 0:
+                    continue
+                _push(heap, self.k, match_value, j)
+                if scorer.symmetric:
+                    _push(heaps.setdefault(j, []), self.k, match_value, i)
+        return pairs
+
+    def score_tile(self, tile):
+        """
+        Score the pairs of a tile and write its file.
+
+        For each symmetric scorer, the rows i of block a are compared
+        only with the profiles j > i of block b, and the match_value is
+        given to both i and j. The other scorers compare the rows of
+        each block with all the profiles of the other block, but i.
+
+        Args:
+            tile: the tuple (a, b) of the numbers of the two blocks
+        """
+        a, b = tile
+        rows_a = self._get_rows(a)
+        rows_b = self._get_rows(b)
+        results = []
+        for scorer in self.scorers:
+            prepared = self.corpus.get_prepared(scorer.prepare) \
+                if scorer.prepare else None
+            heaps = {}
+            pairs = self._score_rows(scorer, prepared, rows_a, rows_b,
+                                     heaps)
+            if not scorer.symmetric and a != b:
+                pairs += self._score_rows(scorer, prepared, rows_b, rows_a,
+                                          heaps)
+            count('all_pairs_scored', pairs)
+            results.append([
+                [i, [[-negative_j, match_value]
+                     for match_value, negative_j in heap]]
+                for i, heap in heaps.items() if heap])
+
+        # the file is complete or missing, even if the run is interrupted
+        path = self._get_path(tile)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'tile': list(tile), 'results': results}, f)
+        os.replace(path + '.tmp', path)
+
+    def run(self, processes=None):
+        """
+        Score the pending tiles in parallel.
+
+        Args:
+            processes (optional): the number of worker processes. By
+                default the number of cpus. With 1 the tiles are scored
+                by this process
+
+        Returns:
+            the number of tiles scored
+        """
+        pending = self.get_pending()
+        count('all_pairs_tiles', len(pending))
+        with stage('all_pairs'):
+            if processes == 1 or len(pending) <= 1:
+                for tile in pending:
+                    self.score_tile(tile)
+                return len(pending)
+            # build the structures shared by the workers before forking
+            self._get_postings()
+            for scorer in self.scorers:
+                if scorer.prepare:
+                    self.corpus.get_prepared(scorer.prepare)
+            with get_context().Pool(processes, _init_worker,
+                                    (self,)) as pool:
+                for _ in pool.imap_unordered(_score_tile, pending):
+                    pass
+        return len(pending)
+
+    def merge(self, output):
+        """
+        Merge the tiles into the result file.
+
+        The file has a json line for each profile, in the order of the
+        corpus, with its 'id' and, for each algorithm, the list of the k
+        most similar profiles with their similarity values, sorted from
+        the most similar. The profiles are merged one block at a time,
+        from the tiles of the block.
+
+        Args:
+            output: the path of the result file
+
+        Raises:
+            ValueError: some tiles have not been written yet
+        """
+        pending = self.get_pending()
+        if pending:
+            raise ValueError("%d tiles have not been scored" % len(pending))
+        ids = self.corpus.ids
+        with stage('all_pairs_merge'), open(output + '.tmp', 'w') as f:
+            for block in range(self.blocks):
+                start, end = self._get_rows(block)
+                top = [{} for _ in self.scorers]
+                for other in range(self.blocks):
+                    tile = (min(block, other), max(block, other))
+                    with open(self._get_path(tile)) as tile_file:
+                        results = json.load(tile_file)['results']
+                    for scorer_top, tile_results in zip(top, results):
+                        for i, matches in tile_results:
+                            if not start <= i < end:
+                                continue
+                            heap = scorer_top.setdefault(i, [])
+                            for j, match_value in matches:
+                                _push(heap, self.k, match_value, j)
+                for i in range(start, end):
+                    line = {'id': ids[i] if ids else i}
+                    for scorer, scorer_top in zip(self.scorers, top):
+                        line[scorer.name] = [
+                            [ids[-negative_j] if ids else -negative_j,
+                             match_value]
+                            for match_value, negative_j in sorted(
+                                scorer_top.get(i, ()), reverse=True)]
+                    f.write(json.dumps(line) + '\n')
+        os.replace(output + '.tmp', output)
+
+
+def _init_worker(job):
+    global _job
+    _job = job
+    reinit_after_fork()
+
+
+def _score_tile(tile):
+    _job.score_tile(tile)
+    return tile
+
+
+def match_all_pairs(corpus, output, k=10, work_dir=None,
+                    block_size=BLOCK_SIZE, processes=None, algorithms=None):
+    """
+    Find for each profile of a corpus the k most similar other profiles,
+    and write them to a JSONL file.
+
+    If the run is interrupted, running it again with the same arguments
+    scores only the tiles which were not written.
+
+    Args:
+        corpus: the Corpus of the profiles
+        output: the path of the result file, see AllPairsJob.merge
+        k (optional): the number of most similar profiles to keep for
+            each profile
+        work_dir (optional): the directory of the files of the tiles,
+            removed at the end. By default output with '.blocks'
+            appended
+        block_size (optional): the number of consecutive profiles of
+            each block
+        processes (optional): the number of worker processes. By default
+            the number of cpus
+        algorithms (optional): list with the names of the algorithms to
+            run, see scorers.py. By default ALGORITHMS
+
+    Returns:
+        a tuple with the number of tiles scored by this run and the
+        total number of tiles
+
+    Raises:
+        ValueError: k or block_size are not positive, an algorithm is
+            not registered, or work_dir contains the tiles of a
+            different job
+    """
+    if work_dir is None:
+        work_dir = output + '.blocks'
+    job = AllPairsJob(corpus, k, work_dir, block_size, algorithms)
+    scored = job.run(processes)
+    job.merge(output)
+    shutil.rmtree(work_dir)
+    return scored, len(job.tiles)
@@ -0,0 +1,135 @@
+"""
+Contains the functions to match many profiles against the same 
+cmp_profiles in a single run.
+
+The corpus of the cmp_profiles is prepared once and shared with a pool 
+of worker processes, which match the profiles in parallel. Where 
+processes are forked the corpus is inherited instead of being copied 
+to each worker.
+"""
+import glob
+import json
+import os
+from .matcher import match_top_k, get_scorers
+from .parsing.loader import get_profile_by_file, get_profile_filenames
+from .parsing.parser import reinit_after_fork
+from .workers import get_context
+
+# the corpus of the worker processes
+_corpus = None
+
+
+def iter_query_profiles(source):
+    """
+    Read the profiles to match from a source.
+
+    Args:
+        source: a directory of json files, a glob pattern of json files, 
+            or a JSONL file where each line is either a profile or an 
+            object with the 'id' and the 'profile'
+
+    Yields:
+        a tuple with the id and the profile. The id of a profile in a 
+        file is the file name without extension, the id of a profile in 
+        a JSONL file without an 'id' is its line number, starting from 1
+
+    Raises:
+        FileNotFoundError: source does not exist
+        json.decoder.JSONDecodeError: a file or a line is not valid json
+    """
+    if os.path.isdir(source):
+        for filename in sorted(get_profile_filenames(source)):
+            yield get_profile_by_file(os.path.join(source, filename))
+    elif os.path.isfile(source) and not source.endswith('.json'):
+        with open(source) as f:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except json.decoder.JSONDecodeError as ex:
+                    raise json.decoder.JSONDecodeError(
+                        ex.msg, '%s:%d' % (source, n), ex.pos)
+                if isinstance(item, dict) and 'profile' in item:
+                    yield item.get('id', n), item['profile']
+                else:
+                    yield n, item
+    else:
+        paths = sorted(glob.glob(source))
+        if not paths:
+            raise FileNotFoundError("no profiles found: %s" % source)
+        for path in paths:
+            yield get_profile_by_file(path)
+
+
+def _init_worker(corpus):
+    global _corpus
+    _corpus = corpus
+    reinit_after_fork()
+
+
+def match_query(query, k, translate=False, algorithms=None):
+    """
+    Match a profile against the corpus of the worker.
+
+    Args:
+        query: a tuple with the id and the profile
+        k: the number of most similar profiles to return
+        translate (optional): if set to True, the topics of the profile 
+            are translated to English when the translation is available
+        algorithms (optional): list with the names of the algorithms to 
+            run. By default ALGORITHMS
+
+    Returns:
+        a dictionary with the id of the profile and, for each algorithm, 
+        the id of the most similar profile and the k most similar ones 
+        with their similarity values. If the profile cannot be matched, 
+        the dictionary contains the error instead of the results
+    """
+    query_id, profile = query
+    try:
+        results = match_top_k(profile, _corpus, k, translate=translate,
+                              algorithms=algorithms)
+    except Exception as ex:
+        return {'id': query_id, 'error': '%s: %s' % (type(ex).__name__, ex)}
+    return {'id': query_id,
+            'results': [{'best_match': top[0][0] if top else None,
+                         'top_k': top} for top in results]}
+
+
+def _match_query(args):
+    return match_query(*args)
+
+
+def match_batch(queries, corpus, k=5, processes=None, translate=False,
+                algorithms=None):
+    """
+    Match many profiles against a corpus in parallel.
+
+    Args:
+        queries: iterable of tuples with the id and the profile to match
+        corpus: the Corpus of the cmp_profiles
+        k (optional): the number of most similar profiles to return for 
+            each profile
+        processes (optional): the number of worker processes. By default 
+            the number of cpus
+        translate (optional): if set to True, the topics of the profiles 
+            are translated to English when the translation is available
+        algorithms (optional): list with the names of the algorithms to 
+            run. By default ALGORITHMS
+
+    Yields:
+        the result of each profile, as returned by match_query, in the 
+        order in which they are completed
+
+    Raises:
+        ValueError: an algorithm is not registered
+    """
+    # an unknown algorithm is reported once, not by each profile
+    get_scorers(algorithms)
+    # build the index before forking, so that the workers share it
+    corpus.index
+    with get_context().Pool(processes, _init_worker, (corpus,)) as pool:
+        tasks = ((query, k, translate, algorithms) for query in queries)
+        for result in pool.imap_unordered(_match_query, tasks, chunksize=8):
+            yield result
@@ -0,0 +1,351 @@
+"""
+Contains a columnar file format for the Corpus, which is opened with
+mmap and read in place.
+
+The file stores the topic names, sorted, the ids of the profiles and,
+for each profile, the ids of its topics, sorted, with their
+percentages and their normalized positions in the ranking of algorithm2,
+all in contiguous arrays. The same values are also stored grouped by
+topic, as the postings of an inverted index.
+
+Opening the file does not read it: the arrays are memoryviews of the
+mapped pages, and the profiles are views of slices of them, so the
+processes which open the same file share the same pages of the page
+cache. Topic names are found by a binary search of the sorted names.
+
+The arrays are written in the byte order of the machine, and a file
+written on a machine with a different byte order cannot be opened.
+"""
+import mmap
+import struct
+import sys
+from array import array
+from .corpus import Corpus
+from .index import TopicIndex
+from .profile import Profile
+from .vectorized import HAS_NUMPY, SparseCorpus, np
+
+MAGIC = b'TPCORPUS'
+FORMAT_VERSION = 1
+# the sections of the file, with the typecode of their arrays
+_SECTIONS = (
+    ('topic_offsets', 'Q'),     # start of each topic name in topic_data
+    ('topic_data', 'B'),        # utf-8 topic names, sorted
+    ('id_offsets', 'Q'),        # start of each profile id in id_data
+    ('id_data', 'B'),           # utf-8 profile ids
+    ('indptr', 'Q'),            # start of each profile in the arrays
+    ('topic_ids', 'I'),         # topic ids, sorted within each profile
+    ('weights', 'd'),           # percentage of each topic
+    ('positions', 'd'),         # normalized position of each topic
+    ('postings_indptr', 'Q'),   # start of each topic in the postings
+    ('postings_rows', 'I'),     # profile of each posting
+    ('postings_weights', 'd'),  # percentage of each posting
+)
+# magic, format version, byte order, translate, number of profiles, and
+# the offset and the length in items of each section
+_HEADER = struct.Struct('<8sIB?2xQ' + 'QQ' * len(_SECTIONS))
+_BYTEORDERS = {'little': 0, 'big': 1}
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _encode_strings(strings):
+    offsets = array('Q', [0])
+    data = bytearray()
+    for string in strings:
+        data += string.encode('utf-8')
+        offsets.append(len(data))
+    return offsets, array('B', data)
+
+
+def write_columnar(corpus, path):
+    """
+    Write a Corpus in the columnar format.
+
+    Args:
+        corpus: the Corpus. Its ids are stored as strings
+        path: the path of the file
+    """
+    topics = sorted({topic for profile in corpus.profiles
+                     for topic in profile},
+                    key=lambda topic: topic.encode('utf-8'))
+    topic_ids = {topic: i for i, topic in enumerate(topics)}
+    ids = corpus.ids if corpus.ids is not None \
+        else range(len(corpus.profiles))
+
+    sections = {name: array(typecode) for name, typecode in _SECTIONS}
+    sections['topic_offsets'], sections['topic_data'] = \
+        _encode_strings(topics)
+    sections['id_offsets'], sections['id_data'] = \
+        _encode_strings(str(profile_id) for profile_id in ids)
+    sections['indptr'].append(0)
+    postings = [[] for _ in topics]
+    for row, (profile, ranking) in enumerate(
+            zip(corpus.profiles, corpus.rankings)):
+        for topic_id, topic in sorted(
+                (topic_ids[topic], topic) for topic in profile):
+            sections['topic_ids'].append(topic_id)
+            sections['weights'].append(profile[topic])
+            sections['positions'].append(ranking[topic])
+            postings[topic_id].append((row, profile[topic]))
+        sections['indptr'].append(len(sections['topic_ids']))
+    sections['postings_indptr'].append(0)
+    for topic_postings in postings:
+        for row, weight in topic_postings:
+            sections['postings_rows'].append(row)
+            sections['postings_weights'].append(weight)
+        sections['postings_indptr'].append(len(sections['postings_rows']))
+
+    table = []
+    offset = _align(_HEADER.size)
+    for name, _ in _SECTIONS:
+        values = sections[name]
+        table += [offset, len(values)]
+        offset = _align(offset + len(values) * values.itemsize)
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, _BYTEORDERS[sys.byteorder],
+        bool(corpus.translate), len(corpus.profiles), *table)
+    with open(path, 'wb') as f:
+        f.write(header)
+        for i, (name, _) in enumerate(_SECTIONS):
+            f.write(b'\0' * (table[2*i] - f.tell()))
+            sections[name].tofile(f)
+
+
+class _Strings:
+    """
+    Sequence of the utf-8 strings of a section, decoded when accessed.
+    """
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._data[self._offsets[i]:self._offsets[i+1]],
+                   'utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def encoded(self, i):
+        return bytes(self._data[self._offsets[i]:self._offsets[i+1]])
+
+
+class _SortedTopicIds:
+    """
+    Association between topic names and ids, found by a binary search of
+    the sorted names. The ids found are cached.
+    """
+
+    def __init__(self, topics):
+        self._topics = topics
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._topics)
+
+    def get(self, topic, default=None):
+        topic_id = self._cache.get(topic)
+        if topic_id is not None:
+            return topic_id
+        encoded = topic.encode('utf-8')
+        low, high = 0, len(self._topics)
+        while low < high:
+            middle = (low + high) // 2
+            if self._topics.encoded(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self._topics) and \
+                self._topics.encoded(low) == encoded:
+            self._cache[topic] = low
+            return low
+        return default
+
+    def __contains__(self, topic):
+        return self.get(topic) is not None
+
+    def __getitem__(self, topic):
+        topic_id = self.get(topic)
+        if topic_id is None:
+            raise KeyError(topic)
+        return topic_id
+
+
+class MappedVocabulary:
+    """
+    The read-only Vocabulary of a columnar file.
+
+    Attributes:
+        ids: mapping where each topic name is associated with its id
+        topics: sequence with the topic name of each id
+    """
+
+    def __init__(self, offsets, data):
+        self.topics = _Strings(offsets, data)
+        self.ids = _SortedTopicIds(self.topics)
+
+    def __len__(self):
+        return len(self.topics)
+
+
+class _ProfileViews:
+    """
+    Sequence of the Profiles of a columnar file, whose arrays are views
+    of the mapped arrays.
+    """
+
+    def __init__(self, vocabulary, indptr, topic_ids, weights):
+        self._vocabulary = vocabulary
+        self._indptr = indptr
+        self._topic_ids = topic_ids
+        self._weights = weights
+
+    def __len__(self):
+        return len(self._indptr) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start = self._indptr[i]
+        end = self._indptr[i+1]
+        return Profile(self._vocabulary, self._topic_ids[start:end],
+                       self._weights[start:end])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class MappedIndex(TopicIndex):
+    """
+    The TopicIndex of a columnar file, whose postings are read from the
+    mapped arrays.
+    """
+
+    def __init__(self, vocabulary, indptr, rows, weights):
+        self.size = 0
+        self.postings = None
+        self._vocabulary = vocabulary
+        self._indptr = indptr
+        self._rows = rows
+        self._weights = weights
+
+    def get_postings(self, topic):
+        topic_id = self._vocabulary.ids.get(topic)
+        if topic_id is None:
+            return ()
+        start = self._indptr[topic_id]
+        end = self._indptr[topic_id+1]
+        if start == end:
+            return ()
+        return list(zip(self._rows[start:end], self._weights[start:end]))
+
+    def add(self, i, profile):
+        raise TypeError("a MappedIndex is read-only")
+
+    def remove(self, i, profile):
+        raise TypeError("a MappedIndex is read-only")
+
+    def move(self, i, j, profile):
+        raise TypeError("a MappedIndex is read-only")
+
+    def truncate(self, size):
+        raise TypeError("a MappedIndex is read-only")
+
+
+class MappedCorpus(Corpus):
+    """
+    A Corpus read in place from a columnar file.
+
+    The profiles and the rankings are Profiles whose arrays are views of
+    the mapped file, so both the algorithms use them directly, and the
+    TopicIndex and the SparseCorpus are views of the file too.
+
+    Attributes:
+        path: the path of the file
+    """
+
+    def __init__(self, path):
+        """
+        Open a columnar file.
+
+        Args:
+            path: the path of the file
+
+        Raises:
+            ValueError: the file is not a columnar corpus, or it was
+                written on a machine with a different byte order
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError("not a columnar corpus: %s" % path)
+        header = _HEADER.unpack_from(self._mmap)
+        magic, version, byteorder, translate, size = header[:5]
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("not a columnar corpus: %s" % path)
+        if byteorder != _BYTEORDERS[sys.byteorder]:
+            raise ValueError("%s was written with a different byte order"
+                             % path)
+        buffer = memoryview(self._mmap)
+        sections = {}
+        for i, (name, typecode) in enumerate(_SECTIONS):
+            offset, length = header[5 + 2*i], header[6 + 2*i]
+            itemsize = array(typecode).itemsize
+            sections[name] = buffer[
+                offset:offset + length * itemsize].cast(typecode)
+        self._sections = sections
+
+        vocabulary = MappedVocabulary(sections['topic_offsets'],
+                                      sections['topic_data'])
+        self.vocabulary = vocabulary
+        super().__init__(
+            _Strings(sections['id_offsets'], sections['id_data']),
+            _ProfileViews(vocabulary, sections['indptr'],
+                          sections['topic_ids'], sections['weights']),
+            _ProfileViews(vocabulary, sections['indptr'],
+                          sections['topic_ids'], sections['positions']),
+            translate)
+        self._index = MappedIndex(
+            vocabulary, sections['postings_indptr'],
+            sections['postings_rows'], sections['postings_weights'])
+        self._index.size = size
+
+    def __reduce__(self):
+        # a process which receives the corpus maps the same file
+        return (MappedCorpus, (self.path,))
+
+    @property
+    def sparse(self):
+        """
+        The SparseCorpus of the profiles, whose arrays are views of the
+        file. It requires NumPy.
+        """
+        if self._sparse is None:
+            if not HAS_NUMPY:
+                raise ImportError("NumPy is required by SparseCorpus")
+            sections = self._sections
+            self._sparse = SparseCorpus.from_arrays(
+                self.vocabulary.ids,
+                np.frombuffer(sections['indptr'], dtype=np.uint64),
+                np.frombuffer(sections['topic_ids'], dtype=np.uint32),
+                np.frombuffer(sections['weights'], dtype=np.float64),
+                np.frombuffer(sections['positions'], dtype=np.float64))
+        return self._sparse
@@ -0,0 +1,764 @@
+"""
+Contains the Corpus, i.e. the set of cmp_profiles already parsed and
+converted to percentages, so that it can be reused for many matchings,
+and the functions to compile it into a snapshot file and to load it
+back.
+
+A snapshot stores the parsed profiles together with their ids and their
+algorithm2 rankings, and it records the modification time, the size and
+the hash of each source file, so that it is rebuilt only when the
+content of the directory changes, and only for the files which changed.
+"""
+import hashlib
+import os
+import pickle
+from array import array
+from .parsing.parser import get_parsed_profile, get_parsed_profiles, \
+    values_to_percentage, reinit_after_fork, check_profile
+from .parsing.loader import get_profile_by_file, get_profile_filenames
+from .algorithm2 import get_normalized_ranking
+from .index import TopicIndex
+from .profile import Profile, Vocabulary
+from .vectorized import SparseCorpus
+from .workers import get_context
+from .stats import stage, count
+
+# increase it whenever the content of the snapshot changes
+SNAPSHOT_VERSION = 2
+SNAPSHOT_FILENAME = '.corpus.pickle'
+
+
+class Corpus:
+    """
+    A set of cmp_profiles ready to be used for the matching.
+
+    Attributes:
+        ids: the ids of the profiles, or None if they are not known
+        profiles: list of profiles where each topic is associated with
+            its percentage of discussions over all discussions
+        rankings: list with the algorithm2 ranking of each profile,
+            where each topic is associated with its normalized position
+        translate: True if the topics of the profiles are translated to
+            English
+        version: number of times the profiles have been modified
+    """
+
+    def __init__(self, ids, profiles, rankings, translate=False):
+        self.ids = ids
+        self.profiles = profiles
+        self.rankings = rankings
+        self.translate = translate
+        self.version = 0
+        self._index = None
+        self._sparse = None
+        self._prepared = {}
+
+    def __len__(self):
+        return len(self.profiles)
+
+    @property
+    def index(self):
+        """
+        The TopicIndex of the profiles, built the first time it is used.
+        """
+        if self._index is None:
+            self._index = TopicIndex(self.profiles)
+        return self._index
+
+    @property
+    def sparse(self):
+        """
+        The SparseCorpus of the profiles, built the first time it is 
+        used. It requires NumPy.
+        """
+        if self._sparse is None:
+            self._sparse = SparseCorpus(self.profiles, self.rankings)
+        return self._sparse
+
+    def get_prepared(self, prepare):
+        """
+        Get the values computed by the preprocessing of a scorer for 
+        each profile, computed the first time they are used.
+
+        Args:
+            prepare: function which takes a profile and returns a 
+                dictionary where each topic is associated with a value, 
+                see scorers.Scorer
+
+        Returns:
+            a list with the result of prepare for each profile
+        """
+        # the rankings of algorithm2 are always available
+        if prepare is get_normalized_ranking:
+            return self.rankings
+        prepared = self._prepared.get(prepare)
+        if prepared is None:
+            prepared = [prepare(profile) for profile in self.profiles]
+            self._prepared[prepare] = prepared
+        return prepared
+
+    def compact(self, vocabulary=None):
+        """
+        Get a copy of the corpus where profiles and rankings are
+        Profiles, which take much less memory than dictionaries.
+
+        Each topic name is stored once in the Vocabulary instead of once
+        in each profile, and the ranking of a profile shares the array
+        of its topic ids.
+
+        Args:
+            vocabulary (optional): the Vocabulary where the topics are
+                interned. By default a new one is created
+
+        Returns:
+            the compact corpus
+        """
+        if vocabulary is None:
+            vocabulary = Vocabulary()
+        profiles = []
+        rankings = []
+        for profile, ranking in zip(self.profiles, self.rankings):
+            profile = Profile.from_dict(profile, vocabulary)
+            profiles.append(profile)
+            if len(ranking) == len(profile):
+                # a ranking has the topics of its profile
+                ranking = Profile(vocabulary, profile.topic_ids, array(
+                    'd', [ranking[topic] for topic in profile]))
+            else:
+                ranking = Profile.from_dict(ranking, vocabulary)
+            rankings.append(ranking)
+        return Corpus(self.ids, profiles, rankings, self.translate)
+
+    @classmethod
+    def from_profiles(cls, cmp_profiles, cmp_ids=None, translate=False):
+        """
+        Build a corpus from raw profiles.
+
+        Args:
+            cmp_profiles: list of profiles where topics are urls of
+                Wikipedia categories
+            cmp_ids (optional): the ids of the cmp_profiles
+            translate (optional): if set to True, the topics of profiles
+                are translated to English when the translation is
+                available
+
+        Returns:
+            the corpus with the parsed profiles
+
+        Raises:
+            ValueError: cmp_ids size and cmp_profiles size do not
+                correspond
+        """
+        return cls.from_parsed(
+            get_parsed_profiles(cmp_profiles, translate), cmp_ids,
+            translate)
+
+    @classmethod
+    def from_parsed(cls, profiles, cmp_ids=None, translate=False):
+        """
+        Build a corpus from parsed profiles.
+
+        Args:
+            profiles: list of profiles where topics are names of
+                categories, as returned by get_parsed_profiles. They are
+                converted to percentages in place
+            cmp_ids (optional): the ids of the profiles
+            translate (optional): True if the topics of profiles are
+                translated to English
+
+        Returns:
+            the corpus with the given profiles
+
+        Raises:
+            ValueError: cmp_ids size and profiles size do not correspond
+        """
+        if cmp_ids and not len(cmp_ids) == len(profiles):
+            raise ValueError(
+                "cmp_ids size and cmp_profiles size do not correspond")
+        with stage('normalize'):
+            for profile in profiles:
+                values_to_percentage(profile)
+        with stage('ranking'):
+            rankings = [get_normalized_ranking(p) for p in profiles]
+        return cls(cmp_ids, profiles, rankings, translate)
+
+
+class MutableCorpus(Corpus):
+    """
+    A Corpus whose profiles can be added, removed and updated.
+
+    The raw counts of the topics of each profile are kept, so that when 
+    a profile changes only its percentages, its ranking and its entries 
+    in the TopicIndex are computed again. Each change increases the 
+    version of the corpus.
+
+    Attributes:
+        counts: list of profiles where each topic is associated with the 
+            number of times the profile has discussed it
+        totals: list with the total number of discussions of each 
+            profile
+    """
+
+    def __init__(self, ids, counts, translate=False):
+        """
+        Build the corpus of the given counts.
+
+        Args:
+            ids: the ids of the profiles
+            counts: list of parsed profiles, where each topic is 
+                associated with the number of times the profile has 
+                discussed it
+            translate (optional): True if the topics of profiles are 
+                translated to English
+
+        Raises:
+            ValueError: ids size and counts size do not correspond, or 
+                there are duplicated ids
+        """
+        if not len(ids) == len(counts):
+            raise ValueError(
+                "cmp_ids size and cmp_profiles size do not correspond")
+        if not len(set(ids)) == len(ids):
+            raise ValueError("cmp_ids must be unique")
+        super().__init__(list(ids), [], [], translate)
+        self.counts = []
+        self.totals = []
+        self._positions = {}
+        for profile_id, profile_counts in zip(ids, counts):
+            self._append(profile_id, profile_counts)
+
+    @classmethod
+    def from_parsed(cls, profiles, cmp_ids=None, translate=False):
+        """
+        Build a corpus from parsed profiles.
+
+        Args:
+            profiles: list of profiles where topics are names of 
+                categories, as returned by get_parsed_profiles
+            cmp_ids: the ids of the profiles
+            translate (optional): True if the topics of profiles are 
+                translated to English
+
+        Returns:
+            the corpus with the given profiles
+
+        Raises:
+            ValueError: cmp_ids are missing, their size and profiles 
+                size do not correspond, or there are duplicated ids
+        """
+        if not cmp_ids:
+            raise ValueError("a MutableCorpus needs the cmp_ids")
+        return cls(cmp_ids, profiles, translate)
+
+    def _derive(self, i):
+        """
+        Compute the percentages and the ranking of the i-th profile from 
+        its counts, and update the derived structures.
+
+        Args:
+            i: the index of the profile
+        """
+        coefficient = 100 / self.totals[i]
+        profile = {topic: times * coefficient
+                   for topic, times in self.counts[i].items()}
+        ranking = get_normalized_ranking(profile)
+        if self._index is not None:
+            if i < len(self.profiles):
+                self._index.remove(i, self.profiles[i])
+            self._index.add(i, profile)
+        if i < len(self.profiles):
+            self.profiles[i] = profile
+            self.rankings[i] = ranking
+        else:
+            self.profiles.append(profile)
+            self.rankings.append(ranking)
+        # the sparse matrix and the values of the scorers are not 
+        # updated in place
+        self._sparse = None
+        self._prepared = {}
+
+    def _append(self, profile_id, counts):
+        counts = {topic: times for topic, times in counts.items()
+                  if times > 0}
+        if not counts:
+            raise ValueError("profile %s has no discussions" % profile_id)
+        self._positions[profile_id] = len(self.counts)
+        self.counts.append(counts)
+        self.totals.append(sum(counts.values()))
+        self._derive(len(self.counts) - 1)
+
+    def __contains__(self, profile_id):
+        return profile_id in self._positions
+
+    def add_profile(self, profile_id, profile):
+        """
+        Add a profile to the corpus.
+
+        Args:
+            profile_id: the id of the profile
+            profile: profile where topics are urls of Wikipedia 
+                categories
+
+        Raises:
+            ValueError: a profile with the same id is in the corpus, or 
+                the profile has no discussions
+            requests.exceptions.RequestException: the translation of the 
+                topics failed. The corpus is not changed
+        """
+        if profile_id in self._positions:
+            raise ValueError("profile %s already exists" % profile_id)
+        # the profile is parsed before any change, since the translation 
+        # can fail
+        counts = get_parsed_profile(profile, self.translate)
+        self.ids.append(profile_id)
+        try:
+            self._append(profile_id, counts)
+        except BaseException:
+            self.ids.pop()
+            raise
+        self.version += 1
+
+    def remove_profile(self, profile_id):
+        """
+        Remove a profile from the corpus.
+
+        The last profile of the corpus takes the place of the removed 
+        one, so the indexes of the other profiles do not change.
+
+        Args:
+            profile_id: the id of the profile
+
+        Raises:
+            KeyError: there is no profile with the given id
+        """
+        i = self._positions.pop(profile_id)
+        last = len(self.profiles) - 1
+        if self._index is not None:
+            self._index.remove(i, self.profiles[i])
+            if i != last:
+                self._index.move(last, i, self.profiles[last])
+            self._index.truncate(last)
+        for values in (self.ids, self.profiles, self.rankings, self.counts,
+                       self.totals):
+            values[i] = values[last]
+            values.pop()
+        if i != last:
+            self._positions[self.ids[i]] = i
+        self._sparse = None
+        self._prepared = {}
+        self.version += 1
+
+    def update_counts(self, profile_id, deltas):
+        """
+        Change the number of discussions of some topics of a profile.
+
+        Args:
+            profile_id: the id of the profile
+            deltas: dictionary where topics, as urls of Wikipedia 
+                categories, are associated with the number of 
+                discussions to add (or to remove, if negative). Topics 
+                whose number of discussions is no more positive are 
+                removed from the profile
+
+        Raises:
+            KeyError: there is no profile with the given id
+            ValueError: the profile would have no discussions
+        """
+        i = self._positions[profile_id]
+        counts = dict(self.counts[i])
+        for topic, delta in get_parsed_profile(
+                deltas, self.translate).items():
+            times = counts.get(topic, 0) + delta
+            if times > 0:
+                counts[topic] = times
+            else:
+                counts.pop(topic, None)
+        if not counts:
+            raise ValueError("profile %s has no discussions" % profile_id)
+        self.counts[i] = counts
+        self.totals[i] = sum(counts.values())
+        self._derive(i)
+        self.version += 1
+
+
+def prepare_profile_file(path, translate=False):
+    """
+    Read a profile file and prepare it for the matching.
+
+    Args:
+        path: the path of the json file of the profile
+        translate (optional): if set to True, the topics of the profile
+            are translated to English when the translation is available
+
+    Returns:
+        a tuple with the id of the profile, the parsed profile where
+        each topic is associated with its percentage of discussions, and
+        its normalized ranking
+    """
+    profile_id, profile = get_profile_by_file(path)
+    profile = get_parsed_profile(profile, translate)
+    values_to_percentage(profile)
+    return profile_id, profile, get_normalized_ranking(profile)
+
+
+def _prepare_profile_file(args):
+    return prepare_profile_file(*args)
+
+
+def iter_prepared_profiles(profiles_dir, translate=False, processes=None,
+                           chunksize=16):
+    """
+    Read and prepare the profiles in a directory in parallel.
+
+    The files are read, parsed and converted to percentages by a pool
+    of worker processes, and the prepared profiles are yielded as soon
+    as they are ready, so that the caller can use them while the next
+    ones are prepared. The raw profiles never leave the workers.
+
+    With translate set to True each profile is translated on its own,
+    so a topic shared by many profiles is requested more times, unless
+    a TranslationCache is set.
+
+    Args:
+        profiles_dir: the directory containing the profiles
+        translate (optional): if set to True, the topics of profiles
+            are translated to English when the translation is available
+        processes (optional): the number of worker processes. By
+            default the number of cpus
+        chunksize (optional): the number of files sent to a worker at a
+            time
+
+    Yields:
+        a tuple with the id of a profile, the parsed profile and its
+        normalized ranking, in the order of the file names
+
+    Raises:
+        IsADirectoryError: there is a subdirectory with '.json'
+            extension
+        json.decoder.JSONDecodeError: there is a file with '.json'
+            extension which is not a valid json file
+    """
+    tasks = ((os.path.join(profiles_dir, filename), translate)
+             for filename in sorted(get_profile_filenames(profiles_dir)))
+    with get_context().Pool(processes, reinit_after_fork) as pool:
+        for entry in pool.imap(_prepare_profile_file, tasks, chunksize):
+            yield entry
+
+
+def load_corpus_parallel(profiles_dir, translate=False, processes=None):
+    """
+    Load the corpus of the profiles in a directory, preparing them in
+    parallel.
+
+    Args:
+        profiles_dir: the directory containing the profiles
+        translate (optional): if set to True, the topics of profiles
+            are translated to English when the translation is available
+        processes (optional): the number of worker processes. By
+            default the number of cpus
+
+    Returns:
+        the corpus with the parsed profiles of the directory
+    """
+    ids = []
+    profiles = []
+    rankings = []
+    for profile_id, profile, ranking in iter_prepared_profiles(
+            profiles_dir, translate, processes):
+        ids.append(profile_id)
+        profiles.append(profile)
+        rankings.append(ranking)
+    return Corpus(ids, profiles, rankings, translate)
+
+
+def _file_hash(path):
+    """
+    Compute the hash of the content of a file.
+
+    Args:
+        path: the path of the file
+
+    Returns:
+        the hex digest of the sha1 of the file content
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _default_snapshot_path(profiles_dir):
+    return os.path.join(profiles_dir, SNAPSHOT_FILENAME)
+
+
+def get_sources(profiles_dir):
+    """
+    Describe the profile files in a directory.
+
+    Args:
+        profiles_dir: the directory containing the profiles
+
+    Returns:
+        a dictionary where each file name is associated with a tuple
+        with its modification time (ns) and its size
+    """
+    sources = {}
+    for filename in sorted(get_profile_filenames(profiles_dir)):
+        stat = os.stat(os.path.join(profiles_dir, filename))
+        sources[filename] = (stat.st_mtime_ns, stat.st_size)
+    return sources
+
+
+def _is_fresh(snapshot, profiles_dir, translate):
+    """
+    Check if a snapshot reflects the current content of a directory.
+
+    A file whose modification time or size changed is hashed, so that a
+    file which is only touched does not invalidate the snapshot. The
+    modification time and the size of such a file are updated in the
+    snapshot, so that it is not hashed again at the next check.
+
+    Args:
+        snapshot: the dictionary loaded from the snapshot file
+        profiles_dir: the directory containing the profiles
+        translate: True if the profiles need to be translated
+
+    Returns:
+        a tuple with True if the snapshot can be used, and True if the
+        description of some source files was updated
+    """
+    if snapshot.get('version') != SNAPSHOT_VERSION or \
+            snapshot['translate'] != translate or snapshot.get('invalid'):
+        # the invalid files skipped by the service are reported again
+        return False, False
+    stored = snapshot['sources']
+    current = get_sources(profiles_dir)
+    if stored.keys() != current.keys():
+        return False, False
+    touched = {}
+    for filename, (mtime, size, digest) in stored.items():
+        if current[filename] != (mtime, size):
+            path = os.path.join(profiles_dir, filename)
+            if _file_hash(path) != digest:
+                return False, False
+            touched[filename] = current[filename] + (digest,)
+    stored.update(touched)
+    return True, bool(touched)
+
+
+def _reusable_entries(snapshot, translate):
+    """
+    Collect the entries of a snapshot which can be reused.
+
+    Args:
+        snapshot: the dictionary loaded from the snapshot file, or None
+        translate: True if the profiles need to be translated
+
+    Returns:
+        a dictionary where a tuple with the name and the hash of each 
+        source file of the snapshot is associated with a tuple with the 
+        id, the parsed profile and the ranking obtained from it
+    """
+    if not snapshot or snapshot.get('version') != SNAPSHOT_VERSION or \
+            snapshot['translate'] != translate:
+        return {}
+    entries = {}
+    for i, filename in enumerate(snapshot['filenames']):
+        digest = snapshot['sources'][filename][2]
+        entries[(filename, digest)] = (
+            snapshot['ids'][i], snapshot['profiles'][i],
+            snapshot['rankings'][i])
+    return entries
+
+
+def build_snapshot(profiles_dir, translate=False, previous=None,
+                   skip_invalid=False):
+    """
+    Parse the profiles in a directory and build their snapshot, without 
+    writing it.
+
+    Args:
+        profiles_dir: the directory containing the profiles
+        translate (optional): if set to True, the topics of profiles
+            are translated to English when the translation is available
+        previous (optional): a previously built snapshot. The parsed 
+            profiles and the rankings of the files which did not change 
+            are taken from it instead of being computed again
+        skip_invalid (optional): if set to True, the files which are 
+            not valid json or whose profile cannot be matched (see 
+            parser.check_profile) are left out of the corpus instead of 
+            raising an error. They are still described in the sources, 
+            so they are read again only when they change
+
+    Returns:
+        the snapshot, i.e. a dictionary with the parsed profiles, their 
+        ids and rankings, the description of the source files and, in 
+        'invalid', the error of each skipped file
+
+    Raises:
+        IsADirectoryError: there is a subdirectory with '.json'
+            extension
+        json.decoder.JSONDecodeError: there is a file with '.json'
+            extension which is not a valid json file, and skip_invalid 
+            is False
+    """
+    reusable = _reusable_entries(previous, translate)
+    filenames = []
+    sources = {}
+    invalid = {}
+    entries = []
+    # the positions in entries of the profiles which need to be parsed
+    to_parse = []
+    raw_profiles = []
+    raw_ids = []
+    for filename, (mtime, size) in get_sources(profiles_dir).items():
+        path = os.path.join(profiles_dir, filename)
+        digest = _file_hash(path)
+        sources[filename] = (mtime, size, digest)
+        if (filename, digest) in reusable:
+            filenames.append(filename)
+            entries.append(reusable[(filename, digest)])
+        else:
+            try:
+                profile_id, profile = get_profile_by_file(path)
+                if skip_invalid:
+                    check_profile(profile)
+            except ValueError as ex:
+                # json.decoder.JSONDecodeError is a ValueError
+                if not skip_invalid:
+                    raise
+                invalid[filename] = str(ex)
+                continue
+            filenames.append(filename)
+            to_parse.append(len(entries))
+            raw_ids.append(profile_id)
+            raw_profiles.append(profile)
+            entries.append(None)
+    parsed = Corpus.from_profiles(raw_profiles, raw_ids, translate)
+    for j, i in enumerate(to_parse):
+        entries[i] = (parsed.ids[j], parsed.profiles[j], parsed.rankings[j])
+
+    return {
+        'version': SNAPSHOT_VERSION,
+        'translate': translate,
+        'filenames': filenames,
+        'sources': sources,
+        'invalid': invalid,
+        'ids': [entry[0] for entry in entries],
+        'profiles': [entry[1] for entry in entries],
+        'rankings': [entry[2] for entry in entries],
+    }
+
+
+def snapshot_to_corpus(snapshot):
+    """
+    Get the corpus stored in a snapshot.
+
+    Args:
+        snapshot: the snapshot, as returned by build_snapshot
+
+    Returns:
+        the corpus with the profiles of the snapshot
+    """
+    return Corpus(snapshot['ids'], snapshot['profiles'],
+                  snapshot['rankings'], snapshot['translate'])
+
+
+def read_snapshot(snapshot_path):
+    """
+    Read a snapshot file.
+
+    Args:
+        snapshot_path: the path of the snapshot file
+
+    Returns:
+        the snapshot, or None if the file is missing or not valid
+    """
+    try:
+        with open(snapshot_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def write_snapshot(snapshot, snapshot_path):
+    """
+    Write a snapshot file.
+
+    The snapshot is written to a temporary file first, so that a 
+    concurrent reader never sees a partially written snapshot.
+
+    Args:
+        snapshot: the snapshot, as returned by build_snapshot
+        snapshot_path: the path of the snapshot file
+    """
+    tmp_path = snapshot_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, snapshot_path)
+
+
+def compile_corpus(profiles_dir, snapshot_path=None, translate=False,
+                   previous=None):
+    """
+    Parse the profiles in a directory and write them in a snapshot.
+
+    Args:
+        profiles_dir: the directory containing the profiles
+        snapshot_path (optional): the path of the snapshot file. By
+            default it is stored in profiles_dir
+        translate (optional): if set to True, the topics of profiles
+            are translated to English when the translation is available
+        previous (optional): a previously loaded snapshot. The parsed 
+            profiles and the rankings of the files which did not change 
+            are taken from it instead of being computed again
+
+    Returns:
+        the compiled corpus
+
+    Raises:
+        IsADirectoryError: there is a subdirectory with '.json'
+            extension
+        json.decoder.JSONDecodeError: there is a file with '.json'
+            extension which is not a valid json file
+    """
+    if snapshot_path is None:
+        snapshot_path = _default_snapshot_path(profiles_dir)
+    snapshot = build_snapshot(profiles_dir, translate, previous)
+    write_snapshot(snapshot, snapshot_path)
+    return snapshot_to_corpus(snapshot)
+
+
+def load_corpus(profiles_dir, snapshot_path=None, translate=False):
+    """
+    Load the corpus of the profiles in a directory from its snapshot.
+
+    The snapshot is recompiled if it is missing, if it was written by a 
+    different version or if the profiles in the directory changed. In 
+    the last case only the profiles of the files which were added or 
+    modified are parsed and ranked again.
+
+    Args:
+        profiles_dir: the directory containing the profiles
+        snapshot_path (optional): the path of the snapshot file. By
+            default it is stored in profiles_dir
+        translate (optional): if set to True, the topics of profiles
+            are translated to English when the translation is available
+
+    Returns:
+        the corpus with the parsed profiles of the directory
+    """
+    if snapshot_path is None:
+        snapshot_path = _default_snapshot_path(profiles_dir)
+    with stage('load_snapshot'):
+        snapshot = read_snapshot(snapshot_path)
+    fresh, touched = _is_fresh(snapshot, profiles_dir, translate) \
+        if snapshot is not None else (False, False)
+    if not fresh:
+        count('snapshot_misses')
+        with stage('compile_snapshot'):
+            return compile_corpus(profiles_dir, snapshot_path, translate,
+                                  snapshot)
+    count('snapshot_hits')
+    if touched:
+        # the files which were only touched are not hashed again
+        write_snapshot(snapshot, snapshot_path)
+    return snapshot_to_corpus(snapshot)
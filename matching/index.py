@@ -0,0 +1,107 @@
+"""
+Contains the inverted index of the topics of a set of profiles.
+
+The index associates each topic with the profiles which discussed it,
+so that the comparison of a profile with the whole set only visits the
+profiles which share at least one topic with it.
+"""
+
+
+class TopicIndex:
+    """
+    Inverted index from topics to the profiles which discussed them.
+
+    Attributes:
+        size: the number of indexed profiles
+        postings: a dictionary where each topic is associated with a
+            dictionary where the index of each profile which discussed
+            the topic is associated with the value of the topic in that
+            profile
+    """
+
+    def __init__(self, profiles):
+        """
+        Build the index of the given profiles.
+
+        Args:
+            profiles: list of profiles where each topic is associated
+                with its value
+        """
+        self.size = 0
+        self.postings = {}
+        for profile in profiles:
+            self.add(self.size, profile)
+
+    def __len__(self):
+        return self.size
+
+    def get_postings(self, topic):
+        """
+        Get the profiles which discussed a topic.
+
+        Args:
+            topic: the topic to look for
+
+        Returns:
+            an iterable of tuples with the index of a profile and the
+            value of the topic in that profile, empty if no profile
+            discussed the topic
+        """
+        postings = self.postings.get(topic)
+        return postings.items() if postings is not None else ()
+
+    def add(self, i, profile):
+        """
+        Add the topics of a profile to the index.
+
+        Args:
+            i: the index of the profile. If it is not lower than size,
+                the size is increased to i + 1
+            profile: the profile, where each topic is associated with
+                its value
+        """
+        for topic, value in profile.items():
+            if topic not in self.postings:
+                self.postings[topic] = {}
+            self.postings[topic][i] = value
+        self.size = max(self.size, i + 1)
+
+    def remove(self, i, profile):
+        """
+        Remove the topics of a profile from the index.
+
+        The size of the index does not change.
+
+        Args:
+            i: the index of the profile
+            profile: the profile, as it was when it was added
+        """
+        for topic in profile:
+            postings = self.postings[topic]
+            del postings[i]
+            if not postings:
+                del self.postings[topic]
+
+    def truncate(self, size):
+        """
+        Reduce the size of the index.
+
+        Args:
+            size: the new size. The profiles with an index not lower 
+                than it must have been removed or moved
+        """
+        self.size = min(self.size, size)
+
+    def move(self, i, j, profile):
+        """
+        Change the index of a profile.
+
+        Args:
+            i: the current index of the profile
+            j: the new index of the profile, which must not be used by
+                another profile
+            profile: the profile, as it was when it was added
+        """
+        for topic in profile:
+            postings = self.postings[topic]
+            postings[j] = postings.pop(i)
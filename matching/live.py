@@ -0,0 +1,350 @@
+"""
+Contains the LiveQuery, a profile matched continuously against a corpus
+while the numbers of discussions of its topics change.
+
+The query keeps the raw counts of its topics and, for each scorer, the
+contribution of each topic it shares with each cmp_profile, in a list
+aligned with the postings of the topic in the TopicIndex. An update only
+changes the counts: the match_values are brought up to date the first
+time they are read, so a burst of updates is scored once. Then only the
+contributions which changed are computed again, by walking the postings
+of their topics, and the match_values of the cmp_profiles sharing those
+topics are summed again.
+
+A contribution changes when the percentage of its topic changes or, for
+the scorers with a prepare function like algorithm2, when the value
+prepared for the topic changes (e.g. its position in the ranking). The
+ranking of the query is built again only when its percentages change,
+which only costs the sorting of its topics, and only the topics whose
+position moved are scored again.
+
+The contributions are not linear in the percentages, and the
+match_values must be the ones computed from scratch, so they cannot be
+rescaled when the total number of discussions of the query changes: all
+the percentages change and all the topics are scored again. So the cost
+of an update is proportional to the postings of the changed topics only
+when the total does not change (e.g. a discussion moved from a topic to
+another), and otherwise it is the cost of the scoring of a match, in a
+single pass as in scorers.score (see the live report of
+benchmarks/run.py).
+
+The match_values are always summed in the order of the topics of the
+profile, as in matcher.match, so they are equal to the ones computed
+from scratch. The contributions kept take memory proportional to the
+number of pairs of a cmp_profile and a topic shared with the profile.
+"""
+from .corpus import Corpus
+from .matcher import get_scorers
+from .parsing.parser import get_parsed_profile
+from .stats import stage, count
+
+
+class LiveQuery:
+    """
+    A profile whose match_values with a corpus are kept up to date while
+    its counts change.
+
+    If the version of the corpus changes (see MutableCorpus), the
+    match_values are computed again from scratch at the next read.
+
+    Attributes:
+        corpus: the Corpus of the cmp_profiles
+        translate: True if the topics are translated to English
+        scorers: the Scorers of the algorithms
+        counts: dictionary where each topic is associated with the
+            number of times the profile has discussed it
+        profile: dictionary where each topic is associated with its
+            percentage of discussions, when the match_values were last
+            read
+    """
+
+    def __init__(self, profile, corpus, translate=False, algorithms=None):
+        """
+        Match a profile against a corpus.
+
+        Args:
+            profile: profile where topics are urls of Wikipedia
+                categories
+            corpus: the Corpus of the cmp_profiles
+            translate (optional): if set to True, the topics of the
+                profile are translated to English when the translation
+                is available. It should be the same of the corpus
+            algorithms (optional): list with the names of the algorithms
+                to run, see scorers.py. By default ALGORITHMS
+
+        Raises:
+            TypeError: corpus is not a Corpus
+            ValueError: the profile has no discussions, or an algorithm
+                is not registered
+        """
+        if not isinstance(corpus, Corpus):
+            raise TypeError("a LiveQuery needs a Corpus")
+        self.corpus = corpus
+        self.translate = translate
+        self.scorers = get_scorers(algorithms)
+        self.counts = {}
+        parsed = get_parsed_profile(profile, translate)
+        for topic, times in parsed.items():
+            if times > 0:
+                self.counts[topic] = times
+        if not self.counts:
+            raise ValueError("the profile has no discussions")
+        # the topics removed from counts since the last scoring
+        self._removed = set()
+        self._stale = False
+        self._rebuild()
+
+    def _normalize(self):
+        coefficient = 100 / sum(self.counts.values())
+        self.profile = {topic: times * coefficient
+                        for topic, times in self.counts.items()}
+
+    def _prepare(self):
+        self._prepared = [
+            scorer.prepare(self.profile) if scorer.prepare else None
+            for scorer in self.scorers]
+
+    def _get_topic_values(self, n, topic, postings, cmp_prepared):
+        """
+        Compute the contributions of a topic with a scorer.
+
+        Returns:
+            a list with the contribution to each cmp_profile which
+            discussed the topic, in the order of the postings
+        """
+        contribution = self.scorers[n].contribution
+        value1 = self.profile[topic]
+        prepared1 = self._prepared[n]
+        if prepared1 is None:
+            return [contribution(value1, value2) for _, value2 in postings]
+        topic_prepared1 = prepared1[topic]
+        return [contribution(value1, value2, topic_prepared1,
+                             cmp_prepared[i][topic])
+                for i, value2 in postings]
+
+    def _score_all(self, n, cmp_prepared):
+        """
+        Compute all the contributions and the match_values of a scorer,
+        in the same order of scorers.score.
+        """
+        index = self.corpus.index
+        contributions = {}
+        values = [0] * len(self.corpus)
+        for topic in self.profile:
+            postings = index.get_postings(topic)
+            topic_values = self._get_topic_values(
+                n, topic, postings, cmp_prepared)
+            for (i, _), value in zip(postings, topic_values):
+                values[i] += value
+            contributions[topic] = topic_values
+        self._contributions[n] = contributions
+        self._values[n] = values
+        self._best[n] = self._find_best(values)
+        count('live_rescored', self._postings)
+
+    def _rebuild(self):
+        """
+        Compute all the contributions and the match_values.
+        """
+        with stage('live_rebuild'):
+            self._normalize()
+            self._prepare()
+            self._removed.clear()
+            self._stale = False
+            self._version = self.corpus.version
+            # the topics shared with each cmp_profile, in the order of
+            # the profile, with the position of the cmp_profile in their
+            # postings
+            self._shared = {}
+            self._postings = 0
+            for topic in self.profile:
+                self._add_shared(topic)
+            self._contributions = [None] * len(self.scorers)
+            self._values = [None] * len(self.scorers)
+            self._best = [None] * len(self.scorers)
+            for n, cmp_prepared in enumerate(self._get_cmp_prepared()):
+                self._score_all(n, cmp_prepared)
+
+    def _get_cmp_prepared(self):
+        return [self.corpus.get_prepared(scorer.prepare)
+                if scorer.prepare else None for scorer in self.scorers]
+
+    @staticmethod
+    def _find_best(values):
+        # the same of matcher.get_best_match
+        best, best_value = None, 0
+        for i, value in enumerate(values):
+            if value > best_value:
+                best, best_value = i, value
+        return best
+
+    def update(self, deltas):
+        """
+        Change the number of discussions of some topics of the profile.
+
+        The match_values are updated the next time they are read, so
+        consecutive updates are scored together.
+
+        Args:
+            deltas: dictionary where topics, as urls of Wikipedia
+                categories, are associated with the number of
+                discussions to add (or to remove, if negative). Topics
+                whose number of discussions is no more positive are
+                removed from the profile
+
+        Raises:
+            ValueError: the profile would have no discussions
+        """
+        count('live_updates')
+        parsed = get_parsed_profile(deltas, self.translate)
+        changes = {topic: self.counts.get(topic, 0) + delta
+                   for topic, delta in parsed.items()}
+        added = sum(1 for topic, times in changes.items()
+                    if times > 0 and topic not in self.counts)
+        removed = sum(1 for topic, times in changes.items()
+                      if times <= 0 and topic in self.counts)
+        if len(self.counts) + added - removed == 0:
+            raise ValueError("the profile would have no discussions")
+
+        for topic, times in changes.items():
+            if times > 0:
+                self.counts[topic] = times
+            elif topic in self.counts:
+                del self.counts[topic]
+                # if it is discussed again, it follows the other topics
+                self._removed.add(topic)
+        self._stale = True
+
+    def _refresh(self):
+        """
+        Bring the match_values up to date with the counts.
+        """
+        if self._version != self.corpus.version:
+            self._rebuild()
+            return
+        if not self._stale:
+            return
+
+        with stage('live_update'):
+            old_profile, old_prepared = self.profile, self._prepared
+            self._normalize()
+            self._stale = False
+            # the topics added since the last scoring are the last ones
+            # of counts, so they follow the other topics in _shared too
+            removed = [topic for topic in self._removed
+                       if topic in old_profile]
+            added = [topic for topic in self.profile
+                     if topic not in old_profile or topic in self._removed]
+            self._removed.clear()
+            for topic in removed:
+                self._remove_shared(topic)
+            for topic in added:
+                self._add_shared(topic)
+            # when the total changes, all the percentages change
+            changed = set(removed).union(added, (
+                topic for topic, value in self.profile.items()
+                if old_profile.get(topic, value) != value))
+            if not changed:
+                # e.g. the updates cancelled each other out
+                return
+            self._prepare()
+            cmp_prepared = self._get_cmp_prepared()
+            for n, scorer in enumerate(self.scorers):
+                topics = changed
+                if scorer.prepare is not None:
+                    prepared, old = self._prepared[n], old_prepared[n]
+                    topics = changed.union(
+                        topic for topic in prepared
+                        if prepared[topic] != old.get(topic))
+                self._rescore(n, topics, cmp_prepared[n])
+
+    def _add_shared(self, topic):
+        # a new topic is the last one of the profile
+        postings = self.corpus.index.get_postings(topic)
+        self._postings += len(postings)
+        for j, (i, _) in enumerate(postings):
+            self._shared.setdefault(i, []).append((topic, j))
+
+    def _remove_shared(self, topic):
+        postings = self.corpus.index.get_postings(topic)
+        self._postings -= len(postings)
+        for j, (i, _) in enumerate(postings):
+            shared = self._shared[i]
+            shared.remove((topic, j))
+            if not shared:
+                del self._shared[i]
+
+    def _rescore(self, n, topics, cmp_prepared):
+        """
+        Compute again the contributions of some topics for a scorer, and
+        the match_values of the cmp_profiles which share them.
+        """
+        index = self.corpus.index
+        postings = {topic: index.get_postings(topic) for topic in topics}
+        scored = sum(len(topic_postings)
+                     for topic_postings in postings.values())
+        if 2 * scored > self._postings:
+            # most of the contributions change
+            self._score_all(n, cmp_prepared)
+            return
+        count('live_rescored', scored)
+
+        contributions = self._contributions[n]
+        values = self._values[n]
+        dirty = set()
+        for topic, topic_postings in postings.items():
+            if topic in self.profile:
+                contributions[topic] = self._get_topic_values(
+                    n, topic, topic_postings, cmp_prepared)
+            else:
+                contributions.pop(topic, None)
+            dirty.update(i for i, _ in topic_postings)
+
+        best = self._best[n]
+        best_value = values[best] if best is not None else 0
+        for i in dirty:
+            # summed in the order of the topics of the profile
+            value = 0
+            for topic, j in self._shared.get(i, ()):
+                value += contributions[topic][j]
+            values[i] = value
+        if best is not None and best in dirty and values[best] < best_value:
+            self._best[n] = self._find_best(values)
+            return
+        for i in dirty:
+            if values[i] > best_value or \
+                    (values[i] == best_value and best_value > 0 and
+                     i < best):
+                best, best_value = i, values[i]
+        self._best[n] = best
+
+    @property
+    def match_values(self):
+        """
+        A list with the match_values of each scorer.
+        """
+        self._refresh()
+        return self._values
+
+    @property
+    def best_matches(self):
+        """
+        The id of the most similar cmp_profile for each scorer, or None
+        if no cmp_profile shares a topic with the profile.
+        """
+        self._refresh()
+        ids = self.corpus.ids
+        return [(ids[best] if ids else best) if best is not None else None
+                for best in self._best]
+
+    def results(self):
+        """
+        Get the results of the matching, as returned by matcher.match.
+
+        Returns:
+            a list with a tuple for each of the algorithms, with the id
+            of the most similar cmp_profile and a copy of the
+            match_values
+        """
+        return [(best_match, list(values)) for best_match, values in
+                zip(self.best_matches, self._values)]
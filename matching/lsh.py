@@ -0,0 +1,177 @@
+"""
+Contains an approximate pre-filter of the cmp_profiles based on weighted
+MinHash and Locality Sensitive Hashing.
+
+The signature of a profile holds, for each of bands * rows hash
+functions, the hash of the topic which wins a race among all the topics
+of the profile: the hash function gives each topic a pseudo-random
+value u in (0, 1], and the winner is the topic with the lowest
+-ln(u) / p, where p is its percentage of discussions (P-MinHash). Every
+topic with a positive percentage takes part, and it wins with a
+probability proportional to its percentage, so the long tail of the
+topics of a profile counts as much as its weight.
+
+Two profiles agree on a value of their signatures with a probability
+never lower than their weighted Jaccard similarity S / (200 - S), where
+S is the sum over the shared topics of the lowest of the two
+percentages, the upper bound of both the algorithms (see topk.py).
+
+The signature is split in bands of rows values, and the profiles which
+agree on all the values of at least one band are candidates. The
+probability of a pair with similarity s to be a candidate is at least
+1 - (1 - s^rows)^bands: more bands or fewer rows find more candidates
+(higher recall, slower), fewer bands or more rows find fewer.
+
+The pre-filter is approximate: a cmp_profile which is not a candidate
+is not evaluated, even if it shares some topics with the profile. A
+profile without discussed topics has no signature: it is never a
+candidate, and it has no candidates.
+"""
+import math
+import random
+import zlib
+from .vectorized import HAS_NUMPY, np
+
+# the prime modulus of the hash functions, the Mersenne prime 2^31 - 1
+_PRIME = (1 << 31) - 1
+BANDS = 32
+ROWS = 1
+
+
+def get_weighted_topics(profile):
+    """
+    Get the hashes of the discussed topics of a profile with their
+    percentages.
+
+    Args:
+        profile: a profile where each topic is associated with its
+            percentage of discussions
+
+    Returns:
+        a tuple with the list of the hashes of the topics with a
+        positive percentage and the list of their percentages
+    """
+    hashes = []
+    weights = []
+    for topic, value in profile.items():
+        if value > 0:
+            hashes.append(zlib.crc32(topic.encode('utf-8')) % _PRIME)
+            weights.append(value)
+    return hashes, weights
+
+
+class LSHIndex:
+    """
+    MinHash signatures of a set of profiles, grouped in LSH buckets.
+
+    Attributes:
+        bands: the number of bands of the signatures
+        rows: the number of values of each band
+        seed: the seed of the hash functions
+        size: the number of indexed profiles
+        buckets: a list with a dictionary for each band, where the
+            values of the band are associated with the list of the
+            indexes of the profiles which have them
+    """
+
+    def __init__(self, profiles, bands=BANDS, rows=ROWS, seed=0):
+        """
+        Build the index of the given profiles.
+
+        Args:
+            profiles: list of profiles where each topic is associated
+                with its percentage of discussions
+            bands (optional): the number of bands
+            rows (optional): the number of values of each band
+            seed (optional): the seed of the hash functions
+        """
+        self.bands = bands
+        self.rows = rows
+        self.seed = seed
+        rng = random.Random(seed)
+        self._coefficients = [(rng.randrange(1, _PRIME),
+                               rng.randrange(0, _PRIME))
+                              for _ in range(bands * rows)]
+        if HAS_NUMPY:
+            self._a = np.array([a for a, _ in self._coefficients],
+                               dtype=np.uint64)[:, None]
+            self._b = np.array([b for _, b in self._coefficients],
+                               dtype=np.uint64)[:, None]
+        self.size = 0
+        self.buckets = [{} for _ in range(bands)]
+        for profile in profiles:
+            self.add(self.size, profile)
+
+    def __len__(self):
+        return self.size
+
+    def get_signature(self, profile):
+        """
+        Compute the weighted MinHash signature of a profile.
+
+        Args:
+            profile: a profile where each topic is associated with its
+                percentage of discussions
+
+        Returns:
+            a list with the hash of the topic which wins the race of
+            each hash function, or None if the profile has no topic
+            with a positive percentage
+        """
+        hashes, weights = get_weighted_topics(profile)
+        if not hashes:
+            return None
+        if HAS_NUMPY:
+            # a * h < 2^62, so the products do not overflow
+            values = np.array(hashes, dtype=np.uint64)[None, :]
+            uniforms = ((self._a * values + self._b) % _PRIME + 1) / _PRIME
+            races = -np.log(uniforms) / np.array(weights)[None, :]
+            return [hashes[i] for i in races.argmin(axis=1).tolist()]
+        signature = []
+        for a, b in self._coefficients:
+            winner = min(
+                range(len(hashes)),
+                key=lambda i: -math.log(
+                    ((a * hashes[i] + b) % _PRIME + 1) / _PRIME) / weights[i])
+            signature.append(hashes[winner])
+        return signature
+
+    def _get_keys(self, profile):
+        signature = self.get_signature(profile)
+        if signature is None:
+            return []
+        rows = self.rows
+        return [tuple(signature[band*rows:(band+1)*rows])
+                for band in range(self.bands)]
+
+    def add(self, i, profile):
+        """
+        Add a profile to the index.
+
+        A profile without discussed topics is counted, but it is not
+        put in any bucket.
+
+        Args:
+            i: the index of the profile
+            profile: a profile where each topic is associated with its
+                percentage of discussions
+        """
+        for buckets, key in zip(self.buckets, self._get_keys(profile)):
+            buckets.setdefault(key, []).append(i)
+        self.size = max(self.size, i + 1)
+
+    def get_candidates(self, profile):
+        """
+        Find the profiles which share a bucket with the given one.
+
+        Args:
+            profile: a profile where each topic is associated with its
+                percentage of discussions
+
+        Returns:
+            a sorted list with the indexes of the candidate profiles
+        """
+        candidates = set()
+        for buckets, key in zip(self.buckets, self._get_keys(profile)):
+            candidates.update(buckets.get(key, ()))
+        return sorted(candidates)
@@ -3,51 +3,482 @@ Contains the functions to do the comparison between the profile and the
 cmp_profiles and to get the most similar one. It uses functions defined 
 in the matching package.
 """
+import heapq
 from .parsing.parser import get_parsed_profile, get_parsed_profiles, \
     values_to_percentage
-from .algorithm1 import match as match1
-from .algorithm2 import match as match2
+from .corpus import Corpus
+from .algorithm2 import get_normalized_ranking
+from .scorers import ALGORITHMS, get_scorer, score, PairScorer
+from .topk import get_upper_bounds, top_k
+from .stats import stage, count, is_enabled
+from .vectorized import HAS_NUMPY, match as match_vectorized
 
+# the available engines used to compute the match_values
+ENGINES = ('python', 'numpy')
 
-def match(profile, cmp_profiles, cmp_ids=None, translate=False):
+
+def get_id(cmp_ids, index):
     """
-    Find the most similar profile to the given one among cmp_profiles.
+    Get the id of a cmp_profile.
+
+    Args:
+        cmp_ids: the ids of the cmp_profiles
+        index: the index of the cmp_profile, or None
+
+    Returns:
+        the id of the cmp_profile, or None if index is None
+    """
+    return cmp_ids[index] if index is not None else None
+
 
-    The matching is done with two algorithms and both the results are 
-    returned.
+def get_overlapping_topics(profile, corpus):
+    """
+    Count the topics shared by a profile with the profiles of a corpus.
+
+    Args:
+        profile: the parsed profile
+        corpus: the Corpus
+
+    Returns:
+        the number of pairs of a cmp_profile and a topic discussed both 
+        by it and by profile
+    """
+    index = corpus.index
+    return sum(len(index.get_postings(topic)) for topic in profile)
+
+
+def prepare(profile, cmp_profiles, cmp_ids=None, translate=False):
+    """
+    Parse the profile and get the corpus of the cmp_profiles.
+
+    If cmp_profiles are not a Corpus, they are parsed together with 
+    profile, so that each foreign topic is translated only once.
 
     Args:
         profile: the profile for which you want to find the most similar 
             one
-        cmp_profiles: the profiles with which the comparison is done
+        cmp_profiles: a Corpus, or a list of profiles where topics are 
+            urls of Wikipedia categories
         cmp_ids (optional): the ids of the cmp_profiles
+        translate (optional): if set to True, the topics of profiles 
+            are translated to English when the translation is available
+
+    Returns:
+        a tuple with the parsed profile, where each topic is associated 
+        with its percentage of discussions, the Corpus of cmp_profiles 
+        and the ids of the cmp_profiles (those of the Corpus if cmp_ids 
+        is not given)
+
+    Raises:
+        ValueError: cmp_ids size and cmp_profiles size do not correspond
+    """
+    if isinstance(cmp_profiles, Corpus):
+        if cmp_ids and not len(cmp_ids) == len(cmp_profiles):
+            raise ValueError(
+                "cmp_ids size and cmp_profiles size do not correspond")
+        with stage('parse'):
+            profile = get_parsed_profile(profile, translate)
+        corpus = cmp_profiles
+    else:
+        with stage('parse'):
+            parsed = get_parsed_profiles([profile] + list(cmp_profiles),
+                                         translate)
+        profile = parsed[0]
+        corpus = Corpus.from_parsed(parsed[1:], cmp_ids, translate)
+    if not cmp_ids:
+        cmp_ids = corpus.ids
+
+    # both matching algorithms are based on the percentage of the number
+    # of times the profile has spoken about a topic on the total of
+    # times the profile has spoken about something
+    with stage('normalize'):
+        values_to_percentage(profile)
+    count('queries')
+    count('query_topics', len(profile))
+    count('cmp_profiles', len(corpus))
+    if is_enabled():
+        count('overlapping_topics', get_overlapping_topics(profile, corpus))
+    return profile, corpus, cmp_ids
+
+
+def get_scorers(algorithms=None):
+    """
+    Get the scorers of some algorithms.
+
+    Args:
+        algorithms (optional): list with the names of the algorithms. By 
+            default ALGORITHMS
+
+    Returns:
+        the list of the Scorers, in the same order
+
+    Raises:
+        ValueError: an algorithm is not registered, or no algorithm is 
+            given
+    """
+    if algorithms is None:
+        algorithms = ALGORITHMS
+    if not algorithms:
+        raise ValueError("no algorithm to run")
+    return [get_scorer(name) for name in algorithms]
+
+
+def get_lsh_key(lsh):
+    """
+    Describe the parameters of an LSHIndex for the key of a cached result.
+
+    Args:
+        lsh: an LSHIndex, or None
+
+    Returns:
+        a tuple with the parameters of lsh, or None
+    """
+    if lsh is None:
+        return None
+    return (lsh.bands, lsh.rows, lsh.seed)
+
+
+def match(profile, cmp_profiles, cmp_ids=None, translate=False,
+          engine='python', lsh=None, algorithms=None, cache=None):
+    """
+    Find the most similar profile to the given one among cmp_profiles.
+
+    The matching is done with some algorithms, by default both 
+    algorithm1 and algorithm2, and all the results are returned. The 
+    algorithms are run together, in a single pass over the cmp_profiles.
+
+    Args:
+        profile: the profile for which you want to find the most similar 
+            one
+        cmp_profiles: the profiles with which the comparison is done. 
+            It can also be a Corpus, which is already parsed, so that 
+            it is not parsed again
+        cmp_ids (optional): the ids of the cmp_profiles. If not given 
+            and cmp_profiles is a Corpus, the ids of the Corpus are used
         translated(optional): if set to True, the topics of profiles are 
             translated to English when the translation is available
+        engine (optional): 'python' to compute the match_values with 
+            the pure-Python algorithms, 'numpy' to compute them with 
+            NumPy arrays. If NumPy is not installed, or an algorithm is 
+            not implemented with NumPy, the pure-Python algorithms are 
+            used anyway
+        lsh (optional): an LSHIndex of the profiles of the Corpus 
+            cmp_profiles. If given, only the candidates found by it are 
+            compared, with the pure-Python algorithms, and the 
+            match_values of the other profiles are 0
+        algorithms (optional): list with the names of the algorithms to 
+            run, see scorers.py. By default ALGORITHMS
+        cache (optional): a ResultCache of the Corpus cmp_profiles. If 
+            the parsed profile has already been matched with the same 
+            options, the stored result is returned
 
     Returns:
         a list with a tuple for each of the algorithms.
         Each tuple contains the id of the most similar profile returned 
         by the algorithm, and a list of similarity values computed by it
+
+    Raises:
+        ValueError: the engine is not one of ENGINES, or an algorithm is 
+            not registered
     """
-    profile = get_parsed_profile(profile, translate)
-    cmp_profiles = get_parsed_profiles(cmp_profiles, translate)
+    if engine not in ENGINES:
+        raise ValueError("unknown engine: %s" % engine)
+    scorers = get_scorers(algorithms)
+    profile, corpus, cmp_ids = prepare(
+        profile, cmp_profiles, cmp_ids, translate)
+    use_numpy = lsh is None and engine == 'numpy' and HAS_NUMPY and \
+        {scorer.name for scorer in scorers} <= set(ALGORITHMS)
 
-    if cmp_ids and not len(cmp_ids) == len(cmp_profiles):
-        raise ValueError(
-            "cmp_ids size and cmp_profiles size do not correspond")
-    values_to_percentage(profile)
+    all_match_values = None
+    if cache is not None:
+        key = cache.get_key(profile, corpus, (
+            'match', tuple(scorer.name for scorer in scorers),
+            'numpy' if use_numpy else 'python', get_lsh_key(lsh)))
+        all_match_values = cache.get(corpus, key)
+    if all_match_values is None:
+        all_match_values = _match_values(profile, corpus, lsh, scorers,
+                                         use_numpy)
+        if cache is not None:
+            cache.put(corpus, key, all_match_values)
+    # the stored lists must not be modified by the caller
+    all_match_values = [list(values) for values in all_match_values]
 
-    # both matching algorithms are based on the percentage of the number
-    # of times the profile has spoken about a topic on the total of
-    # times the profile has spoken about something
-    for cmp_p in cmp_profiles:
-        values_to_percentage(cmp_p)
+    results = []
+    for match_values in all_match_values:
+        best_match_id = get_best_match(match_values)
+        if cmp_ids:
+            best_match_id = get_id(cmp_ids, best_match_id)
+        results.append((best_match_id, match_values))
+    return results
 
-    best_match_id1, match_values1 = match1(profile, cmp_profiles)
-    best_match_id2, match_values2 = match2(profile, cmp_profiles)
+
+def _match_values(profile, corpus, lsh, scorers, use_numpy):
+    """
+    Compute the match_values of the profile with all the profiles of the
+    corpus with each scorer, see match.
+    """
+    if lsh is not None:
+        with stage('lsh'):
+            candidates = lsh.get_candidates(profile)
+        count('lsh_candidates', len(candidates))
+        with stage('score'):
+            pair_scorer = PairScorer(profile, corpus, scorers)
+            all_match_values = [[0] * len(corpus) for _ in scorers]
+            for i in candidates:
+                for values, value in zip(all_match_values, pair_scorer(i)):
+                    values[i] = value
+        return all_match_values
+    if use_numpy:
+        with stage('numpy'):
+            results = dict(zip(ALGORITHMS, match_vectorized(
+                profile, get_normalized_ranking(profile), corpus.sparse)))
+        return [results[scorer.name][1] for scorer in scorers]
+    with stage('score'):
+        return score(profile, corpus, scorers)
+
+
+def match_top_k(profile, cmp_profiles, k, cmp_ids=None, translate=False,
+                lsh=None, algorithms=None, cache=None):
+    """
+    Find the k most similar profiles to the given one among 
+    cmp_profiles.
+
+    The matching is done with some algorithms, by default both 
+    algorithm1 and algorithm2, and all the results are returned. The 
+    cmp_profiles whose match_value cannot be among the k highest are 
+    not evaluated, see the topk module, and the match_values of each 
+    cmp_profile with all the algorithms are computed together.
+
+    Args:
+        profile: the profile for which you want to find the most similar 
+            ones
+        cmp_profiles: the profiles with which the comparison is done. 
+            It can also be a Corpus, which is already parsed
+        k: the number of most similar profiles to find
+        cmp_ids (optional): the ids of the cmp_profiles. If not given 
+            and cmp_profiles is a Corpus, the ids of the Corpus are used
+        translated(optional): if set to True, the topics of profiles are 
+            translated to English when the translation is available
+        lsh (optional): an LSHIndex of the profiles of the Corpus 
+            cmp_profiles. If given, only the candidates found by it are 
+            compared
+        algorithms (optional): list with the names of the algorithms to 
+            run, see scorers.py. By default ALGORITHMS
+        cache (optional): a ResultCache of the Corpus cmp_profiles. If 
+            the parsed profile has already been matched with the same 
+            options, the stored result is returned
+
+    Returns:
+        a list with a list for each of the algorithms.
+        Each list contains at most k tuples with the id of a profile and 
+        its similarity value, sorted from the most similar. Profiles 
+        with a similarity value of 0 are not returned
+
+    Raises:
+        ValueError: an algorithm is not registered
+    """
+    scorers = get_scorers(algorithms)
+    profile, corpus, cmp_ids = prepare(
+        profile, cmp_profiles, cmp_ids, translate)
+
+    results = None
+    if cache is not None:
+        key = cache.get_key(profile, corpus, (
+            'top_k', k, tuple(scorer.name for scorer in scorers),
+            get_lsh_key(lsh)))
+        results = cache.get(corpus, key)
+    if results is None:
+        results = _match_top_k(profile, corpus, k, lsh, scorers)
+        if cache is not None:
+            cache.put(corpus, key, results)
+    # the stored lists must not be modified by the caller
+    results = [list(algorithm_results) for algorithm_results in results]
 
     if cmp_ids:
-        best_match_id1 = cmp_ids[best_match_id1]
-        best_match_id2 = cmp_ids[best_match_id2]
+        results = [[(cmp_ids[i], value) for i, value in algorithm_results]
+                   for algorithm_results in results]
+    return results
+
+
+def _match_top_k(profile, corpus, k, lsh, scorers):
+    """
+    Find the indexes of the k most similar profiles of the corpus with 
+    each scorer, see match_top_k.
+    """
+    # the upper bounds hold for the bounded algorithms
+    with stage('upper_bounds'):
+        bounds = get_upper_bounds(profile, corpus.index)
+    if lsh is not None:
+        with stage('lsh'):
+            candidates = lsh.get_candidates(profile)
+        count('lsh_candidates', len(candidates))
+        bounds = {i: bounds[i] for i in candidates if i in bounds}
+    unbounded = dict.fromkeys(bounds, float('inf'))
+
+    pair_scorer = PairScorer(profile, corpus, scorers)
+    results = []
+    with stage('score'):
+        for n, scorer in enumerate(scorers):
+            results.append(top_k(
+                lambda i: pair_scorer(i)[n],
+                bounds if scorer.bounded else unbounded, k))
+    return results
+
+
+def get_best_match(match_values):
+    """
+    Find the index of the highest match_value.
+
+    Args:
+        match_values: list of match_values
+
+    Returns:
+        the index of the first highest value, or None if no value is 
+        greater than 0
+    """
+    best_match_id = None
+    best_match_value = 0
+    for i, match_value in enumerate(match_values):
+        if match_value > best_match_value:
+            best_match_value = match_value
+            best_match_id = i
+    return best_match_id
+
+
+def _iter_match_values(profile, entries, scorers):
+    """
+    Compute the match_values of the parsed profile with each cmp_profile
+    of entries, with each scorer, see match_iter.
+
+    Yields:
+        a tuple with the id of the cmp_profile and the list of its
+        match_values
+    """
+    prepared = [scorer.prepare(profile) if scorer.prepare else None
+                for scorer in scorers]
+    for cmp_id, cmp_profile, cmp_ranking in entries:
+        # the ranking of algorithm2 comes with the cmp_profile
+        cmp_prepared = [
+            None if scorer.prepare is None else cmp_ranking
+            if scorer.prepare is get_normalized_ranking
+            else scorer.prepare(cmp_profile) for scorer in scorers]
+        values = [0] * len(scorers)
+        for topic, value1 in profile.items():
+            value2 = cmp_profile.get(topic)
+            if value2 is None:
+                continue
+            for n, scorer in enumerate(scorers):
+                if prepared[n] is None:
+                    values[n] += scorer.contribution(value1, value2)
+                else:
+                    values[n] += scorer.contribution(
+                        value1, value2, prepared[n][topic],
+                        cmp_prepared[n][topic])
+        yield cmp_id, values
+
+
+def _parse_iter_profile(profile, translate):
+    with stage('parse'):
+        profile = get_parsed_profile(profile, translate)
+    with stage('normalize'):
+        values_to_percentage(profile)
+    count('queries')
+    count('query_topics', len(profile))
+    return profile
+
+
+def match_iter(profile, entries, translate=False, algorithms=None):
+    """
+    Find the most similar profile to the given one among cmp_profiles 
+    which are prepared while the matching goes on.
+
+    Each cmp_profile is compared as soon as it is yielded by entries, 
+    e.g. by corpus.iter_prepared_profiles, so that the preparation of 
+    the next ones overlaps with the comparison.
+
+    Args:
+        profile: the profile for which you want to find the most similar 
+            one
+        entries: iterable of tuples with the id of a cmp_profile, the 
+            parsed cmp_profile where each topic is associated with its 
+            percentage of discussions, and its normalized ranking
+        translated(optional): if set to True, the topics of profile are 
+            translated to English when the translation is available
+        algorithms (optional): list with the names of the algorithms to 
+            run, see scorers.py. By default ALGORITHMS
+
+    Returns:
+        a tuple with the list of the ids of the cmp_profiles, and a list 
+        with a tuple for each of the algorithms, as returned by match
+
+    Raises:
+        ValueError: an algorithm is not registered
+    """
+    scorers = get_scorers(algorithms)
+    profile = _parse_iter_profile(profile, translate)
+
+    cmp_ids = []
+    all_match_values = [[] for _ in scorers]
+    with stage('score'):
+        for cmp_id, values in _iter_match_values(profile, entries,
+                                                 scorers):
+            cmp_ids.append(cmp_id)
+            for match_values, value in zip(all_match_values, values):
+                match_values.append(value)
+    count('cmp_profiles', len(cmp_ids))
+
+    return cmp_ids, [
+        (get_id(cmp_ids, get_best_match(match_values)), match_values)
+        for match_values in all_match_values]
+
+
+def match_iter_top_k(profile, entries, k, translate=False, algorithms=None):
+    """
+    Find the k most similar profiles to the given one among cmp_profiles 
+    which are prepared while the matching goes on, see match_iter.
+
+    Only the k most similar cmp_profiles found so far are kept, in a 
+    heap for each algorithm, so neither the match_values nor the ids of 
+    the other cmp_profiles are stored.
+
+    Args:
+        profile: the profile for which you want to find the most similar 
+            ones
+        entries: iterable of tuples with the id of a cmp_profile, the 
+            parsed cmp_profile and its normalized ranking
+        k: the number of most similar profiles to find
+        translated(optional): if set to True, the topics of profile are 
+            translated to English when the translation is available
+        algorithms (optional): list with the names of the algorithms to 
+            run, see scorers.py. By default ALGORITHMS
+
+    Returns:
+        a list with a list for each of the algorithms, as returned by 
+        match_top_k
+
+    Raises:
+        ValueError: an algorithm is not registered
+    """
+    scorers = get_scorers(algorithms)
+    profile = _parse_iter_profile(profile, translate)
+
+    # a min-heap for each scorer with the best k (match_value, -index, 
+    # id) found so far; among equal values the lowest index wins
+    heaps = [[] for _ in scorers]
+    size = 0
+    with stage('score'):
+        for i, (cmp_id, values) in enumerate(
+                _iter_match_values(profile, entries, scorers)):
+            size += 1
+            for heap, value in zip(heaps, values):
+                if not value > 0:
+                    continue
+                item = (value, -i, cmp_id)
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, item)
+    count('cmp_profiles', size)
 
-    return [(best_match_id1, match_values1), (best_match_id2, match_values2)]
+    return [[(cmp_id, value) for value, _, cmp_id in sorted(
+        heap, key=lambda item: item[:2], reverse=True)] for heap in heaps]
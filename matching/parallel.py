@@ -0,0 +1,210 @@
+"""
+Contains the parallel scoring of a single profile, where the corpus is
+split in contiguous partitions scored by a pool of worker processes.
+
+The partitions are built, with their TopicIndex, before the pool is
+started, so that forked workers inherit them instead of receiving a
+copy: each task only carries the parsed profile, and each worker
+returns the match_values of its partition. The partitions are merged in
+order, so the results are the same of matcher.match and
+matcher.match_top_k on the whole corpus.
+
+The pool is kept alive between the profiles, so the cost of starting
+the workers is paid once. Where fork is not available, each worker
+receives a copy of the partitions when it starts.
+"""
+import os
+from .corpus import Corpus
+from .matcher import get_best_match, get_id, get_scorers, _match_top_k
+from .parsing.parser import get_parsed_profile, values_to_percentage, \
+    reinit_after_fork
+from .scorers import score
+from .stats import stage, count
+from .workers import get_context
+
+# the partitions of the worker processes
+_partitions = None
+
+
+def split_corpus(corpus, parts):
+    """
+    Split a corpus in contiguous partitions of about the same size.
+
+    The partitions share the profiles and the rankings of the corpus.
+
+    Args:
+        corpus: the Corpus
+        parts: the number of partitions
+
+    Returns:
+        a list with a tuple for each partition, with the index of its
+        first profile in the corpus and its Corpus
+    """
+    parts = max(1, min(parts, len(corpus)))
+    partitions = []
+    for part in range(parts):
+        start = len(corpus) * part // parts
+        end = len(corpus) * (part + 1) // parts
+        ids = corpus.ids[start:end] if corpus.ids else None
+        partitions.append((start, Corpus(
+            ids, list(corpus.profiles[start:end]),
+            list(corpus.rankings[start:end]), corpus.translate)))
+    return partitions
+
+
+def _init_worker(partitions):
+    global _partitions
+    _partitions = partitions
+    reinit_after_fork()
+
+
+def _score_partition(args):
+    part, profile, names = args
+    _, partition = _partitions[part]
+    return score(profile, partition, get_scorers(names))
+
+
+def _top_k_partition(args):
+    part, profile, names, k = args
+    start, partition = _partitions[part]
+    return [[(start + i, value) for i, value in results]
+            for results in _match_top_k(profile, partition, k, None,
+                                        get_scorers(names))]
+
+
+class ParallelMatcher:
+    """
+    Scores each profile against a corpus split among worker processes.
+
+    Attributes:
+        corpus: the Corpus of the cmp_profiles
+        processes: the number of worker processes
+        partitions: a list with the index of the first profile and the
+            Corpus of each partition
+    """
+
+    def __init__(self, corpus, processes=None):
+        """
+        Split the corpus and start the worker processes.
+
+        Args:
+            corpus: the Corpus of the cmp_profiles
+            processes (optional): the number of worker processes, and of
+                partitions. By default the number of cpus
+        """
+        self.corpus = corpus
+        self.processes = processes or os.cpu_count() or 1
+        self.partitions = split_corpus(corpus, self.processes)
+        # build the indexes before forking, so that the workers share
+        # them
+        for _, partition in self.partitions:
+            partition.index
+        self._pool = get_context().Pool(
+            len(self.partitions), _init_worker, (self.partitions,))
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def _prepare(self, profile, translate):
+        with stage('parse'):
+            profile = get_parsed_profile(profile, translate)
+        with stage('normalize'):
+            values_to_percentage(profile)
+        count('queries')
+        count('query_topics', len(profile))
+        count('cmp_profiles', len(self.corpus))
+        return profile
+
+    def match(self, profile, translate=False, algorithms=None):
+        """
+        Find the most similar profile to the given one among the
+        cmp_profiles of all the partitions.
+
+        Args:
+            profile: the profile for which you want to find the most
+                similar one
+            translate (optional): if set to True, the topics of the
+                profile are translated to English when the translation
+                is available
+            algorithms (optional): list with the names of the algorithms
+                to run, see scorers.py. By default ALGORITHMS
+
+        Returns:
+            a list with a tuple for each of the algorithms, as returned
+            by matcher.match with the ids of the corpus
+
+        Raises:
+            ValueError: an algorithm is not registered
+        """
+        names = [scorer.name for scorer in get_scorers(algorithms)]
+        profile = self._prepare(profile, translate)
+        with stage('score'):
+            answers = self._pool.map(
+                _score_partition,
+                [(part, profile, names)
+                 for part in range(len(self.partitions))], chunksize=1)
+        results = []
+        for n in range(len(names)):
+            match_values = []
+            for answer in answers:
+                match_values += answer[n]
+            best_match = get_best_match(match_values)
+            if self.corpus.ids:
+                best_match = get_id(self.corpus.ids, best_match)
+            results.append((best_match, match_values))
+        return results
+
+    def match_top_k(self, profile, k, translate=False, algorithms=None):
+        """
+        Find the k most similar profiles to the given one among the
+        cmp_profiles of all the partitions.
+
+        Each partition returns its k most similar cmp_profiles, and the
+        k best of them are kept. Profiles with the same similarity value
+        are sorted by their index in the corpus, as in a single process.
+
+        Args:
+            profile: the profile for which you want to find the most
+                similar ones
+            k: the number of most similar profiles to find
+            translate (optional): if set to True, the topics of the
+                profile are translated to English when the translation
+                is available
+            algorithms (optional): list with the names of the algorithms
+                to run, see scorers.py. By default ALGORITHMS
+
+        Returns:
+            a list with a list for each of the algorithms, as returned
+            by matcher.match_top_k with the ids of the corpus
+
+        Raises:
+            ValueError: an algorithm is not registered
+        """
+        names = [scorer.name for scorer in get_scorers(algorithms)]
+        profile = self._prepare(profile, translate)
+        with stage('score'):
+            answers = self._pool.map(
+                _top_k_partition,
+                [(part, profile, names, k)
+                 for part in range(len(self.partitions))], chunksize=1)
+        results = []
+        for n in range(len(names)):
+            candidates = sorted(
+                (item for answer in answers for item in answer[n]),
+                key=lambda item: (-item[1], item[0]))[:k]
+            if self.corpus.ids:
+                candidates = [(self.corpus.ids[i], value)
+                              for i, value in candidates]
+            results.append(candidates)
+        return results
@@ -0,0 +1,164 @@
+"""
+Contains a persistent cache for the translations of topic names, so
+that the Wikipedia API is asked only once for each topic.
+
+The cache is a SQLite database where each tuple with the language code
+and the name of a topic is associated with its translation to English.
+Topics for which the translation is not available are stored too, so
+that they are not asked again.
+"""
+import sqlite3
+import threading
+import time
+from ..stats import count
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    lang TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    translation TEXT,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (lang, topic)
+)
+"""
+_INDEX = """
+CREATE INDEX IF NOT EXISTS translations_accessed
+ON translations (accessed)
+"""
+# maximum number of parameters of a single SQLite query
+_BATCH = 500
+
+
+class TranslationCache:
+    """
+    Persistent cache of the translations of topic names.
+
+    Attributes:
+        path: the path of the SQLite database
+        ttl: number of seconds after which a translation expires, or
+            None if translations never expire
+        max_size: maximum number of translations stored, or None if
+            there is no limit. When it is exceeded, the least recently
+            used translations are evicted
+        hits: number of translations found in the cache
+        misses: number of translations not found in the cache
+    """
+
+    def __init__(self, path, ttl=None, max_size=None):
+        """
+        Open the cache, creating the database if it does not exist.
+
+        Args:
+            path: the path of the SQLite database
+            ttl (optional): number of seconds after which a translation
+                expires
+            max_size (optional): maximum number of translations stored
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(_SCHEMA)
+            self._connection.execute(_INDEX)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def get(self, lang, topics):
+        """
+        Look for the translations of some topics.
+
+        Args:
+            lang: language code of the topics
+            topics: list of names of topics
+
+        Returns:
+            a tuple with a dictionary where each tuple with the language
+            code and the name of a cached topic is associated with its
+            translation (or with its name in the original language if
+            the translation is not available), and a list with the
+            topics which are not in the cache
+        """
+        now = time.time()
+        min_created = now - self.ttl if self.ttl is not None else -1
+        found = {}
+        with self._lock, self._connection:
+            for i in range(0, len(topics), _BATCH):
+                chunk = topics[i:i+_BATCH]
+                rows = self._connection.execute(
+                    "SELECT topic, translation FROM translations "
+                    "WHERE lang = ? AND created >= ? AND topic IN (%s)"
+                    % ','.join('?' * len(chunk)),
+                    [lang, min_created] + chunk).fetchall()
+                for topic, translation in rows:
+                    found[(lang, topic)] = \
+                        translation if translation is not None else topic
+                self._connection.executemany(
+                    "UPDATE translations SET accessed = ? "
+                    "WHERE lang = ? AND topic = ?",
+                    [(now, lang, topic) for topic, _ in rows])
+        missing = [topic for topic in topics if (lang, topic) not in found]
+        self.hits += len(found)
+        self.misses += len(missing)
+        count('translation_cache_hits', len(found))
+        count('translation_cache_misses', len(missing))
+        return found, missing
+
+    def put(self, translations):
+        """
+        Store some translations.
+
+        Args:
+            translations: a dictionary where each tuple with the
+                language code and the name of a topic is associated
+                with its translation, or with its name in the original
+                language if the translation is not available
+        """
+        now = time.time()
+        rows = [(lang, topic, translation if translation != topic else None,
+                 now, now)
+                for (lang, topic), translation in translations.items()]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO translations "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove the expired translations and, if there are more than
+        max_size translations, the least recently used ones.
+        """
+        if self.ttl is not None:
+            self._connection.execute(
+                "DELETE FROM translations WHERE created < ?",
+                (time.time() - self.ttl,))
+        if self.max_size is not None:
+            size = self._connection.execute(
+                "SELECT COUNT(*) FROM translations").fetchone()[0]
+            if size > self.max_size:
+                self._connection.execute(
+                    "DELETE FROM translations WHERE rowid IN ("
+                    "SELECT rowid FROM translations "
+                    "ORDER BY accessed LIMIT ?)", (size - self.max_size,))
+
+    def clear(self):
+        """
+        Remove all the translations.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM translations")
+
+    def close(self):
+        """
+        Close the database.
+        """
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,133 @@
+"""
+Contains functions to read profiles from json files and directories of 
+json files.
+"""
+import os
+import json
+from ..stats import stage, count
+
+
+def path_to_id(profile_path):
+    """
+    Convert the profile path to an id. 
+
+    Args:
+        profile_path: the path of the file containing the profile
+
+    Returns:
+        the file name without the '.json' extension
+    """
+    return profile_path.rstrip('.json').split('/')[-1]
+
+
+def get_profile_by_file(profile_path):
+    """
+    Read the profile from the given file.
+
+    A valid profile contains a dictionary where keys are topic names 
+    (in the form of urls of Wikipedia categories) and values are the 
+    number of times the profile has spoken about the respective topic.
+
+    Args:
+        profile_path: path to a json file containing a profile
+
+    Returns:
+        a tuple with the file name (without the extension), which is 
+        meant to be the id of the profile, and the profile itself
+
+    Raises:
+        FileNotFoundError: the file is missing
+        IsADirectoryError: the profile_path is a path to a directory
+        json.decoder.JSONDecodeError: the given is not a valid json file
+    """
+    try:
+        with open(profile_path) as f:
+            profile = json.load(f)
+    except json.decoder.JSONDecodeError as ex:
+        raise json.decoder.JSONDecodeError(ex.msg, profile_path, ex.pos)
+    return path_to_id(profile_path), profile
+
+
+def get_profile_filenames(profiles_dir):
+    """
+    List the names of the profile files in the given directory.
+
+    Args:
+        profiles_dir: the path to the directory in which to look for 
+            profiles
+
+    Returns:
+        a list with the names of the files with '.json' extension which 
+        are not hidden
+    """
+    return [filename for filename in os.listdir(profiles_dir)
+            if filename.endswith('.json') and not filename.startswith('.')]
+
+
+def get_profiles_by_dir(profiles_dir):
+    """
+    Read the profiles in the given directory.
+
+    Profiles are json files. A valid profile contains a dictionary where 
+    keys are topic names (in the form of urls of Wikipedia categories) 
+    and values are the number of times the profile has spoken about the 
+    respective topic.
+
+    Args:
+        profiles_dir: the path to the directory in which to look for 
+            profiles
+
+    Returns:
+        a tuple with a list with the file names (without the extension), 
+        which are meant to be the ids of the profiles, and a list with 
+        the profiles
+
+    Raises:
+        IsADirectoryError: there is a subdirectory with '.json' 
+            extension
+        json.decoder.JSONDecodeError: there is a file with '.json' 
+            extension which is not a valid json file
+    """
+    profiles = []
+    ids = []
+    if not profiles_dir.endswith('/'):
+        profiles_dir += '/'
+    with stage('load'):
+        for filename in get_profile_filenames(profiles_dir):
+            profile_id, profile = get_profile_by_file(
+                profiles_dir + filename)
+            ids.append(profile_id)
+            profiles.append(profile)
+    count('profiles_loaded', len(profiles))
+
+    return ids, profiles
+
+
+def iter_profiles_by_dir(profiles_dir):
+    """
+    Read the profiles in the given directory one at a time.
+
+    The profiles are yielded in the same order of get_profiles_by_dir, 
+    but the directory is scanned while they are read, so that neither 
+    the profiles nor the list of the files are kept in memory.
+
+    Args:
+        profiles_dir: the path to the directory in which to look for 
+            profiles
+
+    Yields:
+        a tuple with the file name (without the extension) and the 
+        profile
+
+    Raises:
+        IsADirectoryError: there is a subdirectory with '.json' 
+            extension
+        json.decoder.JSONDecodeError: there is a file with '.json' 
+            extension which is not a valid json file
+    """
+    with os.scandir(profiles_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.json') and \
+                    not entry.name.startswith('.'):
+                count('profiles_loaded')
+                yield get_profile_by_file(entry.path)
@@ -3,12 +3,29 @@ Contains functions to clean-up topic names for a profile and translate
 them if requested. Topic names are translated using the Wikipedia API.
 """
 import json
+import math
 import os
+import threading
 import urllib.parse
 import requests
-import itertools
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ..stats import stage, count, is_enabled
 
 _EN = 'en'
+# url of the Wikipedia API, where {lang} is replaced by the language code
+API_URL = 'https://{lang}.wikipedia.org/w/api.php'
+# maximum number of concurrent requests to the Wikipedia API
+MAX_WORKERS = 8
+# number of times a request is retried after a transient failure, with
+# an exponential backoff of RETRY_BACKOFF * 2^(retry - 1) sec
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+_session = None
+_session_lock = threading.Lock()
+# the TranslationCache used by default by get_translated_topics
+_translation_cache = None
 
 
 def values_to_percentage(profile):
@@ -25,6 +42,27 @@ def values_to_percentage(profile):
         profile[topic] *= coefficient
 
 
+def check_profile(profile):
+    """
+    Check that a profile read from a file or received by a service can
+    be matched.
+
+    Args:
+        profile: the decoded json of the profile
+
+    Raises:
+        ValueError: the profile is not a non-empty dictionary of finite
+            non-negative numbers with a positive sum
+    """
+    if not isinstance(profile, dict) or not profile or \
+            not all(isinstance(v, (int, float)) and
+                    not isinstance(v, bool) and math.isfinite(v) and v >= 0
+                    for v in profile.values()) or \
+            not sum(profile.values()) > 0:
+        raise ValueError("a profile must be a non-empty object of "
+                         "finite non-negative numbers")
+
+
 def url_to_topic(url):
     """
     Extract the topic from the given url. 
@@ -106,10 +144,38 @@ def get_topics(profile):
     return topics
 
 
+def get_session():
+    """
+    Get the HTTP session used for the requests to the Wikipedia API.
+
+    The session keeps the connections alive, so that consecutive 
+    requests to the same host do not need a new handshake, and retries 
+    the requests which fail because of transient errors.
+
+    Returns:
+        the requests.Session shared by all the translations
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=RETRIES, backoff_factor=RETRY_BACKOFF,
+                          status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=('GET',))
+            adapter = HTTPAdapter(pool_connections=MAX_WORKERS,
+                                  pool_maxsize=MAX_WORKERS, max_retries=retry)
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
 def translate_topics(lang, topics):
     """
     Translate topics from lang to English.
 
+    If the response of the API is split in more parts, all of them are 
+    requested.
+
     Args:
         lang: language code from which the translation has to be done
         topics: list of topics (names of Wikipedia categories) which 
@@ -122,12 +188,13 @@ def translate_topics(lang, topics):
         if the translation is not available
 
     Raises:
-        requests.exceptions.ConnectionError: if the API do not respond
+        requests.exceptions.RequestException: if the API do not respond, 
+            also after retrying
     """
     # request to Wikipedia API
     TIMEOUT = 5  # raise an error after TIMEOUT sec without response
     topics_titles = 'Category:' + '|Category:'.join(topics)
-    request_url = 'https://' + lang + '.wikipedia.org/w/api.php'
+    request_url = API_URL.format(lang=lang)
     params = {
         'action': 'query',
         'titles': topics_titles,
@@ -137,47 +204,186 @@ def translate_topics(lang, topics):
         'format': 'json',
         'lllimit': 'max'
     }
-    response = requests.get(request_url, params, timeout=TIMEOUT).json()
-
-    # read and parse json response
+    session = get_session()
     translated_dict = {}
-    page_list = response['query']['pages']
-    for page in page_list:
-        page_info = page_list[page]
-        topic = normalize_topic_string(page_info['title'])
-        if 'langlinks' in page_info:
-            translation = normalize_topic_string(
-                page_info['langlinks'][0]['*'])
-        else:
-            translation = topic
-        translated_dict[(lang, topic)] = translation
+    while True:
+        http_response = session.get(request_url, params=params,
+                                    timeout=TIMEOUT)
+        count('translation_requests')
+        count('translation_bytes', len(http_response.content))
+        response = http_response.json()
+
+        # read and parse json response
+        page_list = response['query']['pages']
+        for page in page_list:
+            page_info = page_list[page]
+            topic = normalize_topic_string(page_info['title'])
+            if 'langlinks' in page_info:
+                translated_dict[(lang, topic)] = normalize_topic_string(
+                    page_info['langlinks'][0]['*'])
+            elif (lang, topic) not in translated_dict:
+                translated_dict[(lang, topic)] = topic
+
+        # the langlinks of some pages are in the next part
+        if 'continue' not in response:
+            break
+        params = dict(params, **response['continue'])
 
     return translated_dict
 
 
-def get_translated_topics(to_translate):
+def set_translation_cache(cache):
+    """
+    Set the cache used by default to store the translations.
+
+    Args:
+        cache: a TranslationCache, or None to disable the cache
+    """
+    global _translation_cache
+    _translation_cache = cache
+
+
+def reinit_after_fork():
+    """
+    Reinitialize the resources of the translation in a forked process.
+
+    The connections of the HTTP session and of the translation cache 
+    must not be shared with the parent process, so the session is 
+    dropped and the cache is opened again.
+    """
+    global _session, _translation_cache
+    _session = None
+    if _translation_cache is not None:
+        cache = _translation_cache
+        _translation_cache = type(cache)(cache.path, cache.ttl,
+                                         cache.max_size)
+
+
+def get_translated_topics(to_translate, cache=None, max_workers=None):
     """
     Translate the topics from original languages to English.
 
+    The translations found in the cache are not requested to the 
+    Wikipedia API, and the ones obtained from the API are stored in it.
+    The requests for the different languages and batches of topics are 
+    sent concurrently.
+
     Args:
         to_translate: dictionary where keys are language codes and 
             values are lists of topic names (Wikipedia categories) 
+        cache (optional): the TranslationCache to use. If not given, 
+            the one set with set_translation_cache is used, if any
+        max_workers (optional): maximum number of concurrent requests. 
+            By default MAX_WORKERS
 
     Returns:
         a dictionary where a tuple with the language code and the name 
         of a topic is associated to the name of the topic translated to 
         English, or with the name in original language if the 
         translation is not available
+
+    Raises:
+        requests.exceptions.RequestException: if the API do not respond, 
+            also after retrying
     """
     LIMIT = 50  # maximum number of queries per request for wikipedia
+    if cache is None:
+        cache = _translation_cache
+    if max_workers is None:
+        max_workers = MAX_WORKERS
     translations = {}
+    batches = []
     for lang in to_translate:
-        for i in range(0, len(to_translate[lang]), LIMIT):
-            translations.update(translate_topics(
-                lang, itertools.islice(to_translate[lang], i, i+LIMIT)))
+        topics = to_translate[lang]
+        if cache is not None:
+            cached, topics = cache.get(lang, topics)
+            translations.update(cached)
+        for i in range(0, len(topics), LIMIT):
+            batches.append((lang, topics[i:i+LIMIT]))
+    if not batches:
+        return translations
+
+    count('translation_batches', len(batches))
+    with stage('translation'), \
+            ThreadPoolExecutor(min(max_workers, len(batches))) as executor:
+        futures = [executor.submit(translate_topics, lang, topics)
+                   for lang, topics in batches]
+        for future in futures:
+            translated = future.result()
+            if cache is not None:
+                cache.put(translated)
+            translations.update(translated)
     return translations
 
 
+def get_lang_topics(profile):
+    """
+    Create a new profile where urls are replaced by tuples with the 
+    language and the topic name.
+
+    Args:
+        profile: profile where topics are urls of Wikipedia categories
+
+    Returns:
+        a new profile where topics are tuples with the language code 
+        and the name of the categories. If two or more urls refer to the 
+        same topic in the same language, their values are summed
+    """
+    lang_topics = {}
+    for url, times in profile.items():
+        lang_topic = url_to_lang_topic(url)
+        lang_topics[lang_topic] = lang_topics.get(lang_topic, 0) + times
+    return lang_topics
+
+
+def get_topics_to_translate(lang_topics_profiles):
+    """
+    Collect the distinct foreign topics of some profiles.
+
+    Args:
+        lang_topics_profiles: list of profiles where topics are tuples 
+            with the language code and the name of the categories
+
+    Returns:
+        a dictionary where keys are language codes other than English 
+        and values are lists of the distinct topic names in that 
+        language
+    """
+    to_translate = {}
+    for lang_topics in lang_topics_profiles:
+        for lang, topic in lang_topics:
+            if not lang == _EN:
+                if not lang in to_translate:
+                    to_translate[lang] = {}
+                to_translate[lang][topic] = None
+    return {lang: list(topics) for lang, topics in to_translate.items()}
+
+
+def apply_translations(lang_topics, translations):
+    """
+    Create a profile with topic names translated.
+
+    Args:
+        lang_topics: profile where topics are tuples with the language 
+            code and the name of the categories
+        translations: a dictionary where a tuple with the language code 
+            and the name of a topic is associated to the name of the 
+            topic translated to English. Foreign topics which are not 
+            in it keep the name in the original language
+
+    Returns:
+        a new profile where topics are the names of the categories 
+        translated to English. If two or more topics have the same 
+        translation, their values are summed
+    """
+    topics = {}
+    for (lang, topic), times in lang_topics.items():
+        if not lang == _EN:
+            topic = translations.get((lang, topic), topic)
+        topics[topic] = topics.get(topic, 0) + times
+    return topics
+
+
 def get_and_translate_topics(profile):
     """
     Create a profile with topic names translated instead of urls.
@@ -193,21 +399,33 @@ def get_and_translate_topics(profile):
         If two or more urls refer to the same topic, their values are 
         summed
     """
-    parsed_profile = {url_to_lang_topic(url): times
-                      for url, times in profile.items()}
-    to_translate = {}
-    topics = {}
-    for (lang, topic), times in parsed_profile.items():
-        if not lang == _EN:
-            if not lang in to_translate:
-                to_translate[lang] = []
-            to_translate[lang].append(topic)
-        else:
-            topics[topic] = topics.get(topic, 0) + times
-    for original, translation in get_translated_topics(to_translate).items():
-        topics[translation] = topics.get(
-            translation, 0) + parsed_profile[original]
-    return topics
+    return get_and_translate_topics_bulk([profile])[0]
+
+
+def get_and_translate_topics_bulk(profiles):
+    """
+    Create a list of profiles with topic names translated instead of 
+    urls.
+
+    The distinct foreign topics of all the profiles are collected, so 
+    that each of them is translated only once and the requests to the 
+    Wikipedia API are as full as possible.
+
+    Args:
+        profiles: list of profiles where topics are urls of Wikipedia 
+            categories
+
+    Returns:
+        a list of new profiles obtained by replacing topic urls in the 
+        original profiles with the corresponding category names.
+        If two or more urls refer to the same topic, their values are 
+        summed
+    """
+    lang_topics_profiles = [get_lang_topics(p) for p in profiles]
+    translations = get_translated_topics(
+        get_topics_to_translate(lang_topics_profiles))
+    return [apply_translations(lang_topics, translations)
+            for lang_topics in lang_topics_profiles]
 
 
 def get_parsed_profile(profile, translate=False):
@@ -226,13 +444,19 @@ def get_parsed_profile(profile, translate=False):
         summed
     """
     get_topics_fn = get_and_translate_topics if translate else get_topics
-    return get_topics_fn(profile)
+    parsed = get_topics_fn(profile)
+    count('profiles_parsed')
+    count('topics_parsed', len(parsed))
+    return parsed
 
 
 def get_parsed_profiles(profiles, translate=False):
     """
     Create a list of profiles with topic names instead of urls.
 
+    If the topics are translated, each distinct foreign topic of the 
+    profiles is translated only once.
+
     Args:
         profiles: list of profiles where topics are urls of Wikipedia 
             categories
@@ -245,4 +469,11 @@ def get_parsed_profiles(profiles, translate=False):
         if two or more urls refer to the same topic, their values are 
         summed
     """
-    return [get_parsed_profile(profile, translate) for profile in profiles]
+    count('profiles_parsed', len(profiles))
+    if translate:
+        parsed = get_and_translate_topics_bulk(profiles)
+    else:
+        parsed = [get_topics(profile) for profile in profiles]
+    if is_enabled():
+        count('topics_parsed', sum(len(profile) for profile in parsed))
+    return parsed
@@ -0,0 +1,205 @@
+"""
+Contains a compact representation of profiles.
+
+Topic names are interned in a Vocabulary shared by all the profiles, so
+that each name is stored only once, and a Profile stores the ids of its
+topics, sorted, in an array of unsigned ints and their values in an
+array of doubles. The topics shared by two profiles are found by merging
+their sorted ids.
+
+A Profile can be used like the dictionary it was built from, so both
+the algorithms accept it in place of a plain dictionary.
+"""
+from array import array
+from bisect import bisect_left
+
+
+class Vocabulary:
+    """
+    Association between topic names and integer ids.
+
+    Attributes:
+        ids: a dictionary where each topic name is associated with its id
+        topics: a list with the topic name of each id
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.topics = []
+
+    def __len__(self):
+        return len(self.topics)
+
+    def intern(self, topic):
+        """
+        Get the id of a topic, adding it if it is not in the vocabulary.
+
+        Args:
+            topic: the topic name
+
+        Returns:
+            the id of the topic
+        """
+        topic_id = self.ids.get(topic)
+        if topic_id is None:
+            topic_id = len(self.topics)
+            self.ids[topic] = topic_id
+            self.topics.append(topic)
+        return topic_id
+
+
+class Profile:
+    """
+    A profile whose topics are interned in a Vocabulary.
+
+    Attributes:
+        vocabulary: the Vocabulary of the topics
+        topic_ids: array with the ids of the topics, in increasing order
+        weights: array with the value of each topic in topic_ids
+    """
+    __slots__ = ('vocabulary', 'topic_ids', 'weights')
+
+    def __init__(self, vocabulary, topic_ids, weights):
+        self.vocabulary = vocabulary
+        self.topic_ids = topic_ids
+        self.weights = weights
+
+    @classmethod
+    def from_dict(cls, profile, vocabulary):
+        """
+        Build a Profile from a dictionary.
+
+        Args:
+            profile: a profile where each topic is associated with its
+                value
+            vocabulary: the Vocabulary where the topics are interned
+
+        Returns:
+            the Profile with the same topics and values of profile
+        """
+        items = sorted((vocabulary.intern(topic), value)
+                       for topic, value in profile.items())
+        return cls(vocabulary, array('I', [item[0] for item in items]),
+                   array('d', [item[1] for item in items]))
+
+    def to_dict(self):
+        """
+        Convert the Profile to a dictionary.
+
+        Returns:
+            a dictionary where each topic is associated with its value
+        """
+        return dict(self.items())
+
+    def _position(self, topic):
+        """
+        Find the position of a topic in the arrays.
+
+        Args:
+            topic: the topic name
+
+        Returns:
+            the position of the topic in topic_ids, or None if the
+            profile does not contain the topic
+        """
+        topic_id = self.vocabulary.ids.get(topic)
+        if topic_id is None:
+            return None
+        i = bisect_left(self.topic_ids, topic_id)
+        if i < len(self.topic_ids) and self.topic_ids[i] == topic_id:
+            return i
+        return None
+
+    def __len__(self):
+        return len(self.topic_ids)
+
+    def __iter__(self):
+        topics = self.vocabulary.topics
+        return (topics[topic_id] for topic_id in self.topic_ids)
+
+    def __contains__(self, topic):
+        return self._position(topic) is not None
+
+    def __getitem__(self, topic):
+        i = self._position(topic)
+        if i is None:
+            raise KeyError(topic)
+        return self.weights[i]
+
+    def __setitem__(self, topic, value):
+        i = self._position(topic)
+        if i is None:
+            raise KeyError(topic)
+        self.weights[i] = value
+
+    def get(self, topic, default=None):
+        i = self._position(topic)
+        return default if i is None else self.weights[i]
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return self.weights
+
+    def items(self):
+        return zip(self, self.weights)
+
+    def topic_at(self, i):
+        """
+        Get the name of the i-th topic of the profile.
+
+        Args:
+            i: the position of the topic in topic_ids
+
+        Returns:
+            the topic name
+        """
+        return self.vocabulary.topics[self.topic_ids[i]]
+
+    def intersect(self, other):
+        """
+        Find the topics shared with another profile.
+
+        The sorted ids of the two profiles are merged, so the cost is
+        linear in the size of the two profiles.
+
+        Args:
+            other: a Profile with the same Vocabulary
+
+        Yields:
+            a tuple with the positions of each shared topic in the
+            arrays of this profile and of the other one
+        """
+        ids1 = self.topic_ids
+        ids2 = other.topic_ids
+        i = j = 0
+        len1 = len(ids1)
+        len2 = len(ids2)
+        while i < len1 and j < len2:
+            id1 = ids1[i]
+            id2 = ids2[j]
+            if id1 == id2:
+                yield i, j
+                i += 1
+                j += 1
+            elif id1 < id2:
+                i += 1
+            else:
+                j += 1
+
+
+def is_compact(*profiles):
+    """
+    Check if some profiles are Profiles sharing the same Vocabulary.
+
+    Args:
+        profiles: the profiles to check
+
+    Returns:
+        True if all the profiles are Profiles with the same Vocabulary
+    """
+    if not all(isinstance(p, Profile) for p in profiles):
+        return False
+    vocabulary = profiles[0].vocabulary
+    return all(p.vocabulary is vocabulary for p in profiles)
@@ -0,0 +1,308 @@
+"""
+Contains a quantized storage of the Corpus, where the percentages and
+the normalized positions of the rankings are stored with less precision,
+so that they take less memory.
+
+With the 'float32' storage each value is a single precision float, with
+a relative error below 6e-8. With the 'uint16' storage each value is a
+fixed-point unsigned 16 bit integer, a multiple of the scale of its
+profile: the highest percentage (or position) of the profile divided by
+65535. The error of each value is at most half of the scale, so the
+small percentages of a profile keep their precision unless the profile
+also has a very high one.
+
+The profiles and the rankings are Profiles whose arrays of values are
+read back as floats, so both the algorithms score them directly. The
+postings of the TopicIndex are stored in arrays with the same precision
+and decoded with the scales of their profiles, so they give exactly the
+values of the profiles. get_accuracy_report compares the matching with
+a quantized corpus against the exact one, to check whether the
+precision is enough.
+"""
+import heapq
+from array import array
+from .corpus import Corpus
+from .index import TopicIndex
+from .matcher import get_best_match, get_scorers
+from .parsing.parser import get_parsed_profile, values_to_percentage
+from .profile import Profile, Vocabulary
+from .scorers import score
+
+STORAGES = ('float32', 'uint16')
+UINT16_MAX = 65535
+
+
+class FixedPointArray:
+    """
+    Array of non-negative values stored as fixed-point unsigned 16 bit
+    integers, which are read and written as floats.
+
+    Attributes:
+        scale: the value of a unit of the integers
+        data: array of unsigned 16 bit integers
+    """
+    __slots__ = ('scale', 'data')
+
+    def __init__(self, scale, data):
+        self.scale = scale
+        self.data = data
+
+    @classmethod
+    def from_values(cls, values, scale=None):
+        """
+        Quantize some values, rounding them to the closest multiple of
+        scale.
+
+        Args:
+            values: list of floats
+            scale (optional): the value of a unit of the integers. By
+                default the highest value divided by UINT16_MAX, or 1 if
+                no value is positive
+
+        Returns:
+            the FixedPointArray of the values
+
+        Raises:
+            ValueError: a value is negative or higher than
+                UINT16_MAX * scale
+        """
+        if scale is None:
+            highest = max(values, default=0)
+            scale = highest / UINT16_MAX if highest > 0 else 1.0
+        return cls(scale, array('H', [_encode(value, scale)
+                                      for value in values]))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return FixedPointArray(self.scale, self.data[i])
+        return self.data[i] * self.scale
+
+    def __setitem__(self, i, value):
+        self.data[i] = _encode(value, self.scale)
+
+    def __iter__(self):
+        scale = self.scale
+        return (value * scale for value in self.data)
+
+
+def _encode(value, scale):
+    encoded = round(value / scale)
+    if not 0 <= encoded <= UINT16_MAX:
+        raise ValueError("%r cannot be stored in 16 bits with a scale of "
+                         "%r" % (value, scale))
+    return encoded
+
+
+def _get_array(values, storage):
+    if storage == 'float32':
+        return array('f', values)
+    return FixedPointArray.from_values(values)
+
+
+class QuantizedIndex(TopicIndex):
+    """
+    A read-only TopicIndex whose postings are stored, grouped by topic,
+    in contiguous arrays with the values of the quantized profiles.
+    """
+
+    def __init__(self, vocabulary, profiles, storage):
+        """
+        Build the index of the given profiles.
+
+        Args:
+            vocabulary: the Vocabulary of the topics
+            profiles: list of quantized Profiles
+            storage: the storage of the profiles, one of STORAGES
+        """
+        self.size = len(profiles)
+        self.postings = None
+        self._vocabulary = vocabulary
+        # the postings are counted first and then written in place, so
+        # that no list of them is built
+        indptr = array('Q', [0]) * (len(vocabulary) + 1)
+        for profile in profiles:
+            for topic_id in profile.topic_ids:
+                indptr[topic_id + 1] += 1
+        for topic_id in range(len(vocabulary)):
+            indptr[topic_id + 1] += indptr[topic_id]
+        size = indptr[-1]
+        self._indptr = indptr
+        self._rows = array('I', [0]) * size
+        typecode = 'H' if storage == 'uint16' else 'f'
+        self._values = array(typecode, [0]) * size
+        ends = array('Q', indptr[:-1])
+        for row, profile in enumerate(profiles):
+            weights = profile.weights
+            if storage == 'uint16':
+                weights = weights.data
+            for topic_id, value in zip(profile.topic_ids, weights):
+                end = ends[topic_id]
+                self._rows[end] = row
+                self._values[end] = value
+                ends[topic_id] = end + 1
+        # the integers of each profile are decoded with its scale
+        self._scales = array('d', [profile.weights.scale
+                                   for profile in profiles]) \
+            if storage == 'uint16' else None
+
+    def get_postings(self, topic):
+        topic_id = self._vocabulary.ids.get(topic)
+        if topic_id is None:
+            return ()
+        start = self._indptr[topic_id]
+        end = self._indptr[topic_id+1]
+        if start == end:
+            return ()
+        rows = self._rows[start:end]
+        values = self._values[start:end]
+        if self._scales is None:
+            return list(zip(rows, values))
+        scales = self._scales
+        return [(row, value * scales[row])
+                for row, value in zip(rows, values)]
+
+    def add(self, i, profile):
+        raise TypeError("a QuantizedIndex is read-only")
+
+    def remove(self, i, profile):
+        raise TypeError("a QuantizedIndex is read-only")
+
+    def move(self, i, j, profile):
+        raise TypeError("a QuantizedIndex is read-only")
+
+    def truncate(self, size):
+        raise TypeError("a QuantizedIndex is read-only")
+
+
+class QuantizedCorpus(Corpus):
+    """
+    A Corpus whose percentages and ranking positions are stored with
+    less precision.
+
+    The profiles and the rankings are Profiles sharing the arrays of
+    their topic ids, and the TopicIndex is a QuantizedIndex. The
+    SparseCorpus of the numpy engine is built from the quantized values,
+    but it stores them as doubles.
+
+    Attributes:
+        storage: the storage of the values, one of STORAGES
+        vocabulary: the Vocabulary of the topics
+    """
+
+    def __init__(self, corpus, storage='uint16', vocabulary=None):
+        """
+        Quantize the profiles and the rankings of a Corpus.
+
+        Args:
+            corpus: the Corpus, which is not modified
+            storage (optional): the storage of the values, one of
+                STORAGES
+            vocabulary (optional): the Vocabulary where the topics are
+                interned. By default a new one is created
+
+        Raises:
+            ValueError: storage is not one of STORAGES
+        """
+        if storage not in STORAGES:
+            raise ValueError("unknown storage: %s" % storage)
+        if vocabulary is None:
+            vocabulary = Vocabulary()
+        profiles = []
+        rankings = []
+        for profile, ranking in zip(corpus.profiles, corpus.rankings):
+            topics = sorted((vocabulary.intern(topic), topic)
+                            for topic in profile)
+            topic_ids = array('I', [topic_id for topic_id, _ in topics])
+            profiles.append(Profile(vocabulary, topic_ids, _get_array(
+                [profile[topic] for _, topic in topics], storage)))
+            rankings.append(Profile(vocabulary, topic_ids, _get_array(
+                [ranking[topic] for _, topic in topics], storage)))
+        super().__init__(corpus.ids, profiles, rankings, corpus.translate)
+        self.storage = storage
+        self.vocabulary = vocabulary
+        self._index = QuantizedIndex(vocabulary, profiles, storage)
+
+
+def _get_top_k(match_values, k):
+    # the indexes of the k highest positive match_values, the lowest
+    # index first among equal values, as returned by match_top_k
+    return heapq.nsmallest(
+        k, (i for i, value in enumerate(match_values) if value > 0),
+        key=lambda i: (-match_values[i], i))
+
+
+def get_accuracy_report(profiles, exact, quantized, k=10, translate=False,
+                        algorithms=None):
+    """
+    Compare the matching of some profiles with a quantized corpus with
+    the matching with the exact one.
+
+    Args:
+        profiles: iterable of the profiles to match
+        exact: the Corpus of the cmp_profiles
+        quantized: the QuantizedCorpus of the same cmp_profiles
+        k (optional): the number of most similar profiles compared
+        translate (optional): if set to True, the topics of the profiles
+            are translated to English when the translation is available
+        algorithms (optional): list with the names of the algorithms to
+            run, see scorers.py. By default ALGORITHMS
+
+    Returns:
+        a dictionary with the 'storage', the number of 'profiles' and,
+        for each algorithm, a dictionary with:
+        'top1_agreement': the share of the profiles with the same most
+            similar cmp_profile
+        'top_k_agreement': the share of the k most similar cmp_profiles
+            which are also among the k most similar with the quantized
+            corpus
+        'max_error': the highest absolute difference of a match_value
+        'max_relative_error': the highest absolute difference of a
+            match_value divided by the highest exact match_value of its
+            profile
+
+    Raises:
+        ValueError: the two corpora have a different size, or an
+            algorithm is not registered
+    """
+    if len(exact) != len(quantized):
+        raise ValueError("the two corpora have a different size")
+    scorers = get_scorers(algorithms)
+    reports = [{'top1': 0, 'found': 0, 'total': 0, 'max_error': 0.0,
+                'max_relative_error': 0.0} for _ in scorers]
+    size = 0
+    for profile in profiles:
+        profile = get_parsed_profile(profile, translate)
+        values_to_percentage(profile)
+        size += 1
+        for report, exact_values, quantized_values in zip(
+                reports, score(profile, exact, scorers),
+                score(profile, quantized, scorers)):
+            if get_best_match(exact_values) == \
+                    get_best_match(quantized_values):
+                report['top1'] += 1
+            exact_top = set(_get_top_k(exact_values, k))
+            report['found'] += len(
+                exact_top & set(_get_top_k(quantized_values, k)))
+            report['total'] += len(exact_top)
+            error = max((abs(value1 - value2) for value1, value2
+                         in zip(exact_values, quantized_values)),
+                        default=0.0)
+            report['max_error'] = max(report['max_error'], error)
+            highest = max(exact_values, default=0)
+            if highest > 0:
+                report['max_relative_error'] = max(
+                    report['max_relative_error'], error / highest)
+
+    results = {'storage': quantized.storage, 'profiles': size}
+    for scorer, report in zip(scorers, reports):
+        results[scorer.name] = {
+            'top1_agreement': report['top1'] / size if size else None,
+            'top_k_agreement': report['found'] / report['total']
+            if report['total'] else None,
+            'max_error': report['max_error'],
+            'max_relative_error': report['max_relative_error'],
+        }
+    return results
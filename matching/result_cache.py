@@ -0,0 +1,182 @@
+"""
+Contains a cache of the results of the matching, so that a profile which
+is matched again against the same corpus is not compared again.
+
+The results are associated with a hash of the parsed profile, where each
+topic is associated with its percentage of discussions, together with
+the version of the corpus and the options of the matching. The least
+recently used results are evicted when the cache is full, and the
+results expire after a time-to-live.
+
+The cache is bound to a single corpus: when it is used with a different
+Corpus, e.g. after a reload, or with a Corpus whose version changed, all
+the results are discarded.
+"""
+import hashlib
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from .stats import count
+
+# default maximum number of results stored
+MAX_SIZE = 1024
+
+
+def get_profile_hash(profile):
+    """
+    Compute a hash of a parsed profile which does not depend on the
+    order of its topics.
+
+    Args:
+        profile: a profile where each topic is associated with its value
+
+    Returns:
+        the hexadecimal sha256 of the sorted topics and values
+    """
+    content = json.dumps(sorted(profile.items()), ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of the results of the matching of the profiles against a
+    corpus.
+
+    Each result holds a similarity value for each cmp_profile, so the
+    memory used is about max_size times the size of the corpus.
+
+    Attributes:
+        max_size: maximum number of results stored
+        ttl: number of seconds after which a result expires, or None if
+            results never expire
+        hits: number of results found in the cache
+        misses: number of results not found in the cache
+        evictions: number of results evicted because the cache was full
+            or they expired
+        invalidations: number of times all the results were discarded
+            because the corpus changed
+    """
+
+    def __init__(self, max_size=MAX_SIZE, ttl=None):
+        """
+        Args:
+            max_size (optional): maximum number of results stored
+            ttl (optional): number of seconds after which a result
+                expires
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._results = OrderedDict()
+        self._corpus = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def _check_corpus(self, corpus):
+        """
+        Discard all the results if the corpus is not the one of the
+        stored results or its version changed.
+        """
+        if self._corpus is not None and self._corpus() is corpus and \
+                self._version == corpus.version:
+            return
+        if self._results:
+            self._results.clear()
+            self.invalidations += 1
+        self._corpus = weakref.ref(corpus)
+        self._version = corpus.version
+
+    def get_key(self, profile, corpus, options):
+        """
+        Build the key of a result.
+
+        Args:
+            profile: the parsed profile, where each topic is associated
+                with its percentage of discussions
+            corpus: the Corpus of the cmp_profiles
+            options: a tuple with the options of the matching which
+                change the result, e.g. the algorithms
+
+        Returns:
+            the key
+        """
+        return (get_profile_hash(profile), corpus.version) + tuple(options)
+
+    def get(self, corpus, key):
+        """
+        Look for a result.
+
+        Args:
+            corpus: the Corpus of the cmp_profiles
+            key: the key of the result, as returned by get_key
+
+        Returns:
+            the result, or None if it is not in the cache or it expired
+        """
+        with self._lock:
+            self._check_corpus(corpus)
+            entry = self._results.get(key)
+            if entry is not None and self.ttl is not None and \
+                    time.monotonic() - entry[0] > self.ttl:
+                del self._results[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                count('result_cache_misses')
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+        count('result_cache_hits')
+        return entry[1]
+
+    def put(self, corpus, key, result):
+        """
+        Store a result.
+
+        Args:
+            corpus: the Corpus of the cmp_profiles
+            key: the key of the result, as returned by get_key
+            result: the result. It must not be modified afterwards
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._check_corpus(corpus)
+            self._results[key] = (time.monotonic(), result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all the results.
+        """
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        """
+        Describe the use of the cache.
+
+        Returns:
+            a dictionary with the number of results stored, the hits,
+            the misses, the hit rate (None without lookups), the
+            evictions and the invalidations
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._results), 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else None,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
@@ -0,0 +1,228 @@
+"""
+Contains the registry of the scorers, i.e. the algorithms which compute
+the match_values, and the driver which runs any of them in a single
+pass over the corpus.
+
+Both the algorithms sum, over the topics discussed by both profiles, a
+contribution which depends only on the values of the topic in the two
+profiles and, for algorithm2, on its positions in their rankings. So a
+scorer is defined by its contribution and by an optional preprocessing
+of each profile (the ranking of algorithm2), and the driver finds the
+topics shared by the profile and each cmp_profile once, feeding each of
+them to all the requested scorers.
+
+New algorithms can be added with register_scorer.
+"""
+from .algorithm1 import get_similarity
+from .algorithm2 import get_normalized_ranking, get_topic_value
+
+# the algorithms run by default, in the order of their results
+ALGORITHMS = ('algorithm1', 'algorithm2')
+_scorers = {}
+
+
+class Scorer:
+    """
+    An algorithm which computes the match_values.
+
+    Attributes:
+        name: the name of the algorithm
+        title: the title printed with its results
+        contribution: function which takes the values of a topic in
+            the two profiles and, if the scorer has prepare, the values
+            associated with the topic by prepare in the two profiles,
+            and returns the contribution of the topic to the
+            match_value
+        prepare: function which takes a profile and returns a
+            dictionary where each topic is associated with a value used
+            by contribution, or None
+        bounded: True if the contribution of a topic is never higher
+            than the lowest of its two values, so that the cmp_profiles
+            which cannot be among the most similar are not evaluated
+            (see topk.py)
+        symmetric: True if the contribution does not change when the 
+            two profiles are swapped, so that the match_value of a pair 
+            is computed once (see allpairs.py)
+    """
+
+    def __init__(self, name, contribution, prepare=None, title=None,
+                 bounded=False, symmetric=False):
+        self.name = name
+        self.title = title if title is not None else name
+        self.contribution = contribution
+        self.prepare = prepare
+        self.bounded = bounded
+        self.symmetric = symmetric
+
+
+def register_scorer(name, contribution, prepare=None, title=None,
+                    bounded=False, symmetric=False):
+    """
+    Add an algorithm to the registry.
+
+    Args:
+        name: the name of the algorithm
+        contribution: function which computes the contribution of a
+            topic to the match_value, see Scorer
+        prepare (optional): function which computes the values used by
+            contribution for each profile, see Scorer
+        title (optional): the title printed with its results. By
+            default the name
+        bounded (optional): True if the contribution of a topic is never
+            higher than the lowest of its two values
+        symmetric (optional): True if the contribution does not change 
+            when the two profiles are swapped
+
+    Returns:
+        the registered Scorer
+    """
+    scorer = Scorer(name, contribution, prepare, title, bounded, symmetric)
+    _scorers[name] = scorer
+    return scorer
+
+
+def get_scorer(name):
+    """
+    Get a registered algorithm.
+
+    Args:
+        name: the name of the algorithm
+
+    Returns:
+        the Scorer
+
+    Raises:
+        ValueError: no algorithm is registered with the name
+    """
+    scorer = _scorers.get(name)
+    if scorer is None:
+        raise ValueError("unknown algorithm: %s" % name)
+    return scorer
+
+
+def get_scorer_names():
+    """
+    List the names of the registered algorithms.
+
+    Returns:
+        a list with the names, in the order of registration
+    """
+    return list(_scorers)
+
+
+register_scorer('algorithm1', get_similarity, title='Algorithm 1',
+                bounded=True, symmetric=True)
+register_scorer('algorithm2', get_topic_value, get_normalized_ranking,
+                title='Algorithm 2', bounded=True, symmetric=True)
+
+
+def _prepare(profile, corpus, scorers):
+    """
+    Collect, for each scorer, its contribution function and the
+    prepared values of the profile and of the profiles of the corpus.
+    """
+    prepared = []
+    for scorer in scorers:
+        if scorer.prepare is None:
+            prepared.append((scorer.contribution, None, None))
+        else:
+            prepared.append((scorer.contribution, scorer.prepare(profile),
+                             corpus.get_prepared(scorer.prepare)))
+    return prepared
+
+
+def score(profile, corpus, scorers):
+    """
+    Compute the match_values of the profile with all the profiles of a
+    corpus, for some algorithms, in a single pass.
+
+    Only the postings of the topics of profile in the TopicIndex of the
+    corpus are visited, so the cmp_profiles which do not share any
+    topic with profile get a match_value of 0.
+
+    Args:
+        profile: the profile, where each topic is associated with its
+            percentage of discussions over all discussions
+        corpus: the Corpus of the cmp_profiles
+        scorers: list of Scorers
+
+    Returns:
+        a list with the list of the match_values of each scorer
+    """
+    prepared = _prepare(profile, corpus, scorers)
+    match_values = [[0] * len(corpus) for _ in scorers]
+    steps = [(contribution, prepared1, prepared2, values)
+             for (contribution, prepared1, prepared2), values
+             in zip(prepared, match_values)]
+    index = corpus.index
+    for topic, value1 in profile.items():
+        # the cmp_profiles sharing the topic are found once for all the
+        # scorers
+        postings = index.get_postings(topic)
+        if not postings:
+            continue
+        for contribution, prepared1, prepared2, values in steps:
+            if prepared1 is None:
+                for i, value2 in postings:
+                    values[i] += contribution(value1, value2)
+            else:
+                topic_prepared1 = prepared1[topic]
+                for i, value2 in postings:
+                    values[i] += contribution(
+                        value1, value2, topic_prepared1,
+                        prepared2[i][topic])
+    return match_values
+
+
+class PairScorer:
+    """
+    Computes the match_values of a profile with single profiles of a
+    corpus, for some algorithms at the same time.
+
+    The topics shared by the two profiles are found once and fed to all
+    the scorers. The match_values of each cmp_profile are computed only
+    the first time they are requested.
+    """
+
+    def __init__(self, profile, corpus, scorers):
+        """
+        Args:
+            profile: the profile, where each topic is associated with its
+                percentage of discussions over all discussions
+            corpus: the Corpus of the cmp_profiles
+            scorers: list of Scorers
+        """
+        self.profile = profile
+        self.corpus = corpus
+        self._prepared = _prepare(profile, corpus, scorers)
+        self._values = {}
+
+    def __call__(self, i):
+        """
+        Get the match_values with a profile of the corpus.
+
+        Args:
+            i: the index of the cmp_profile
+
+        Returns:
+            a list with the match_value of each scorer
+        """
+        values = self._values.get(i)
+        if values is not None:
+            return values
+        values = [0] * len(self._prepared)
+        cmp_profile = self.corpus.profiles[i]
+        for topic, value1 in self.profile.items():
+            value2 = cmp_profile.get(topic)
+            if value2 is None:
+                continue
+            for k, (contribution, prepared1, prepared2) in \
+                    enumerate(self._prepared):
+                if prepared1 is None:
+                    values[k] += contribution(value1, value2)
+                else:
+                    values[k] += contribution(
+                        value1, value2, prepared1[topic],
+                        prepared2[i][topic])
+        self._values[i] = values
+        return values
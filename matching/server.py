@@ -0,0 +1,357 @@
+"""
+Contains a local HTTP service which keeps the cmp_profiles in memory, so
+that each matching only costs the evaluation of the similarity values.
+
+The service answers to:
+    GET /status: the number of cmp_profiles and the version of the
+        corpus, which is increased at each reload, the files skipped
+        because they are not valid profiles, the error of the last
+        reload if it failed, and the use of the result cache if it is
+        enabled
+    GET /stats: the timings and the counters recorded since the start,
+        if the instrumentation is enabled (see stats.py)
+    POST /match: the body is the json of a profile, the answer contains
+        for each algorithm the id of the most similar profile and the
+        similarity values. With the query parameter top_k=K only the K
+        most similar profiles are returned, and with algorithms=A,B only
+        the results of the algorithms A and B, in this order. Errors are
+        answered with a json object with the 'error': 400 for an invalid
+        profile or query, 500 for a failed translation or any other
+        error
+
+The directory of the cmp_profiles is checked periodically, and the
+corpus is reloaded when a file is added, removed or modified. Only the
+files which changed are parsed again, and the files which are not valid
+profiles are skipped until they change. If a reload fails, the current
+corpus is kept and the reload is retried at the next check.
+
+With a ResultCache (see result_cache.py), a profile which is matched
+again with the same options gets the stored result, until the corpus is
+reloaded.
+"""
+import json
+import sys
+import threading
+import urllib.parse
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .corpus import build_snapshot, snapshot_to_corpus, get_sources, \
+    read_snapshot, write_snapshot
+from .matcher import match, match_top_k, get_scorers
+from .parsing.parser import check_profile
+from .stats import get_stats
+from .vectorized import HAS_NUMPY
+
+
+class MatchingService:
+    """
+    The corpus of a directory of cmp_profiles kept in memory.
+
+    Attributes:
+        cmp_profiles_dir: the directory containing the cmp_profiles
+        translate: True if the topics are translated to English
+        engine: the engine used to compute the similarity values
+        algorithms: the names of the algorithms run when a request does
+            not choose them, or None for ALGORITHMS
+        compact: True if the corpus is kept as Profiles (see
+            Corpus.compact)
+        snapshot_path: the path where the snapshot of the corpus is
+            stored, or None if it is kept only in memory
+        corpus: the current Corpus
+        version: number of times the corpus has been loaded
+        result_cache: the ResultCache of the results, or None
+        reload_error: the error of the last reload of watch, or None if
+            it succeeded
+    """
+
+    def __init__(self, cmp_profiles_dir, translate=False, engine='python',
+                 snapshot_path=None, result_cache=None, algorithms=None,
+                 compact=False):
+        """
+        Load the corpus of the given directory.
+
+        Args:
+            cmp_profiles_dir: the directory containing the cmp_profiles
+            translate (optional): if set to True, the topics of profiles
+                are translated to English when the translation is
+                available
+            engine (optional): the engine used to compute the
+                similarity values
+            snapshot_path (optional): if given, the corpus is initially
+                loaded from this snapshot, and each reload is written to
+                it
+            result_cache (optional): a ResultCache where the results
+                are stored. It is cleared when the corpus is reloaded
+            algorithms (optional): list with the names of the algorithms
+                run when a request does not choose them. By default
+                ALGORITHMS
+            compact (optional): if set to True, the profiles of the
+                corpus are kept as Profiles, which take less memory
+
+        Raises:
+            ValueError: an algorithm is not registered
+        """
+        get_scorers(algorithms)
+        self.cmp_profiles_dir = cmp_profiles_dir
+        self.translate = translate
+        self.engine = engine
+        self.snapshot_path = snapshot_path
+        self.result_cache = result_cache
+        self.algorithms = algorithms
+        self.compact = compact
+        self.reload_error = None
+        self.corpus = None
+        self.version = 0
+        self._snapshot = read_snapshot(snapshot_path) \
+            if snapshot_path else None
+        self._lock = threading.Lock()
+        # held only to replace or to read the corpus with its version,
+        # so that the requests are not blocked while a reload parses
+        self._current_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.reload(force=True)
+
+    def reload(self, force=False):
+        """
+        Reload the corpus if the files in the directory changed.
+
+        Args:
+            force (optional): if set to True, the corpus is reloaded
+                even if no modification time or size changed
+
+        Returns:
+            True if the corpus has been reloaded
+        """
+        with self._lock:
+            sources = get_sources(self.cmp_profiles_dir)
+            if not force and self._snapshot is not None:
+                loaded = {filename: (mtime, size) for filename, (mtime, size,
+                          _) in self._snapshot['sources'].items()}
+                if loaded == sources:
+                    return False
+            snapshot = build_snapshot(
+                self.cmp_profiles_dir, self.translate, self._snapshot,
+                skip_invalid=True)
+            corpus = snapshot_to_corpus(snapshot)
+            if self.compact:
+                corpus = corpus.compact()
+            # build the structures used by the matching before the
+            # corpus is visible to the requests
+            corpus.index
+            if self.engine == 'numpy' and HAS_NUMPY:
+                corpus.sparse
+            if self.snapshot_path:
+                write_snapshot(snapshot, self.snapshot_path)
+            self._snapshot = snapshot
+            with self._current_lock:
+                self.corpus = corpus
+                self.version += 1
+            return True
+
+    def get_current(self):
+        """
+        Get the current corpus together with its version.
+
+        Returns:
+            a tuple with the Corpus and its version, which are not
+            changed by a concurrent reload
+        """
+        with self._current_lock:
+            return self.corpus, self.version
+
+    def watch(self, interval):
+        """
+        Start a thread which reloads the corpus periodically.
+
+        Args:
+            interval: number of seconds between two checks of the
+                directory
+
+        Returns:
+            the started thread
+        """
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload()
+                except Exception as ex:
+                    # e.g. a file removed while it is read, or a failed
+                    # translation: keep the current corpus and retry at
+                    # the next check
+                    error = "%s: %s" % (type(ex).__name__, ex)
+                    if error != self.reload_error:
+                        print("Error while reloading the profiles: %s"
+                              % error, file=sys.stderr)
+                    self.reload_error = error
+                else:
+                    self.reload_error = None
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """
+        Stop the thread started by watch.
+        """
+        self._stop.set()
+
+    def status(self):
+        """
+        Describe the current corpus.
+
+        Returns:
+            a dictionary with the number of cmp_profiles, the version
+            of the corpus, the error of each file skipped because it is
+            not a valid profile, the error of the last reload if it
+            failed and, if there is a result cache, its use
+        """
+        corpus, version = self.get_current()
+        status = {'profiles': len(corpus), 'version': version,
+                  'invalid': dict(self._snapshot['invalid'])}
+        if self.reload_error is not None:
+            status['reload_error'] = self.reload_error
+        if self.result_cache is not None:
+            status['result_cache'] = self.result_cache.stats()
+        return status
+
+    def match(self, profile, top_k=None, algorithms=None):
+        """
+        Find the profiles most similar to the given one.
+
+        Args:
+            profile: a profile where topics are urls of Wikipedia
+                categories
+            top_k (optional): if given, only the top_k most similar
+                profiles are returned
+            algorithms (optional): list with the names of the algorithms
+                to run. By default the ones of the service
+
+        Returns:
+            a dictionary with the version of the corpus used and a list
+            with the result of each algorithm. Each result contains
+            either the id of the most similar profile ('best_match')
+            and the similarity value with each profile
+            ('match_values'), or the list of the top_k most similar
+            profiles with their similarity values ('top_k')
+
+        Raises:
+            ValueError: the profile is not valid, or an algorithm is not
+                registered
+            requests.exceptions.RequestException: the translation of the
+                topics failed
+        """
+        check_profile(profile)
+        if algorithms is None:
+            algorithms = self.algorithms
+        # the corpus may be replaced by a reload during the matching
+        corpus, version = self.get_current()
+        if top_k is not None:
+            results = [{'top_k': top_matches} for top_matches in
+                       match_top_k(profile, corpus, top_k,
+                                   translate=self.translate,
+                                   algorithms=algorithms,
+                                   cache=self.result_cache)]
+        else:
+            results = [
+                {'best_match': best_match,
+                 'match_values': dict(zip(corpus.ids, match_values))}
+                for best_match, match_values in
+                match(profile, corpus, translate=self.translate,
+                      engine=self.engine, algorithms=algorithms,
+                      cache=self.result_cache)]
+        return {'version': version, 'results': results}
+
+
+class MatchingRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the requests to the MatchingService of the server.
+    """
+
+    def _send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path == '/status':
+            self._send_json(200, self.server.service.status())
+        elif path == '/stats' and get_stats() is not None:
+            self._send_json(200, get_stats().to_dict())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != '/match':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            query = urllib.parse.parse_qs(url.query)
+            top_k = int(query['top_k'][0]) if 'top_k' in query else None
+            algorithms = query['algorithms'][0].split(',') \
+                if 'algorithms' in query else None
+            length = int(self.headers.get('Content-Length', 0))
+            profile = json.loads(self.rfile.read(length))
+            result = self.server.service.match(profile, top_k, algorithms)
+        except (ValueError, json.decoder.JSONDecodeError) as ex:
+            self._send_json(400, {'error': str(ex)})
+            return
+        except requests.exceptions.RequestException as ex:
+            self._send_json(500, {'error': "error during the connection to "
+                                  "Wikipedia API: %s" % ex})
+            return
+        except Exception as ex:
+            # answer anyway, instead of dropping the connection
+            self._send_json(500, {'error': "%s: %s"
+                                  % (type(ex).__name__, ex)})
+            return
+        self._send_json(200, result)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(service, host='127.0.0.1', port=8000):
+    """
+    Create the HTTP server of a MatchingService.
+
+    Each request is handled in its own thread.
+
+    Args:
+        service: the MatchingService
+        host (optional): the address on which the server listens
+        port (optional): the port on which the server listens. With 0
+            a free port is chosen
+
+    Returns:
+        the ThreadingHTTPServer, not started yet
+    """
+    server = ThreadingHTTPServer((host, port), MatchingRequestHandler)
+    server.service = service
+    return server
+
+
+def serve(service, host='127.0.0.1', port=8000, reload_interval=1.0):
+    """
+    Serve the requests to a MatchingService until interrupted.
+
+    Args:
+        service: the MatchingService
+        host (optional): the address on which the server listens
+        port (optional): the port on which the server listens
+        reload_interval (optional): number of seconds between two
+            checks of the directory of the cmp_profiles
+    """
+    server = create_server(service, host, port)
+    service.watch(reload_interval)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
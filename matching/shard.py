@@ -0,0 +1,422 @@
+"""
+Contains a sharded matching, where the cmp_profiles are split among
+worker processes which are reached over HTTP.
+
+Each cmp_profile is assigned to a shard by a hash of its id, and each
+shard is served by a worker which keeps only its cmp_profiles in
+memory and scores them with the requested algorithms, by default both.
+A coordinator sends the profile to all the shards at the same time and
+merges their results, which are the same of the matching in a single
+process.
+
+A worker answers with the same protocol of the matching service (see
+server.py), so workers on other hosts can be reached by their address.
+Each request has a timeout, so a slow or dead shard raises a
+ShardTimeoutError instead of blocking the coordinator.
+"""
+import os
+import zlib
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from .corpus import Corpus
+from .matcher import match, match_top_k, get_best_match, get_scorers
+from .parsing.loader import get_profile_by_file, get_profile_filenames, \
+    path_to_id
+from .parsing.parser import check_profile, reinit_after_fork
+from .server import create_server
+from .workers import get_context
+
+# default number of seconds to wait for the answer of a shard
+TIMEOUT = 10.0
+
+
+class ShardError(Exception):
+    """
+    A shard could not be reached or gave an invalid answer.
+    """
+
+
+class ShardTimeoutError(ShardError):
+    """
+    A shard did not answer in time.
+    """
+
+
+def get_shard(profile_id, shards):
+    """
+    Find the shard of a cmp_profile.
+
+    The hash does not depend on the process, so all the workers and the
+    coordinator agree on the assignment.
+
+    Args:
+        profile_id: the id of the cmp_profile
+        shards: the number of shards
+
+    Returns:
+        the index of the shard, from 0 to shards - 1
+    """
+    return zlib.crc32(str(profile_id).encode('utf-8')) % shards
+
+
+def _get_params(scorers):
+    # the query parameters which choose the algorithms run by a shard
+    return {'algorithms': ','.join(scorer.name for scorer in scorers)}
+
+
+class ShardService:
+    """
+    The cmp_profiles of a shard kept in memory.
+
+    The ids of its Corpus are the positions of the cmp_profiles among
+    all the ones of the directory, so that the coordinator can merge
+    the results of the shards in the same order of a single process.
+
+    Attributes:
+        shard: the index of the shard
+        shards: the number of shards
+        translate: True if the topics are translated to English
+        engine: the engine used to compute the similarity values
+        compact: True if the corpus is kept as Profiles (see
+            Corpus.compact)
+        ids: a dictionary where the position of each cmp_profile of the
+            shard is associated with its id
+        corpus: the Corpus of the cmp_profiles of the shard
+    """
+
+    def __init__(self, cmp_profiles_dir, shard, shards, translate=False,
+                 engine='python', compact=False):
+        """
+        Load the cmp_profiles of the shard.
+
+        Args:
+            cmp_profiles_dir: the directory containing all the
+                cmp_profiles
+            shard: the index of the shard
+            shards: the number of shards
+            translate (optional): if set to True, the topics of profiles
+                are translated to English when the translation is
+                available
+            engine (optional): the engine used to compute the
+                similarity values
+            compact (optional): if set to True, the profiles of the
+                shard are kept as Profiles, which take less memory
+        """
+        self.shard = shard
+        self.shards = shards
+        self.translate = translate
+        self.engine = engine
+        self.compact = compact
+        self.ids = {}
+        profiles = []
+        for position, filename in enumerate(
+                get_profile_filenames(cmp_profiles_dir)):
+            if get_shard(path_to_id(filename), shards) == shard:
+                profile_id, profile = get_profile_by_file(
+                    os.path.join(cmp_profiles_dir, filename))
+                self.ids[position] = profile_id
+                profiles.append(profile)
+        self.corpus = Corpus.from_profiles(profiles, list(self.ids),
+                                           translate)
+        if compact:
+            self.corpus = self.corpus.compact()
+        self.corpus.index
+
+    def status(self):
+        """
+        Describe the shard.
+
+        Returns:
+            a dictionary with the index of the shard, the number of its
+            cmp_profiles and a list with the position and the id of each
+            of them
+        """
+        return {'shard': self.shard, 'profiles': len(self.corpus),
+                'ids': list(self.ids.items())}
+
+    def match(self, profile, top_k=None, algorithms=None):
+        """
+        Score the cmp_profiles of the shard.
+
+        Args:
+            profile: a profile where topics are urls of Wikipedia
+                categories
+            top_k (optional): if given, only the top_k most similar
+                cmp_profiles of the shard are returned
+            algorithms (optional): list with the names of the algorithms
+                to run. By default ALGORITHMS
+
+        Returns:
+            a dictionary with the index of the shard and a list with the
+            result of each algorithm. Each result is either the list of
+            the similarity values with the cmp_profiles at 'positions',
+            or the list of the top_k positions with their similarity
+            values
+
+        Raises:
+            ValueError: the profile is not valid, or an algorithm is not
+                registered
+        """
+        check_profile(profile)
+        if top_k is not None:
+            return {'shard': self.shard, 'results': match_top_k(
+                profile, self.corpus, top_k, translate=self.translate,
+                algorithms=algorithms)}
+        return {'shard': self.shard, 'positions': self.corpus.ids,
+                'results': [match_values for _, match_values in match(
+                    profile, self.corpus, translate=self.translate,
+                    engine=self.engine, algorithms=algorithms)]}
+
+
+def _run_worker(cmp_profiles_dir, shard, shards, translate, engine, compact,
+                host, connection):
+    """
+    Serve a shard until the process is terminated.
+
+    The port of the server, or the error raised while loading the
+    shard, is sent through connection.
+    """
+    reinit_after_fork()
+    try:
+        service = ShardService(cmp_profiles_dir, shard, shards, translate,
+                               engine, compact)
+        server = create_server(service, host, 0)
+    except Exception as ex:
+        connection.send(('error', '%s: %s' % (type(ex).__name__, ex)))
+        return
+    connection.send(('port', server.server_address[1]))
+    connection.close()
+    server.serve_forever()
+
+
+class ShardCluster:
+    """
+    Worker processes serving the shards of a directory on this host.
+
+    Attributes:
+        processes: the worker process of each shard
+        addresses: the url of the worker of each shard
+    """
+
+    def __init__(self, cmp_profiles_dir, shards, translate=False,
+                 engine='python', host='127.0.0.1', timeout=None,
+                 compact=False):
+        """
+        Start a worker process for each shard.
+
+        Args:
+            cmp_profiles_dir: the directory containing the cmp_profiles
+            shards: the number of shards
+            translate (optional): if set to True, the topics of profiles
+                are translated to English when the translation is
+                available
+            engine (optional): the engine used to compute the
+                similarity values
+            host (optional): the address on which the workers listen
+            timeout (optional): number of seconds to wait for each
+                worker to load its shard. By default there is no limit
+            compact (optional): if set to True, the workers keep their
+                profiles as Profiles, which take less memory
+
+        Raises:
+            ShardError: a worker could not load its shard
+            ShardTimeoutError: a worker did not start in time
+        """
+        context = get_context()
+        self.processes = []
+        self.addresses = []
+        connections = []
+        for shard in range(shards):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_run_worker, daemon=True,
+                args=(cmp_profiles_dir, shard, shards, translate, engine,
+                      compact, host, sender))
+            process.start()
+            sender.close()
+            self.processes.append(process)
+            connections.append(receiver)
+        try:
+            for shard, receiver in enumerate(connections):
+                if not receiver.poll(timeout):
+                    raise ShardTimeoutError(
+                        "shard %d did not start in time" % shard)
+                try:
+                    kind, value = receiver.recv()
+                except EOFError:
+                    raise ShardError("shard %d exited" % shard)
+                if kind == 'error':
+                    raise ShardError("shard %d: %s" % (shard, value))
+                self.addresses.append('http://%s:%d' % (host, value))
+        except ShardError:
+            self.stop()
+            raise
+
+    def stop(self):
+        """
+        Terminate the worker processes.
+        """
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+
+class ShardedMatcher:
+    """
+    Coordinator of the matching over the shards.
+
+    Attributes:
+        addresses: the url of the worker of each shard
+        timeout: number of seconds to wait for the answers of the shards
+        ids: the ids of all the cmp_profiles, in the order of the
+            directory
+    """
+
+    def __init__(self, addresses, timeout=TIMEOUT):
+        """
+        Connect to the shards and collect the ids of their cmp_profiles.
+
+        Args:
+            addresses: the url of the worker of each shard
+            timeout (optional): number of seconds to wait for the
+                answers of the shards
+
+        Raises:
+            ShardError: a shard could not be reached
+            ShardTimeoutError: a shard did not answer in time
+        """
+        self.addresses = list(addresses)
+        self.timeout = timeout
+        ids = {}
+        for status in self._scatter('get', '/status'):
+            ids.update((position, profile_id)
+                       for position, profile_id in status['ids'])
+        if sorted(ids) != list(range(len(ids))):
+            raise ShardError("the shards do not cover the cmp_profiles")
+        self.ids = [ids[position] for position in range(len(ids))]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _request(self, method, address, path, **kwargs):
+        try:
+            response = requests.request(method, address + path,
+                                        timeout=self.timeout, **kwargs)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.Timeout:
+            raise ShardTimeoutError("shard %s did not answer in %g sec" %
+                                    (address, self.timeout))
+        except (requests.exceptions.RequestException, ValueError) as ex:
+            raise ShardError("shard %s: %s" % (address, ex))
+
+    def _scatter(self, method, path, **kwargs):
+        """
+        Send the same request to all the shards at the same time.
+
+        Returns:
+            the list of the decoded answers, in the order of addresses
+
+        Raises:
+            ShardError: a shard could not be reached
+            ShardTimeoutError: a shard did not answer in time
+        """
+        executor = ThreadPoolExecutor(len(self.addresses))
+        try:
+            futures = [executor.submit(self._request, method, address, path,
+                                       **kwargs)
+                       for address in self.addresses]
+            # the timeout of requests bounds each read, this one bounds
+            # the whole answer
+            _, not_done = wait(futures, self.timeout)
+            if not_done:
+                raise ShardTimeoutError(
+                    "%d shards did not answer in %g sec" %
+                    (len(not_done), self.timeout))
+            return [future.result() for future in futures]
+        finally:
+            executor.shutdown(wait=False)
+
+    def match(self, profile, algorithms=None):
+        """
+        Find the most similar profile to the given one among the
+        cmp_profiles of all the shards.
+
+        Args:
+            profile: a profile where topics are urls of Wikipedia
+                categories
+            algorithms (optional): list with the names of the algorithms
+                to run. By default ALGORITHMS
+
+        Returns:
+            a list with a tuple for each of the algorithms, as returned
+            by matcher.match with the ids of the cmp_profiles
+
+        Raises:
+            ValueError: an algorithm is not registered
+            ShardError: a shard could not be reached
+            ShardTimeoutError: a shard did not answer in time
+        """
+        scorers = get_scorers(algorithms)
+        answers = self._scatter('post', '/match', json=profile,
+                                params=_get_params(scorers))
+        results = []
+        for algorithm in range(len(scorers)):
+            match_values = [0] * len(self.ids)
+            for answer in answers:
+                for position, match_value in zip(
+                        answer['positions'], answer['results'][algorithm]):
+                    match_values[position] = match_value
+            best_match = get_best_match(match_values)
+            results.append((self.ids[best_match]
+                            if best_match is not None else None,
+                            match_values))
+        return results
+
+    def match_top_k(self, profile, k, algorithms=None):
+        """
+        Find the k most similar profiles to the given one among the
+        cmp_profiles of all the shards.
+
+        Each shard returns its k most similar cmp_profiles, and the k
+        best of them are kept. Profiles with the same similarity value
+        are sorted by their position, as in a single process.
+
+        Args:
+            profile: a profile where topics are urls of Wikipedia
+                categories
+            k: the number of most similar profiles to find
+            algorithms (optional): list with the names of the algorithms
+                to run. By default ALGORITHMS
+
+        Returns:
+            a list with a list for each of the algorithms, as returned
+            by matcher.match_top_k with the ids of the cmp_profiles
+
+        Raises:
+            ValueError: an algorithm is not registered
+            ShardError: a shard could not be reached
+            ShardTimeoutError: a shard did not answer in time
+        """
+        scorers = get_scorers(algorithms)
+        params = _get_params(scorers)
+        params['top_k'] = k
+        answers = self._scatter('post', '/match', json=profile,
+                                params=params)
+        results = []
+        for algorithm in range(len(scorers)):
+            candidates = sorted(
+                (tuple(item) for answer in answers
+                 for item in answer['results'][algorithm]),
+                key=lambda item: (-item[1], item[0]))
+            results.append([(self.ids[position], match_value)
+                            for position, match_value in candidates[:k]])
+        return results
@@ -0,0 +1,215 @@
+"""
+Contains a lightweight instrumentation of the matching.
+
+The stages of the matching record their wall time and some counters
+(profiles and topics processed, overlapping topics, translation
+requests, cache hits...) in the active Stats. When the instrumentation
+is not enabled, which is the default, recording costs a function call
+and a check.
+
+A host service can also register hooks, which are called with each
+recorded value, to forward them to its own metrics.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# the active Stats, or None if the instrumentation is disabled
+_stats = None
+_hooks = []
+
+
+class Stats:
+    """
+    The timings and the counters recorded by the instrumentation.
+
+    Attributes:
+        timings: a dictionary where the name of each stage is associated
+            with the total seconds spent in it
+        calls: a dictionary where the name of each stage is associated
+            with the number of times it has been run
+        counters: a dictionary where the name of each counter is
+            associated with its value
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.calls = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def add_count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def hit_rate(self, name):
+        """
+        Compute the hit rate of a cache.
+
+        Args:
+            name: the prefix of the counters of the cache, which are
+                name + '_hits' and name + '_misses'
+
+        Returns:
+            the share of hits over all lookups, or None if there were no
+            lookups
+        """
+        hits = self.counters.get(name + '_hits', 0)
+        lookups = hits + self.counters.get(name + '_misses', 0)
+        return hits / lookups if lookups else None
+
+    def to_dict(self):
+        """
+        Convert the stats to a dictionary which can be dumped to json.
+
+        Returns:
+            a dictionary with the timings, the calls, the counters and
+            the hit rate of each cache
+        """
+        with self._lock:
+            caches = {name[:-len('_hits')] for name in self.counters
+                      if name.endswith('_hits')}
+            return {
+                'timings': dict(self.timings),
+                'calls': dict(self.calls),
+                'counters': dict(self.counters),
+                'hit_rates': {name: self.hit_rate(name) for name in caches},
+            }
+
+
+def enable_stats(stats=None):
+    """
+    Enable the instrumentation.
+
+    Args:
+        stats (optional): the Stats where values are recorded. By
+            default a new one is created
+
+    Returns:
+        the active Stats
+    """
+    global _stats
+    _stats = stats if stats is not None else Stats()
+    return _stats
+
+
+def disable_stats():
+    """
+    Disable the instrumentation.
+
+    Returns:
+        the Stats which was active, or None
+    """
+    global _stats
+    stats, _stats = _stats, None
+    return stats
+
+
+def get_stats():
+    """
+    Get the active Stats.
+
+    Returns:
+        the active Stats, or None if the instrumentation is disabled
+    """
+    return _stats
+
+
+def is_enabled():
+    """
+    Check if the instrumentation or some hook is active, so that values
+    which are expensive to compute are computed only when needed.
+
+    Returns:
+        True if the recorded values are used
+    """
+    return _stats is not None or bool(_hooks)
+
+
+def add_hook(hook):
+    """
+    Register a function called with each recorded value.
+
+    Hooks are called also if the instrumentation is disabled.
+
+    Args:
+        hook: function which takes the kind of the value ('time' or
+            'count'), its name and the value
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Remove a function registered with add_hook.
+
+    Args:
+        hook: the function to remove
+    """
+    _hooks.remove(hook)
+
+
+def count(name, value=1):
+    """
+    Increase a counter.
+
+    Args:
+        name: the name of the counter
+        value (optional): the increment
+    """
+    if _stats is None and not _hooks:
+        return
+    if _stats is not None:
+        _stats.add_count(name, value)
+    for hook in _hooks:
+        hook('count', name, value)
+
+
+@contextmanager
+def _timed_stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if _stats is not None:
+            _stats.add_time(name, seconds)
+        for hook in _hooks:
+            hook('time', name, seconds)
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """
+    Measure the wall time of a stage.
+
+    Use it as a context manager:
+
+        with stage('parse'):
+            ...
+
+    Args:
+        name: the name of the stage
+
+    Returns:
+        a context manager which records the time spent in it, or which
+        does nothing if the instrumentation is disabled
+    """
+    if _stats is None and not _hooks:
+        return _NO_STAGE
+    return _timed_stage(name)
@@ -0,0 +1,156 @@
+"""
+Contains a streaming matching, where the cmp_profiles are read, parsed
+and scored one chunk at a time, so that the corpus does not need to fit
+in memory.
+
+Only the cmp_profiles of the current chunk are kept in memory, together
+with a heap of the k most similar ones found so far for each algorithm,
+so the peak memory depends on the size of the chunks and on k, not on
+the size of the corpus. The similarity values with all the cmp_profiles
+can be written to a spill file while they are computed.
+
+Each chunk is parsed as a whole, so that with translate set to True the
+foreign topics of its profiles are translated together.
+"""
+import heapq
+import json
+import os
+from .batch import iter_query_profiles
+from .corpus import Corpus
+from .matcher import get_scorers
+from .parsing.loader import iter_profiles_by_dir
+from .parsing.parser import get_parsed_profile, get_parsed_profiles, \
+    values_to_percentage
+from .scorers import score
+from .stats import stage, count
+
+# default number of cmp_profiles read and scored together
+CHUNK_SIZE = 1000
+
+
+def iter_profiles(source):
+    """
+    Read the cmp_profiles from a source one at a time.
+
+    Args:
+        source: a directory of json files, or a JSONL file where each
+            line is either a profile or an object with the 'id' and the
+            'profile' (see batch.iter_query_profiles)
+
+    Yields:
+        a tuple with the id and the profile
+
+    Raises:
+        FileNotFoundError: source does not exist
+        json.decoder.JSONDecodeError: a file or a line is not valid json
+    """
+    if os.path.isdir(source):
+        return iter_profiles_by_dir(source)
+    return iter_query_profiles(source)
+
+
+def iter_chunks(entries, chunk_size=CHUNK_SIZE):
+    """
+    Group the cmp_profiles in chunks.
+
+    Args:
+        entries: iterable of tuples with the id and the profile
+        chunk_size (optional): the number of cmp_profiles of each chunk
+
+    Yields:
+        a tuple with the list of the ids and the list of the profiles of
+        each chunk
+
+    Raises:
+        ValueError: chunk_size is not positive
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive")
+    ids, profiles = [], []
+    for profile_id, profile in entries:
+        ids.append(profile_id)
+        profiles.append(profile)
+        if len(ids) == chunk_size:
+            yield ids, profiles
+            ids, profiles = [], []
+    if ids:
+        yield ids, profiles
+
+
+def match_stream(profile, source, k, chunk_size=CHUNK_SIZE,
+                 translate=False, algorithms=None, spill=None):
+    """
+    Find the k most similar profiles to the given one among the
+    cmp_profiles of a source, reading them one chunk at a time.
+
+    The results are the same of matcher.match_top_k with all the
+    cmp_profiles in the order of the source.
+
+    Args:
+        profile: the profile for which you want to find the most similar
+            ones
+        source: a directory of json files or a JSONL file with the
+            cmp_profiles, or an iterable of tuples with the id and the
+            profile of each cmp_profile
+        k: the number of most similar profiles to find
+        chunk_size (optional): the number of cmp_profiles read and
+            scored together
+        translate (optional): if set to True, the topics of profiles
+            are translated to English when the translation is available
+        algorithms (optional): list with the names of the algorithms to
+            run, see scorers.py. By default ALGORITHMS
+        spill (optional): a text file where a json line is written for
+            each cmp_profile, with its 'id' and its similarity value
+            with each algorithm
+
+    Returns:
+        a list with a list for each of the algorithms, as returned by
+        match_top_k: at most k tuples with the id of a cmp_profile and
+        its match_value, sorted from the most similar
+
+    Raises:
+        ValueError: chunk_size is not positive, or an algorithm is not
+            registered
+    """
+    scorers = get_scorers(algorithms)
+    with stage('parse'):
+        profile = get_parsed_profile(profile, translate)
+    with stage('normalize'):
+        values_to_percentage(profile)
+    count('queries')
+    entries = iter_profiles(source) if isinstance(source, str) else source
+
+    # for each algorithm a min-heap of the k best (match_value,
+    # -position, id): the root is the worst one kept
+    heaps = [[] for _ in scorers]
+    position = 0
+    for ids, profiles in iter_chunks(entries, chunk_size):
+        count('stream_chunks')
+        with stage('parse'):
+            parsed = get_parsed_profiles(profiles, translate)
+        corpus = Corpus.from_parsed(parsed, ids, translate)
+        count('cmp_profiles', len(corpus))
+        with stage('score'):
+            all_match_values = score(profile, corpus, scorers)
+        for heap, match_values in zip(heaps, all_match_values):
+            for j, match_value in enumerate(match_values):
+                if match_value <= 0:
+                    continue
+                item = (match_value, -(position + j), ids[j])
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif heap and item[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, item)
+        if spill is not None:
+            with stage('spill'):
+                for j, profile_id in enumerate(ids):
+                    line = {'id': profile_id}
+                    for scorer, match_values in zip(scorers,
+                                                    all_match_values):
+                        line[scorer.name] = match_values[j]
+                    spill.write(json.dumps(line) + '\n')
+        position += len(ids)
+
+    return [[(profile_id, match_value) for match_value, _, profile_id
+             in sorted(heap, key=lambda item: item[:2], reverse=True)]
+            for heap in heaps]
@@ -0,0 +1,79 @@
+"""
+Contains the functions to find the k profiles most similar to a profile 
+without computing the match_value of every cmp_profile.
+
+With both the algorithms, each topic discussed by both profiles 
+contributes to the match_value with at most the lowest of its two 
+percentages, since the similarity factors are not greater than 1. The 
+sum of these minima is an upper bound of the match_value, which is much 
+cheaper to compute. The cmp_profiles are visited from the highest upper 
+bound, and the visit stops as soon as the upper bound cannot beat the 
+k-th best match_value found so far.
+"""
+import heapq
+from .stats import count
+
+
+def get_upper_bounds(profile, index):
+    """
+    Compute an upper bound of the match_value of each cmp_profile.
+
+    Only the cmp_profiles sharing at least one topic with profile are 
+    visited, the other ones have a match_value of 0.
+
+    Args:
+        profile: the profile, where each topic is associated with its 
+            percentage of discussions over all discussions
+        index: the TopicIndex of the cmp_profiles
+
+    Returns:
+        a dictionary where the index of each cmp_profile sharing at 
+        least one topic with profile is associated with the upper bound 
+        of its match_value
+    """
+    bounds = {}
+    for topic, times in profile.items():
+        for i, cmp_times in index.get_postings(topic):
+            bounds[i] = bounds.get(i, 0) + min(times, cmp_times)
+    return bounds
+
+
+def top_k(match_value_fn, bounds, k):
+    """
+    Find the k cmp_profiles with the highest match_value.
+
+    Args:
+        match_value_fn: function which takes the index of a cmp_profile 
+            and returns its match_value
+        bounds: a dictionary where the index of each candidate 
+            cmp_profile is associated with an upper bound of its 
+            match_value
+        k: the number of cmp_profiles to find
+
+    Returns:
+        a list with at most k tuples with the index of a cmp_profile and 
+        its match_value, sorted from the most similar. Only cmp_profiles 
+        with a positive match_value are returned and among profiles with 
+        the same value the one with the lowest index comes first
+    """
+    candidates = [(-bound, i) for i, bound in bounds.items()]
+    count('top_k_candidates', len(candidates))
+    heapq.heapify(candidates)
+    # min-heap with the best k (match_value, -index) found so far
+    best = []
+    while candidates and k > 0:
+        neg_bound, i = heapq.heappop(candidates)
+        # a cmp_profile with the same value but a lower index would 
+        # still enter the top k, so the visit stops only on strictly 
+        # lower bounds
+        if len(best) == k and -neg_bound < best[0][0]:
+            break
+        value = match_value_fn(i)
+        count('top_k_scored')
+        if not value > 0:
+            continue
+        if len(best) < k:
+            heapq.heappush(best, (value, -i))
+        elif (value, -i) > best[0]:
+            heapq.heapreplace(best, (value, -i))
+    return [(-neg_i, value) for value, neg_i in sorted(best, reverse=True)]
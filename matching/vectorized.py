@@ -0,0 +1,204 @@
+"""
+Implements both the algorithms with NumPy.
+
+The cmp_profiles are stored as a sparse matrix in CSR format, where
+each row is a profile and each column is a topic, with the percentages
+of discussion of the topics and the normalized positions of the topics
+in the ranking of each profile. The match_values of all the
+cmp_profiles are then computed with a few array operations.
+
+NumPy is optional: if it is not installed HAS_NUMPY is False and the
+pure-Python implementations of the algorithms have to be used.
+"""
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    np = None
+    HAS_NUMPY = False
+
+
+class SparseCorpus:
+    """
+    The cmp_profiles stored as a sparse topic-by-profile matrix.
+
+    Attributes:
+        vocabulary: a dictionary where each topic is associated with
+            its column
+        indptr: array where the values of the i-th profile are stored
+            between indptr[i] and indptr[i+1]
+        indices: array with the column of each stored value
+        rows: array with the row of each stored value
+        values: array with the percentage of each stored topic
+        positions: array with the normalized position of each stored
+            topic in the ranking of its profile
+    """
+
+    def __init__(self, profiles, rankings):
+        """
+        Build the matrix of the given profiles.
+
+        Args:
+            profiles: list of profiles where each topic is associated
+                with its percentage of discussions over all discussions
+            rankings: list with the normalized ranking of each profile
+
+        Raises:
+            ImportError: NumPy is not installed
+        """
+        if not HAS_NUMPY:
+            raise ImportError("NumPy is required by SparseCorpus")
+        self.vocabulary = {}
+        indptr = [0]
+        indices = []
+        values = []
+        positions = []
+        for profile, ranking in zip(profiles, rankings):
+            for topic, value in profile.items():
+                column = self.vocabulary.setdefault(
+                    topic, len(self.vocabulary))
+                indices.append(column)
+                values.append(value)
+                positions.append(ranking[topic])
+            indptr.append(len(indices))
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.values = np.array(values, dtype=np.float64)
+        self.positions = np.array(positions, dtype=np.float64)
+        self.rows = np.repeat(np.arange(len(profiles)), np.diff(self.indptr))
+
+    @classmethod
+    def from_arrays(cls, vocabulary, indptr, indices, values, positions):
+        """
+        Build the matrix from arrays which are already in CSR format.
+
+        The arrays are used as they are, without copies.
+
+        Args:
+            vocabulary: mapping where each topic is associated with its
+                column
+            indptr: array where the values of the i-th profile are
+                stored between indptr[i] and indptr[i+1]
+            indices: array with the column of each stored value
+            values: array with the percentage of each stored topic
+            positions: array with the normalized position of each
+                stored topic in the ranking of its profile
+
+        Returns:
+            the SparseCorpus
+        """
+        sparse = cls.__new__(cls)
+        sparse.vocabulary = vocabulary
+        sparse.indptr = indptr.astype(np.int64)
+        sparse.indices = indices
+        sparse.values = values
+        sparse.positions = positions
+        sparse.rows = np.repeat(np.arange(len(sparse)),
+                                np.diff(sparse.indptr))
+        return sparse
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def _query_vectors(self, profile, profile_ranking):
+        """
+        Build the dense vectors of a profile over the vocabulary.
+
+        Topics of the profile which are not in the vocabulary are
+        ignored, since no cmp_profile discussed them.
+
+        Args:
+            profile: the profile, where each topic is associated with
+                its percentage of discussions over all discussions
+            profile_ranking: the normalized ranking of profile
+
+        Returns:
+            a tuple with a boolean vector telling which topics are
+            discussed by profile, a vector with their percentages and a
+            vector with their normalized positions
+        """
+        size = len(self.vocabulary)
+        mask = np.zeros(size, dtype=bool)
+        values = np.zeros(size, dtype=np.float64)
+        positions = np.zeros(size, dtype=np.float64)
+        for topic, value in profile.items():
+            column = self.vocabulary.get(topic)
+            if column is not None:
+                mask[column] = True
+                values[column] = value
+                positions[column] = profile_ranking[topic]
+        return mask, values, positions
+
+    def match_values(self, profile, profile_ranking):
+        """
+        Compute the match_values of both the algorithms.
+
+        Args:
+            profile: the profile, where each topic is associated with
+                its percentage of discussions over all discussions
+            profile_ranking: the normalized ranking of profile
+
+        Returns:
+            a tuple with the arrays of the match_values of algorithm1
+            and algorithm2 for each cmp_profile
+        """
+        mask, values, positions = self._query_vectors(
+            profile, profile_ranking)
+        # keep only the stored values of the topics shared with profile
+        shared = mask[self.indices]
+        columns = self.indices[shared]
+        rows = self.rows[shared]
+        cmp_values = self.values[shared]
+        cmp_positions = self.positions[shared]
+        values = values[columns]
+        positions = positions[columns]
+
+        lowest = np.minimum(values, cmp_values)
+        sims1 = np.exp(-((values - cmp_values) ** 2) / 1000) * lowest
+        sims2 = np.exp(-((2 * np.abs(positions - cmp_positions)) ** 2)) \
+            * lowest
+        match_values1 = np.bincount(rows, weights=sims1, minlength=len(self))
+        match_values2 = np.bincount(rows, weights=sims2, minlength=len(self))
+        return match_values1, match_values2
+
+
+def get_best_match(match_values):
+    """
+    Find the index of the highest match_value.
+
+    Args:
+        match_values: array of match_values
+
+    Returns:
+        the index of the first highest value, or None if no value is
+        greater than 0
+    """
+    if not len(match_values):
+        return None
+    best_match_id = int(np.argmax(match_values))
+    if not match_values[best_match_id] > 0:
+        return None
+    return best_match_id
+
+
+def match(profile, profile_ranking, sparse_corpus):
+    """
+    Find the profile in sparse_corpus which is most similar to profile
+    with both the algorithms.
+
+    Args:
+        profile: the profile for which to find the most similar one.
+            Each topic should be associated with its percentage of
+            discussions over all discussions
+        profile_ranking: the normalized ranking of profile
+        sparse_corpus: the SparseCorpus of the cmp_profiles
+
+    Returns:
+        a list with a tuple for each of the algorithms, with the index
+        of the cmp_profile most similar to profile and a list with the
+        similarity values for each profile
+    """
+    results = []
+    for match_values in sparse_corpus.match_values(profile, profile_ranking):
+        results.append((get_best_match(match_values), match_values.tolist()))
+    return results
@@ -0,0 +1,21 @@
+"""
+Contains helpers for the pools of worker processes.
+"""
+import multiprocessing
+
+
+def get_context():
+    """
+    Get the multiprocessing context used for the pools of workers.
+
+    Forked workers inherit the memory of the parent process, so large 
+    objects like the corpus are shared instead of being copied to each 
+    worker. Where fork is not available, the default start method is 
+    used.
+
+    Returns:
+        the multiprocessing context
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()